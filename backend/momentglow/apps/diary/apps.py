@@ -5,3 +5,6 @@ class DiaryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'momentglow.apps.diary'
     verbose_name = '日记管理'
+
+    def ready(self):
+        from . import signals  # noqa: F401
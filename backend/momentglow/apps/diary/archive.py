@@ -0,0 +1,270 @@
+"""
+日记的导出与导入
+
+导出文件是一个 zip：diaries.ndjson 每行一篇日记（含标签名与图片在包内的路径），
+images/ 下是日记图片的原图，manifest.json 记录格式版本与篇数。导出边查询边写入，
+日记按块迭代读取，zip 以数据描述符方式写入不可回退的流，每写完一块就交给
+StreamingHttpResponse 发送，内存占用与日记数量无关。
+
+导入接受上述 zip 或单独的 NDJSON 文件，按块用 bulk_create 写入日记、标签、
+标签关联与图片。bulk_create 不触发信号，计数、标签使用次数、统计、全文索引、
+公开日记流缓存与图片处理在这里显式更新。导入的日记保留 created_at，updated_at 为导入时间，
+增量同步的客户端因此能收到它们。
+"""
+import json
+import os
+import zipfile
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, router, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+
+from . import counters, images, search, stats
+from .models import Diary, DiaryImage, Tag
+from .signals import feed_state, invalidate_feed
+from .tags import get_or_create_tags, normalize, record_usage
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    # 导入时跳过超过该大小的图片
+    'MAX_IMAGE_SIZE': 20 * 1024 * 1024,
+}
+FORMAT_VERSION = 1
+DIARIES_ENTRY = 'diaries.ndjson'
+MANIFEST_ENTRY = 'manifest.json'
+IMAGES_DIR = 'images/'
+# 导入时接受的图片格式与保存时使用的扩展名
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# 流式写出的块大小
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DIARY_ARCHIVE', {})}
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class StreamBuffer:
+    """只追加的写缓冲，ZipFile 写入后由 pop() 取走已写出的字节"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def diary_record(diary):
+    return {
+        'id': diary.pk,
+        'title': diary.title,
+        'content': diary.content,
+        'mood': diary.mood,
+        'weather': diary.weather,
+        'location': diary.location,
+        'is_public': diary.is_public,
+        'created_at': diary.created_at.isoformat(),
+        'updated_at': diary.updated_at.isoformat(),
+        'tags': [tag.name for tag in diary.tags.all()],
+        'images': [IMAGES_DIR + image.image.name for image in diary.images.all()],
+    }
+
+
+def export_archive(user):
+    """逐块生成用户全部日记的 zip 内容"""
+    chunk_size = get_config()['CHUNK_SIZE']
+    diaries = Diary.objects.filter(user=user).order_by('created_at', 'id').prefetch_related(
+        'tags', Prefetch('images', DiaryImage.objects.only('id', 'diary_id', 'image').order_by('created_at', 'id'))
+    )
+    buffer = StreamBuffer()
+    image_names = {}
+    count = 0
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        # 同时只能打开一个写入句柄，图片在日记之后写入，只记住路径
+        with archive.open(DIARIES_ENTRY, 'w', force_zip64=True) as entry:
+            for diary in diaries.iterator(chunk_size=chunk_size):
+                entry.write(dumps(diary_record(diary)) + b'\n')
+                for image in diary.images.all():
+                    image_names[image.image.name] = None
+                count += 1
+                if count % chunk_size == 0:
+                    yield buffer.pop()
+        yield buffer.pop()
+
+        for name in image_names:
+            if not default_storage.exists(name):
+                continue
+            info = zipfile.ZipInfo(IMAGES_DIR + name, date_time=timezone.localtime().timetuple()[:6])
+            # 图片本身已压缩，原样存储
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = default_storage.size(name)
+            with default_storage.open(name) as source, archive.open(info, 'w') as entry:
+                for chunk in source.chunks(COPY_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.pop()
+
+        archive.writestr(MANIFEST_ENTRY, dumps({
+            'version': FORMAT_VERSION,
+            'exported_at': timezone.now().isoformat(),
+            'diaries': count,
+            'images': len(image_names),
+        }))
+    yield buffer.pop()
+
+
+def export_filename(user):
+    return f'momentglow-{user.username}-{timezone.localdate():%Y%m%d}.zip'
+
+
+class DiaryRecordSerializer(serializers.ModelSerializer):
+    """导入文件中的一行"""
+    created_at = serializers.DateTimeField(required=False)
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=Tag._meta.get_field('name').max_length), required=False
+    )
+    images = serializers.ListField(child=serializers.CharField(), required=False)
+
+    class Meta:
+        model = Diary
+        fields = ['title', 'content', 'mood', 'weather', 'location', 'is_public', 'created_at', 'tags', 'images']
+
+
+def open_records(upload):
+    """返回 (NDJSON 行的可迭代对象, zip 或 None)"""
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        archive = zipfile.ZipFile(upload)
+        if DIARIES_ENTRY not in archive.namelist():
+            raise serializers.ValidationError({'file': f'压缩包中缺少 {DIARIES_ENTRY}'})
+        return archive.open(DIARIES_ENTRY), archive
+    upload.seek(0)
+    return upload, None
+
+
+def iter_records(lines):
+    # 复用同一个序列化器实例，字段只构建一次
+    validator = DiaryRecordSerializer()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise serializers.ValidationError({'line': number, 'errors': '不是有效的 JSON'})
+        try:
+            yield validator.run_validation(data)
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({'line': number, 'errors': exc.detail})
+
+
+def store_image(archive, path, saved):
+    """把包内的图片写入存储，返回存储中的文件名；图片缺失、过大或不是允许的图片格式时返回 None"""
+    if path not in saved:
+        saved[path] = None
+        info = archive.NameToInfo.get(path) if archive is not None else None
+        if info is not None and info.file_size <= get_config()['MAX_IMAGE_SIZE']:
+            with archive.open(info) as source:
+                ext = detect_image(source)
+                if ext is not None:
+                    source.seek(0)
+                    field = DiaryImage._meta.get_field('image')
+                    # 扩展名取自检测到的格式，不信任包内的文件名
+                    saved[path] = default_storage.save(
+                        field.generate_filename(None, f'image.{ext}'), File(source)
+                    )
+    return saved[path]
+
+
+def detect_image(source):
+    """校验文件确为允许的图片格式，返回对应的扩展名，否则返回 None"""
+    try:
+        with Image.open(source) as image:
+            fmt = image.format
+            image.verify()
+    except Exception:
+        return None
+    return IMAGE_EXTENSIONS.get(fmt)
+
+
+def import_chunk(user, records, archive, saved, using):
+    image_names = [
+        [name for name in (store_image(archive, path, saved) for path in record.get('images', [])) if name]
+        for record in records
+    ]
+    diaries = Diary.objects.using(using).bulk_create([
+        Diary(
+            user=user, title=record['title'], content=record['content'],
+            mood=record.get('mood', ''), weather=record.get('weather', ''),
+            location=record.get('location', ''), is_public=record.get('is_public', False),
+            image_count=len(names), **({'created_at': record['created_at']} if record.get('created_at') else {}),
+        )
+        for record, names in zip(records, image_names)
+    ])
+
+    tags = get_or_create_tags((name for record in records for name in record.get('tags', [])), using)
+    through = Diary.tags.through
+    links = through.objects.using(using).bulk_create([
+        through(diary_id=diary.pk, tag_id=tags[name].pk)
+        for diary, record in zip(diaries, records)
+        for name in normalize(record.get('tags', []))
+    ])
+    # 导入的是旧日记，只计入使用次数，不抬高热度
+    record_usage(Counter(link.tag_id for link in links), using, trending=False)
+
+    diary_images = DiaryImage.objects.using(using).bulk_create([
+        DiaryImage(diary=diary, image=name)
+        for diary, names in zip(diaries, image_names)
+        for name in names
+    ])
+    for image in diary_images:
+        images.schedule(image)
+
+    search.index_rows(connections[using], [(diary.pk, diary.title, diary.content) for diary in diaries])
+    invalidate_feed([feed_state(diary) for diary in diaries], using)
+    return Counter(
+        diaries=len(diaries), public=sum(diary.is_public for diary in diaries), images=len(diary_images),
+    )
+
+
+def import_archive(user, upload):
+    """导入 zip 或 NDJSON 文件，任一行无效时整体回滚；返回导入的日记与图片数"""
+    using = router.db_for_write(Diary)
+    lines, archive = open_records(upload)
+    records = iter_records(lines)
+    totals = Counter(diaries=0, public=0, images=0)
+    # 同一文件在包内只写入存储一次
+    saved = {}
+    with transaction.atomic(using=using):
+        while chunk := list(islice(records, get_config()['CHUNK_SIZE'])):
+            totals += import_chunk(user, chunk, archive, saved, using)
+        counters.adjust_user(user.pk, using, diary_count=totals['diaries'], public_diary_count=totals['public'])
+        if totals['diaries']:
+            stats.rebuild(using, user_ids=[user.pk])
+    return {'diaries': totals['diaries'], 'images': totals['images']}
@@ -0,0 +1,117 @@
+"""
+公开日记流与日记详情的异步视图
+
+查询集、过滤、分页器、序列化器和验证器都沿用 DiaryViewSet 的实现，
+只把查询数据库的步骤换成异步 ORM。日记详情的修改、删除仍由同步的
+DiaryViewSet 处理。
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import permissions, status
+
+from momentglow.conditional import has_validators
+from momentglow.views_base import AsyncAPIView
+from .feed_cache import public_feed_cache
+from .pagination import DiaryKeysetPagination, apaginate_queryset
+from .versions import aquery_versions
+from .views import DiaryViewSet
+
+
+class AsyncDiaryView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    # 对应的 DiaryViewSet 动作，决定查询集与序列化器
+    action = None
+    # 请求指标与同步实现记在同一个视图名下
+    metrics_name = 'DiaryViewSet'
+
+    def get_viewset(self):
+        return DiaryViewSet(
+            request=self.request, args=self.args, kwargs=self.kwargs,
+            format_kwarg=self.format_kwarg, action=self.action, headers={},
+        )
+
+
+class PublicDiaryFeedView(AsyncDiaryView):
+    permission_classes = [permissions.AllowAny]
+    action = 'public'
+
+    async def get(self, request):
+        viewset = self.get_viewset()
+        # 前几页命中缓存时直接返回，不查询数据库；页面的版本信息随数据一起缓存
+        cache_key = await public_feed_cache.akey_for(request)
+        if cache_key is not None:
+            cached = await public_feed_cache.aget(cache_key)
+            if cached is not None:
+                return viewset.cached_page_response(cached)
+        started_at = time.perf_counter()
+
+        queryset = viewset.filter_queryset(viewset.get_public_queryset())
+        if has_validators(request):
+            response = viewset.not_modified_page(await self.query_page_versions(viewset, queryset), private=False)
+            if response is not None:
+                return response
+        page = await apaginate_queryset(viewset.paginator, queryset, request)
+        response, page_versions = viewset.serialize_page(page, private=False)
+        if cache_key is not None and response.status_code == status.HTTP_200_OK:
+            await public_feed_cache.aset(cache_key, (response.data, page_versions), started_at)
+        return response
+
+    async def query_page_versions(self, viewset, queryset):
+        """DiaryViewSet.query_page_versions() 的异步版本"""
+        paginator = viewset.paginator
+        if isinstance(paginator, DiaryKeysetPagination):
+            page_queryset = paginator.get_page_queryset(queryset, paginator.decode_cursor(self.request))
+            versions = await aquery_versions(page_queryset)
+            return len(versions) > paginator.page_size, versions[:paginator.page_size]
+        page_size = paginator.get_page_size(self.request)
+        try:
+            number = int(self.request.query_params.get(paginator.page_query_param, 1))
+        except ValueError:
+            return None
+        if number < 1:
+            return None
+        count = await queryset.acount()
+        offset = (number - 1) * page_size
+        if number > 1 and offset >= count:
+            return None
+        return count, await aquery_versions(queryset[offset:offset + page_size])
+
+
+class DiaryDetailView(AsyncDiaryView):
+    action = 'retrieve'
+
+    async def get(self, request, pk):
+        viewset = self.get_viewset()
+        queryset = viewset.filter_queryset(viewset.get_queryset()).filter(pk=pk)
+        # 携带验证器时先只查询版本信息，未变化则不加载评论、图片，也不序列化
+        if has_validators(request):
+            response = viewset.not_modified_diary(await aquery_versions(queryset))
+            if response is not None:
+                return response
+        diary = await queryset.afirst()
+        if diary is None:
+            raise Http404
+        viewset.check_object_permissions(request, diary)
+        return viewset.diary_response(diary)
+
+
+def diary_detail_view():
+    """GET/HEAD 由异步视图处理，其余方法交给同步的 DiaryViewSet"""
+    async_view = DiaryDetailView.as_view()
+    sync_view = sync_to_async(DiaryViewSet.as_view({
+        'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+    }))
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+
+    # 供请求指标解析视图名与动作
+    view.cls = DiaryViewSet
+    view.actions = {'get': 'retrieve', 'head': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+    return view
@@ -0,0 +1,65 @@
+"""
+冗余计数字段的维护
+
+Diary.comment_count / image_count 与 CustomUser.diary_count / public_diary_count
+在评论、图片、日记增删时由 signals 以 F 表达式原子地增减，不需要先读出旧值。
+bulk_create、QuerySet.update() 等绕过信号的写入会造成偏差，可运行
+``python manage.py repair_counters`` 按实际行数重算。
+"""
+from django.db.models import F, IntegerField, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce, Greatest
+
+from momentglow.apps.user.models import CustomUser
+from .models import Comment, Diary, DiaryImage
+
+
+def adjust(queryset, **deltas):
+    """按增量更新计数字段，减少时不低于 0；返回更新的行数"""
+    values = {
+        field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items() if delta
+    }
+    return queryset.update(**values) if values else 0
+
+
+def adjust_diary(diary_id, using, **deltas):
+    adjust(Diary.objects.using(using).filter(pk=diary_id), **deltas)
+
+
+def adjust_user(user_id, using, **deltas):
+    adjust(CustomUser.objects.using(using).filter(pk=user_id), **deltas)
+
+
+def count_of(queryset, field):
+    """统计 queryset 中 field 指向外层行的行数"""
+    counts = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def actual_counts():
+    """各计数字段对应的实际值表达式，按模型分组"""
+    return {
+        Diary: {
+            'comment_count': count_of(Comment.objects.all(), 'diary'),
+            'image_count': count_of(DiaryImage.objects.all(), 'diary'),
+        },
+        CustomUser: {
+            'diary_count': count_of(Diary.objects.all(), 'user'),
+            'public_diary_count': count_of(Diary.objects.filter(is_public=True), 'user'),
+        },
+    }
+
+
+def repair(using='default', dry_run=False):
+    """重算计数字段，返回 {(模型名, 字段): 偏差行数}"""
+    drift = {}
+    for model, expressions in actual_counts().items():
+        for field, expression in expressions.items():
+            rows = model.objects.using(using).annotate(actual=expression).exclude(**{field: F('actual')})
+            pks = list(rows.values_list('pk', flat=True))
+            drift[(model.__name__, field)] = len(pks)
+            if pks and not dry_run:
+                model.objects.using(using).filter(pk__in=pks).update(**{field: expression})
+    return drift
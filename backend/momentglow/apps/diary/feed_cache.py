@@ -0,0 +1,164 @@
+"""
+公开日记流缓存
+
+缓存公开日记流前 N 页的序列化结果，包括按 user_id、mood 过滤的变体。
+每个 (user_id, mood) 变体有独立的版本号，日记、评论、图片或标签变更时只
+更新受影响的四个变体（不过滤、仅作者、仅心情、作者加心情）的版本号，
+旧版本的缓存自然失效。命中率和重建耗时计入缓存中的计数器。
+以 a 开头的方法供异步视图使用，通过缓存后端的异步接口读写。
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    # 缓存的页数（页码分页的第 1~N 页，游标分页只缓存首页）
+    'PAGES': 3,
+    'TIMEOUT': 300,
+}
+CACHEABLE_PARAMS = {'page', 'user_id', 'mood', 'cursor'}
+KEY_PREFIX = 'public_feed'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PUBLIC_FEED_CACHE', {})}
+
+
+def _digest(*parts):
+    return hashlib.md5('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class PublicFeedCache:
+    stat_names = ('hits', 'misses', 'rebuilds', 'rebuild_us_total', 'invalidations')
+
+    @property
+    def cache(self):
+        return caches[get_config()['CACHE_ALIAS']]
+
+    def key_params(self, request):
+        """返回请求的 (mode, page, user_id, mood)，不可缓存的请求返回 None"""
+        params = request.query_params
+        if not set(params) <= CACHEABLE_PARAMS:
+            return None
+        if 'cursor' in params:
+            if params['cursor'] or 'page' in params:
+                return None
+            mode, page = 'cursor', 1
+        else:
+            mode = 'page'
+            try:
+                page = int(params.get('page', 1))
+            except ValueError:
+                return None
+            if not 1 <= page <= get_config()['PAGES']:
+                return None
+        return mode, page, params.get('user_id') or '', params.get('mood') or ''
+
+    def page_key(self, request, generation, mode, page, user_id, mood):
+        # 分页链接是绝对地址，不同 host 需要分开缓存
+        host = request.build_absolute_uri('/')
+        return f'{KEY_PREFIX}:page:{_digest(generation, mode, page, user_id, mood, host)}'
+
+    def key_for(self, request):
+        """返回请求对应的缓存键，不可缓存的请求返回 None"""
+        params = self.key_params(request)
+        if params is None:
+            return None
+        return self.page_key(request, self.get_generation(*params[2:]), *params)
+
+    async def akey_for(self, request):
+        params = self.key_params(request)
+        if params is None:
+            return None
+        return self.page_key(request, await self.aget_generation(*params[2:]), *params)
+
+    def generation_key(self, user_id, mood):
+        return f'{KEY_PREFIX}:gen:{_digest(user_id, mood)}'
+
+    def get_generation(self, user_id, mood):
+        key = self.generation_key(user_id, mood)
+        generation = self.cache.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not self.cache.add(key, generation, None):
+                generation = self.cache.get(key, generation)
+        return generation
+
+    async def aget_generation(self, user_id, mood):
+        key = self.generation_key(user_id, mood)
+        generation = await self.cache.aget(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not await self.cache.aadd(key, generation, None):
+                generation = await self.cache.aget(key, generation)
+        return generation
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self.incr('hits' if data is not None else 'misses')
+        return data
+
+    async def aget(self, key):
+        data = await self.cache.aget(key)
+        await self.aincr('hits' if data is not None else 'misses')
+        return data
+
+    def set(self, key, data, started_at):
+        """写入缓存并记录从 started_at（time.perf_counter 取值）起的重建耗时"""
+        elapsed_us = int((time.perf_counter() - started_at) * 1000000)
+        self.cache.set(key, data, get_config()['TIMEOUT'])
+        self.incr('rebuilds')
+        self.incr('rebuild_us_total', elapsed_us)
+
+    async def aset(self, key, data, started_at):
+        elapsed_us = int((time.perf_counter() - started_at) * 1000000)
+        await self.cache.aset(key, data, get_config()['TIMEOUT'])
+        await self.aincr('rebuilds')
+        await self.aincr('rebuild_us_total', elapsed_us)
+
+    def invalidate(self, user_id, mood):
+        """使包含该作者、该心情日记的全部变体失效"""
+        user_id = str(user_id) if user_id else ''
+        mood = mood or ''
+        variants = {('', ''), (user_id, ''), ('', mood), (user_id, mood)}
+        self.cache.set_many(
+            {self.generation_key(u, m): uuid.uuid4().hex for u, m in variants}, None
+        )
+        self.incr('invalidations')
+
+    def incr(self, name, delta=1):
+        key = f'{KEY_PREFIX}:stat:{name}'
+        try:
+            self.cache.incr(key, delta)
+        except ValueError:
+            if not self.cache.add(key, delta, None):
+                self.cache.incr(key, delta)
+
+    async def aincr(self, name, delta=1):
+        key = f'{KEY_PREFIX}:stat:{name}'
+        try:
+            await self.cache.aincr(key, delta)
+        except ValueError:
+            if not await self.cache.aadd(key, delta, None):
+                await self.cache.aincr(key, delta)
+
+    def stats(self):
+        keys = {f'{KEY_PREFIX}:stat:{name}': name for name in self.stat_names}
+        values = {keys[key]: value for key, value in self.cache.get_many(keys).items()}
+        stats = {name: values.get(name, 0) for name in self.stat_names}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['avg_rebuild_ms'] = (
+            round(stats['rebuild_us_total'] / stats['rebuilds'] / 1000, 3) if stats['rebuilds'] else None
+        )
+        return stats
+
+    def reset_stats(self):
+        self.cache.delete_many([f'{KEY_PREFIX}:stat:{name}' for name in self.stat_names])
+
+
+public_feed_cache = PublicFeedCache()
@@ -0,0 +1,168 @@
+"""
+日记图片后台处理
+
+上传请求只保存原图，事务提交后把图片 id 交给进程内线程池：
+按 EXIF 方向摆正并去除 EXIF（其中可能含有拍摄位置），记录宽高，
+再按固定宽度生成 WebP 与 JPEG 缩略图。进程重启时队列中的任务会丢失，
+可用 ``python manage.py process_diary_images`` 补处理未完成的图片。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import ExifTags, Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WIDTHS': (320, 640, 1280),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    # 同步处理，便于测试和没有常驻进程的环境
+    'SYNC': False,
+}
+FORMAT_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+VARIANT_DIR = 'diary_images/variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DIARY_IMAGE_PIPELINE', {})}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_config()['WORKERS'], thread_name_prefix='diary-image'
+            )
+    return _executor
+
+
+def schedule(image):
+    """在当前事务提交后处理图片"""
+    image_id = image.pk
+    if get_config()['SYNC']:
+        transaction.on_commit(lambda: run(image_id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_in_worker, image_id))
+
+
+def run_in_worker(image_id):
+    """线程池任务入口，工作线程复用各自的数据库连接，前后清理失效连接"""
+    close_old_connections()
+    try:
+        run(image_id)
+    finally:
+        close_old_connections()
+
+
+def run(image_id):
+    """处理单张图片，失败时标记状态而不抛出异常"""
+    from .models import DiaryImage
+
+    try:
+        image = DiaryImage.objects.filter(pk=image_id).first()
+        if image is not None:
+            process(image)
+    except Exception:
+        logger.exception('处理日记图片 %s 失败', image_id)
+        DiaryImage.objects.filter(pk=image_id).update(processing_status=DiaryImage.STATUS_FAILED)
+
+
+def _encode(image, fmt, **options):
+    buffer = BytesIO()
+    if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format=fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def strip_original(image):
+    """去除原图 EXIF 并按方向摆正，返回 (处理后的 PIL 图像, 新文件内容)"""
+    storage = image.image.storage
+    with storage.open(image.image.name, 'rb') as f:
+        source = Image.open(f)
+        source.load()
+    fmt = (source.format or 'JPEG').lower()
+    if fmt == 'gif' and getattr(source, 'is_animated', False):
+        # 动图重新编码会丢帧，原样保留
+        return source, None
+    options = {}
+    if source.getexif().get(ExifTags.Base.Orientation, 1) == 1:
+        upright = source
+        if fmt == 'jpeg':
+            # 无需旋转时沿用原量化表，避免二次压缩损失
+            options['quality'] = 'keep'
+    else:
+        upright = ImageOps.exif_transpose(source)
+        if fmt == 'jpeg':
+            options['quality'] = 95
+    # 不传 exif 参数即不写入 EXIF
+    return upright, _encode(upright, fmt, **options)
+
+
+def process(image):
+    """生成缩略图并回写宽高与变体信息"""
+    config = get_config()
+    original, stripped = strip_original(image)
+    storage = image.image.storage
+    update_fields = ['width', 'height', 'variants', 'processing_status', 'updated_at']
+    if stripped is not None:
+        name = image.image.name
+        storage.delete(name)
+        saved_name = storage.save(name, ContentFile(stripped))
+        if saved_name != name:
+            image.image.name = saved_name
+            update_fields.append('image')
+
+    if original.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        original = original.convert('RGBA')
+
+    delete_variants(image)
+    variants = []
+    for width in sorted(config['WIDTHS']):
+        if width >= original.width:
+            break
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for fmt in config['FORMATS']:
+            content = _encode(resized, fmt, quality=config['QUALITY'])
+            name = storage.save(
+                f'{VARIANT_DIR}/{image.pk}/{width}.{FORMAT_EXTENSIONS[fmt]}', ContentFile(content)
+            )
+            variants.append({'width': width, 'format': fmt, 'name': name})
+
+    image.width = original.width
+    image.height = original.height
+    image.variants = variants
+    image.processing_status = image.STATUS_READY
+    image.save(update_fields=update_fields)
+    return image
+
+
+def delete_variants(image):
+    storage = image.image.storage
+    for variant in image.variants or []:
+        storage.delete(variant['name'])
+
+
+def build_srcset(image, fmt, build_url):
+    """拼接 <img srcset>，原图作为最大宽度的候选；build_url 由存储中的文件名生成地址"""
+    candidates = [
+        f"{build_url(variant['name'])} {variant['width']}w"
+        for variant in image.variants or [] if variant['format'] == fmt
+    ]
+    if not candidates:
+        return ''
+    if image.width:
+        candidates.append(f'{build_url(image.image.name)} {image.width}w')
+    return ', '.join(candidates)
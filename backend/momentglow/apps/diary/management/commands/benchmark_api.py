@@ -0,0 +1,377 @@
+"""
+API 基准测试
+
+默认新建测试数据库（只读副本作为其镜像），按固定随机种子生成合成数据：N 个用户、每人 M 篇日记，
+标签按 Zipf 分布取用，评论数呈长尾分布并带楼中楼回复，图片 0~4 张。随后在进程内
+用测试客户端经过完整的中间件与 URL 路由请求各接口，统计延迟的 p50/p95/p99、
+每个请求的查询次数和响应字节数。
+
+--use-current-db 时改在当前数据库的事务中生成数据并在结束后回滚。
+--output 把结果保存为 JSON；--baseline 与之前保存的结果比较，p95 延迟或响应大小
+超出 --threshold 比例、或查询次数增加时以非零状态退出，可用于在合并前拦截性能回退。
+同一数据规模与种子下查询次数和响应大小是确定的，延迟受机器负载影响，应在同一台
+机器上比较。
+"""
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from momentglow.apps.diary import counters, stats, tags
+from momentglow.apps.diary.models import Comment, Diary, DiaryImage, Tag
+from momentglow.apps.user.models import CustomUser
+
+MOODS = ('happy', 'sad', 'angry', 'calm', 'excited', 'anxious', 'tired')
+WEATHER = ('sunny', 'cloudy', 'overcast', 'light-rain', 'heavy-rain', 'snow', 'fog')
+PASSWORD = 'benchmark-pass-123'
+PARAGRAPH = '<p>今天早上出门时天气很好，路过公园看到有人在放风筝，想起了小时候的事情。</p>'
+# 每篇日记的图片数与权重
+IMAGE_COUNTS = ((0, 50), (1, 20), (2, 15), (3, 10), (4, 5))
+# 回复已有评论的比例与最多的回复层级
+REPLY_RATIO = 0.3
+REPLY_LEVELS = 3
+MAX_COMMENTS = 200
+PAGE_SIZE = api_settings.PAGE_SIZE or 10
+
+
+class Dataset:
+    """生成的数据中供各场景抽样的对象"""
+
+    def __init__(self, users, own_diaries, public_diaries, commented_diaries):
+        self.users = users
+        self.own_diaries = own_diaries
+        self.public_diaries = public_diaries
+        self.commented_diaries = commented_diaries
+        self.tokens = {user.pk: f'Bearer {AccessToken.for_user(user)}' for user in users}
+
+
+def generate(users, diaries_per_user, tag_count, seed, batch_size=500):
+    rng = random.Random(seed)
+    now = timezone.now()
+    # 密码哈希很慢，所有用户共用同一个哈希
+    password = make_password(PASSWORD)
+    people = CustomUser.objects.bulk_create([
+        CustomUser(username=f'bench{i}', email=f'bench{i}@example.com', password=password, bio='记录生活')
+        for i in range(users)
+    ], batch_size=batch_size)
+    tag_objects = Tag.objects.bulk_create([Tag(name=f'基准标签{i}') for i in range(tag_count)])
+    tag_weights = [1 / (rank + 1) for rank in range(tag_count)]
+
+    diaries = Diary.objects.bulk_create([
+        Diary(
+            user=user, title=f'{user.username} 的第 {i} 篇日记', content=PARAGRAPH * rng.randint(1, 20),
+            mood=rng.choice(MOODS), weather=rng.choice(WEATHER), location=rng.choice(('', '上海', '杭州')),
+            is_public=rng.random() < 0.6, created_at=now - timedelta(seconds=rng.randrange(365 * 86400)),
+        )
+        for user in people for i in range(diaries_per_user)
+    ], batch_size=batch_size)
+
+    through = Diary.tags.through
+    links = []
+    for diary in diaries:
+        chosen = set(rng.choices(tag_objects, tag_weights, k=rng.randint(0, 5))) if tag_objects else ()
+        links += [through(diary_id=diary.pk, tag_id=tag.pk) for tag in chosen]
+    through.objects.bulk_create(links, batch_size=batch_size)
+
+    counts, weights = zip(*IMAGE_COUNTS)
+    DiaryImage.objects.bulk_create([
+        DiaryImage(diary=diary, image=f'diary_images/bench/{diary.pk}_{i}.jpg', width=1280, height=960,
+                   processing_status=DiaryImage.STATUS_READY)
+        for diary in diaries for i in range(rng.choices(counts, weights)[0])
+    ], batch_size=batch_size)
+
+    generate_comments(rng, diaries, people, batch_size)
+
+    using = connection.alias
+    counters.repair(using)
+    stats.rebuild(using)
+    tags.rebuild_usage(using)
+    call_command('rebuild_search_index', stdout=StringIO(), stderr=StringIO())
+
+    commented = Diary.objects.filter(
+        user__in=people, is_public=True, comment_count__gt=0
+    ).order_by('-comment_count').values_list('pk', flat=True)[:20]
+    return Dataset(
+        people,
+        {user.pk: [diary.pk for diary in diaries if diary.user_id == user.pk] for user in people},
+        [diary.pk for diary in diaries if diary.is_public],
+        list(commented),
+    )
+
+
+def generate_comments(rng, diaries, people, batch_size):
+    """评论数服从帕累托分布，少数日记评论很多；回复逐层插入，插入后按主键写入路径"""
+    roots = [
+        Comment(diary=diary, user=rng.choice(people), content=f'评论 {i}')
+        for diary in diaries for i in range(min(int(rng.paretovariate(1.2)) - 1, MAX_COMMENTS))
+    ]
+    level = create_comments(roots, batch_size)
+    for _ in range(REPLY_LEVELS):
+        replies = [
+            Comment(diary_id=parent.diary_id, parent=parent, depth=parent.depth + 1,
+                    user=rng.choice(people), content='回复')
+            for parent in level if rng.random() < REPLY_RATIO
+        ]
+        if not replies:
+            break
+        level = create_comments(replies, batch_size)
+
+
+def create_comments(comments, batch_size):
+    # bulk_create 不调用 Comment.save()，路径在这里补上
+    Comment.objects.bulk_create(comments, batch_size=batch_size)
+    for comment in comments:
+        comment.path = (comment.parent.path if comment.parent_id else '') + Comment.path_segment(comment.pk)
+    Comment.objects.bulk_update(comments, ['path'], batch_size=batch_size)
+    return comments
+
+
+def scenarios(dataset):
+    """场景名 -> (请求次数系数, 由随机数生成器构造请求参数的函数)"""
+    def auth(rng):
+        user = rng.choice(dataset.users)
+        return user, {'HTTP_AUTHORIZATION': dataset.tokens[user.pk]}
+
+    def pages(count, limit):
+        return min(limit, max(1, math.ceil(count / PAGE_SIZE)))
+
+    def diaries_list(rng):
+        user, headers = auth(rng)
+        return 'get', '/api/diaries/', {'page': rng.randint(1, pages(len(dataset.own_diaries[user.pk]), 3))}, headers
+
+    def diaries_list_cursor(rng):
+        user, headers = auth(rng)
+        return 'get', '/api/diaries/', {'cursor': ''}, headers
+
+    def diaries_public(rng):
+        page = rng.randint(1, pages(len(dataset.public_diaries), 5))
+        return 'get', '/api/diaries/public/', {'page': page}, auth(rng)[1]
+
+    def diaries_public_mood(rng):
+        return 'get', '/api/diaries/public/', {'mood': rng.choice(MOODS), 'cursor': ''}, auth(rng)[1]
+
+    def diaries_retrieve(rng):
+        user, headers = auth(rng)
+        own = dataset.own_diaries[user.pk]
+        return 'get', f'/api/diaries/{rng.choice(own)}/', {}, headers
+
+    def comments_list(rng):
+        return 'get', '/api/diaries/comments/', {'diary': rng.choice(dataset.commented_diaries)}, auth(rng)[1]
+
+    def users_login(rng):
+        user = rng.choice(dataset.users)
+        return 'post', '/api/users/login/', {'username': user.username, 'password': PASSWORD}, {}
+
+    def users_profile(rng):
+        return 'get', f'/api/users/profiles/{rng.choice(dataset.users).pk}/', {}, {}
+
+    available = {
+        'diaries.list': (1, diaries_list),
+        'diaries.list.cursor': (1, diaries_list_cursor),
+        'diaries.public': (1, diaries_public),
+        'diaries.public.mood': (1, diaries_public_mood),
+        'diaries.retrieve': (1, diaries_retrieve),
+        'comments.list': (1, comments_list),
+        # 登录主要是密码哈希的耗时，少量请求即可
+        'users.login': (0.1, users_login),
+        'users.profile': (1, users_profile),
+    }
+    # 数据规模太小时去掉无从抽样的场景
+    if not all(dataset.own_diaries.values()):
+        available.pop('diaries.retrieve')
+    if not dataset.commented_diaries:
+        available.pop('comments.list')
+    return available
+
+
+def percentile(values, p):
+    """最近秩法的百分位数，values 已排序"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, queries, sizes, errors):
+    latencies, queries, sizes = sorted(latencies), sorted(queries), sorted(sizes)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'mean': round(statistics.fmean(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries': {'mean': round(statistics.fmean(queries), 2), 'max': queries[-1]},
+        'bytes': {'mean': round(statistics.fmean(sizes), 1), 'max': sizes[-1]},
+    }
+
+
+def compare(results, baseline, threshold):
+    """返回回退说明的列表"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if current['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {previous['latency_ms']['p95']:.1f}ms -> {current['latency_ms']['p95']:.1f}ms"
+            )
+        if current['queries']['max'] > previous['queries']['max']:
+            regressions.append(f"{name}: 查询次数 {previous['queries']['max']} -> {current['queries']['max']}")
+        if current['bytes']['mean'] > previous['bytes']['mean'] * (1 + threshold):
+            regressions.append(f"{name}: 响应大小 {previous['bytes']['mean']:.0f}B -> {current['bytes']['mean']:.0f}B")
+    return regressions
+
+
+def git_revision():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR, timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = '用合成数据在进程内请求各 API，统计延迟分位数、查询次数与响应大小，并可与基线结果比较'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='用户数')
+        parser.add_argument('--diaries', type=int, default=40, help='每个用户的日记数')
+        parser.add_argument('--tags', type=int, default=200, help='标签数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子，决定生成的数据与请求顺序')
+        parser.add_argument('--requests', type=int, default=200, help='每个场景测量的请求数')
+        parser.add_argument('--warmup', type=int, default=20, help='每个场景测量前的预热请求数')
+        parser.add_argument('--scenarios', help='只运行这些场景，逗号分隔')
+        parser.add_argument('--output', help='结果保存为 JSON 文件')
+        parser.add_argument('--baseline', help='与之前保存的结果比较')
+        parser.add_argument('--threshold', type=float, default=0.2, help='p95 延迟与响应大小允许增加的比例')
+        parser.add_argument(
+            '--use-current-db', action='store_true',
+            help='在当前数据库中生成数据，不新建测试数据库，结束后回滚',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        if options['use_current_db']:
+            # 生成的数据在结束后回滚；异步视图的查询回到本线程执行，能读到未提交的数据
+            with transaction.atomic():
+                results = self.run(options)
+                transaction.set_rollback(True)
+        else:
+            # 与测试运行器相同：所有别名都换成测试数据库，只读副本作为其镜像，不会读到当前数据库
+            old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=())
+            try:
+                results = self.run(options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"结果已保存到 {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(self.style.ERROR(line))
+                raise CommandError(f'{len(regressions)} 项指标相对基线回退')
+            self.stdout.write(self.style.SUCCESS('与基线相比没有回退'))
+
+    def run(self, options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            dataset = generate(options['users'], options['diaries'], options['tags'], options['seed'])
+        self.stdout.write(f'已生成数据，用时 {time.perf_counter() - started:.1f}s')
+
+        available = scenarios(dataset)
+        names = options['scenarios'].split(',') if options['scenarios'] else list(available)
+        unknown = set(names) - set(available)
+        if unknown:
+            raise CommandError(f"未知的场景：{', '.join(sorted(unknown))}，可选：{', '.join(available)}")
+
+        for cache in caches.all(initialized_only=True):
+            cache.clear()
+        results = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'dataset': {key: options[key] for key in ('users', 'diaries', 'tags', 'seed')},
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+            },
+            'scenarios': {},
+        }
+        rng = random.Random(options['seed'])
+        client = Client()
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name in names:
+                factor, build = available[name]
+                count = max(1, int(options['requests'] * factor))
+                summary = self.measure(client, build, rng, count, max(0, int(options['warmup'] * factor)))
+                results['scenarios'][name] = summary
+                latency = summary['latency_ms']
+                self.stdout.write(
+                    f"{name:<22} p50={latency['p50']:7.2f}ms p95={latency['p95']:7.2f}ms "
+                    f"p99={latency['p99']:7.2f}ms queries={summary['queries']['mean']:5.1f} "
+                    f"bytes={summary['bytes']['mean']:8.0f} errors={summary['errors']}"
+                )
+        return results
+
+    def measure(self, client, build, rng, count, warmup):
+        latencies, queries, sizes, errors = [], [], [], 0
+        for i in range(warmup + count):
+            method, path, data, headers = build(rng)
+            counter = QueryCounter()
+            with ExitStack() as stack:
+                for conn in connections.all(initialized_only=True):
+                    stack.enter_context(conn.execute_wrapper(counter))
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data, **headers)
+                elapsed = (time.perf_counter() - started) * 1000
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(counter.count)
+            sizes.append(len(response.content))
+            if response.status_code >= 400:
+                errors += 1
+        return summarize(latencies, queries, sizes, errors)
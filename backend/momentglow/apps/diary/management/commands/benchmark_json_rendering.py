@@ -0,0 +1,77 @@
+import timeit
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from momentglow.renderers import FastJSONRenderer
+from momentglow.response import CustomResponse
+
+
+def make_feed_payload(page_size):
+    """构造与 DiarySummarySerializer 输出结构相同的一页公开日记流"""
+    now = timezone.now()
+    results = []
+    for i in range(page_size):
+        created_at = (now - timedelta(hours=i)).isoformat().replace('+00:00', 'Z')
+        user = OrderedDict([
+            ('id', i % 7 + 1), ('username', f'user{i % 7}'), ('email', f'user{i % 7}@example.com'),
+            ('avatar_url', f'http://testserver/media/blobs/ab/cd/{i:064x}.jpg'),
+            ('bio', '记录生活里闪光的瞬间'), ('date_joined', created_at),
+        ])
+        results.append(OrderedDict([
+            ('id', 10000 - i), ('title', f'第{i}篇日记：周末去海边'),
+            ('excerpt', '今天天气很好，我们一早出发去了海边，' * 6 + '...'),
+            ('created_at', created_at), ('updated_at', created_at),
+            ('mood', 'happy'), ('weather', 'sunny'), ('location', '青岛'), ('is_public', True),
+            ('user', user),
+            ('tags', [OrderedDict([('id', j), ('name', f'标签{j}'), ('created_at', created_at)]) for j in range(3)]),
+            ('user_username', user['username']),
+            ('comment_count', i * 3), ('image_count', i % 4),
+            ('cover_image', f'http://testserver/media/blobs/12/34/{i:064x}.webp'),
+        ]))
+    return OrderedDict([
+        ('count', 1000), ('next', 'http://testserver/api/diaries/public/?page=2'),
+        ('previous', None), ('results', results),
+    ])
+
+
+def render_legacy(payload):
+    """原有路径：另建 CustomResponse 包裹数据，再由 DRF 的 JSONRenderer 渲染"""
+    response = Response(payload)
+    response = CustomResponse(data=response.data, code=0, errMsg='', status=response.status_code,
+                              headers=response.headers)
+    return JSONRenderer().render(response.data)
+
+
+def render_fast(payload):
+    """现有路径：就地替换 data，再由 FastJSONRenderer 渲染"""
+    response = Response(payload)
+    response.data = {'code': 0, 'errMsg': '', 'data': response.data}
+    return FastJSONRenderer().render(response.data)
+
+
+class Command(BaseCommand):
+    help = '比较统一响应格式的包裹与 JSON 渲染在原有路径和 orjson 路径上的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', default='10,50', help='每页日记数，逗号分隔')
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        for page_size in [int(size) for size in options['page_sizes'].split(',')]:
+            payload = make_feed_payload(page_size)
+            body = render_fast(payload)
+            if body != render_legacy(payload):
+                self.stderr.write(self.style.WARNING(f'page_size={page_size}: 两条路径的输出不一致'))
+            legacy = min(timeit.repeat(lambda: render_legacy(payload), number=iterations, repeat=3))
+            fast = min(timeit.repeat(lambda: render_fast(payload), number=iterations, repeat=3))
+            self.stdout.write(
+                f'page_size={page_size} bytes={len(body)} '
+                f'legacy={legacy / iterations * 1e6:.1f}us fast={fast / iterations * 1e6:.1f}us '
+                f'speedup={legacy / fast:.2f}x'
+            )
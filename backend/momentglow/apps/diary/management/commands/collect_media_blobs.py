@@ -0,0 +1,61 @@
+import os
+import time
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from momentglow.apps.diary.models import DiaryImage
+from momentglow.apps.user.models import CustomUser
+from momentglow.storage import ContentAddressedStorage
+
+
+def count_references():
+    """统计各 blob 被头像、日记图片原图及其缩略图引用的次数"""
+    references = Counter()
+    avatars = CustomUser.objects.exclude(avatar='').exclude(avatar__isnull=True)
+    references.update(avatars.values_list('avatar', flat=True).iterator())
+    for name, variants in DiaryImage.objects.values_list('image', 'variants').iterator():
+        references[name] += 1
+        references.update(variant['name'] for variant in variants or [])
+    return references
+
+
+class Command(BaseCommand):
+    help = '按引用计数回收媒体目录中不再被头像或日记图片引用的 blob'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int, default=3600,
+            help='只回收超过该时长未被写入的 blob，避免误删尚未提交事务的新上传'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='只统计不删除')
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError('默认存储不是 ContentAddressedStorage，无需回收')
+
+        references = count_references()
+        deadline = time.time() - options['grace_seconds']
+        blobs = shared = collected = freed = 0
+        for name, mtime, size in storage.iter_blobs():
+            blobs += 1
+            if references[name] > 1:
+                shared += 1
+            if references[name] or mtime > deadline:
+                continue
+            collected += 1
+            freed += size
+            if not options['dry_run']:
+                storage.delete_blob(name)
+
+        for path, mtime in storage.iter_tmp_files():
+            if mtime <= deadline and not options['dry_run']:
+                os.remove(path)
+
+        action = '可回收' if options['dry_run'] else '已回收'
+        self.stdout.write(self.style.SUCCESS(
+            f'共 {blobs} 个 blob，其中 {shared} 个被多处引用；'
+            f'{action} {collected} 个，释放 {freed / 1024 / 1024:.2f} MB'
+        ))
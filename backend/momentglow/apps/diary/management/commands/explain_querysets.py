@@ -0,0 +1,109 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from momentglow.apps.diary.models import Comment, DiaryImage, Tag
+from momentglow.apps.diary.pagination import CommentThreadPagination, DiaryKeysetPagination
+from momentglow.apps.diary.views import CommentViewSet, DiaryImageViewSet, DiaryViewSet, TagViewSet
+from momentglow.apps.user.models import CustomUser
+
+# 未使用索引的全表扫描；SQLite 的 "SCAN t USING INDEX" 是按索引顺序读取，不算在内
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)(?!.*\b(USING|VIRTUAL TABLE)\b)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\S+)'),
+}
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+
+
+class Command(BaseCommand):
+    help = '对各视图集实际使用的查询集执行 EXPLAIN，标记全表扫描和额外排序，用于在生产数据副本上检查索引覆盖'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+        parser.add_argument('--user-id', type=int, help='模拟登录用户，默认取第一个用户')
+        parser.add_argument('--mood', default='happy', help='过滤示例中使用的心情')
+        parser.add_argument('--verbose-plan', action='store_true', help='输出完整执行计划')
+        parser.add_argument('--fail-on-scan', action='store_true', help='发现全表扫描时以非零状态退出')
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        vendor = connections[self.using].vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'暂不支持分析 {vendor} 的执行计划')
+
+        user = self.get_user(options['user_id'])
+        scans = 0
+        for label, queryset in self.get_querysets(user, options['mood']):
+            plan = queryset.using(self.using).explain()
+            full_scans = FULL_SCAN_PATTERNS[vendor].findall(plan)
+            sorts = SORT_PATTERNS[vendor].findall(plan)
+            scans += len(full_scans)
+            if full_scans:
+                tables = ', '.join(sorted({match[0] if isinstance(match, tuple) else match for match in full_scans}))
+                self.stdout.write(self.style.ERROR(f'[全表扫描] {label}: {tables}'))
+            elif sorts:
+                self.stdout.write(self.style.WARNING(f'[额外排序] {label}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'[OK] {label}'))
+            if options['verbose_plan'] or full_scans or sorts:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f'发现 {scans} 处全表扫描')
+
+    def get_user(self, user_id):
+        users = CustomUser.objects.using(self.using)
+        user = users.filter(pk=user_id).first() if user_id else users.order_by('pk').first()
+        # 空库也能生成执行计划，过滤条件只需要主键
+        return user or CustomUser(pk=user_id or 1)
+
+    def make_view(self, viewset, action, user, params=None, **kwargs):
+        request = Request(RequestFactory().get('/', params or {}))
+        request.user = user
+        return viewset(action=action, request=request, args=(), kwargs=kwargs, format_kwarg=None)
+
+    def get_querysets(self, user, mood):
+        page_size = DiaryKeysetPagination.page_size
+        paginator = DiaryKeysetPagination()
+        position = (timezone.now() - timedelta(days=30), 2 ** 62)
+
+        view = self.make_view(DiaryViewSet, 'list', user)
+        yield 'DiaryViewSet.list', view.filter_queryset(view.get_queryset())[:page_size]
+        yield 'DiaryViewSet.list (cursor)', paginator.get_page_queryset(
+            view.filter_queryset(view.get_queryset()), position
+        )
+
+        for params in ({}, {'mood': mood}, {'user_id': user.pk}):
+            view = self.make_view(DiaryViewSet, 'public', user, params)
+            queryset = view.filter_queryset(view.get_public_queryset())
+            suffix = ''.join(f' {key}={value}' for key, value in params.items())
+            yield f'DiaryViewSet.public{suffix}', queryset[:page_size]
+            yield f'DiaryViewSet.public{suffix} (cursor)', paginator.get_page_queryset(queryset, position)
+
+        view = self.make_view(DiaryViewSet, 'retrieve', user, pk=1)
+        yield 'DiaryViewSet.retrieve', view.get_queryset().filter(pk=1)
+        yield 'DiaryViewSet.retrieve prefetch images', DiaryImage.objects.filter(diary__in=[1])
+
+        view = self.make_view(TagViewSet, 'diaries', user, pk=1)
+        yield 'TagViewSet.diaries', view.get_diaries_queryset(Tag(pk=1))
+
+        view = self.make_view(CommentViewSet, 'list', user, {'diary': 1})
+        thread_page_size = CommentThreadPagination.page_size
+        yield 'CommentViewSet.list', view.get_thread_queryset(1)[:thread_page_size]
+        yield 'CommentViewSet.list (cursor)', CommentThreadPagination().get_page_queryset(
+            view.get_thread_queryset(1), Comment.path_segment(1)
+        )
+        root = Comment(pk=1, diary_id=1, path=Comment.path_segment(1))
+        yield 'CommentViewSet.thread', view.get_thread_queryset(1, root)[:thread_page_size]
+
+        view = self.make_view(DiaryImageViewSet, 'list', user)
+        yield 'DiaryImageViewSet.list', view.get_queryset()[:page_size]
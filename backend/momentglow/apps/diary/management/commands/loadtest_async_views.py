@@ -0,0 +1,174 @@
+"""
+在进程内通过 ASGI 应用压测异步视图，并与同步实现对比
+
+每个模拟客户端接收响应体时等待 --client-delay 秒，模拟慢速客户端；
+同步基线视图与异步视图读取相同的数据、返回相同的内容，只在 ASGI 下经
+线程池执行。公开日记流请求附带不可缓存的参数，两边都会真正查询数据库。
+"""
+import asyncio
+import statistics
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import include, path
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework_simplejwt.tokens import AccessToken
+
+from momentglow.apps.diary.async_views import AsyncDiaryView
+from momentglow.apps.diary.models import Diary
+from momentglow.apps.user.models import CustomUser
+from momentglow.apps.user.serializers import UserSerializer
+from momentglow.views_base import CustomAPIView
+
+
+class SyncPublicFeedView(CustomAPIView):
+    permission_classes = [permissions.AllowAny]
+    action = 'public'
+    get_viewset = AsyncDiaryView.get_viewset
+
+    def get(self, request):
+        viewset = self.get_viewset()
+        queryset = viewset.filter_queryset(viewset.get_public_queryset())
+        return viewset.page_response(queryset, private=False)[0]
+
+
+class SyncDiaryDetailView(CustomAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    action = 'retrieve'
+    get_viewset = AsyncDiaryView.get_viewset
+
+    def get(self, request, pk):
+        viewset = self.get_viewset()
+        return viewset.diary_response(viewset.get_object())
+
+
+class SyncProfileView(CustomAPIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, user_id):
+        user = CustomUser.objects.get(id=user_id)
+        return Response(UserSerializer(user, context={'request': request}).data)
+
+
+class SyncAvatarView(CustomAPIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, user_id):
+        user = CustomUser.objects.get(id=user_id)
+        path = user.avatar.url if user.avatar else '/media/avatars/default.jpg'
+        return Response({'avatar_url': request.build_absolute_uri(path), 'has_avatar': bool(user.avatar)})
+
+
+# 同步基线的 URLconf，挂在 /sync/ 下，其余路径沿用项目的 URLconf
+urlpatterns = [
+    path('sync/api/diaries/public/', SyncPublicFeedView.as_view()),
+    path('sync/api/diaries/<int:pk>/', SyncDiaryDetailView.as_view()),
+    path('sync/api/users/profiles/<int:user_id>/', SyncProfileView.as_view()),
+    path('sync/api/users/avatar/<int:user_id>/', SyncAvatarView.as_view()),
+    path('', include('momentglow.urls')),
+]
+
+
+class Command(BaseCommand):
+    help = '在进程内通过 ASGI 压测异步的公开日记流、日记详情、用户资料和头像接口，并与同步实现对比吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='并发客户端数')
+        parser.add_argument('--requests', type=int, default=20, help='每个客户端发出的请求数')
+        parser.add_argument('--client-delay', type=float, default=0.05, help='客户端接收响应体的耗时（秒）')
+        parser.add_argument('--create-data', type=int, default=0, help='先为压测用户创建若干篇公开日记')
+
+    def handle(self, *args, **options):
+        if options['create_data']:
+            self.create_data(options['create_data'])
+        diary = Diary.objects.filter(is_public=True).select_related('user').order_by('-created_at').first()
+        if diary is None:
+            raise CommandError('没有公开日记，可使用 --create-data 创建')
+        user = diary.user
+        headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+        # 公开日记流附带不可缓存的参数，避免命中缓存
+        paths = {
+            'public': '/api/diaries/public/?_=1',
+            'retrieve': f'/api/diaries/{diary.pk}/',
+            'profile': f'/api/users/profiles/{user.pk}/',
+            'avatar': f'/api/users/avatar/{user.pk}/',
+        }
+
+        with override_settings(ROOT_URLCONF=__name__):
+            application = get_asgi_application()
+            for name, url in paths.items():
+                results = {}
+                for mode, prefix in (('sync', '/sync'), ('async', '')):
+                    target = url.replace('/api', prefix + '/api', 1) if prefix else url
+                    results[mode] = asyncio.run(self.run(application, target, headers, options))
+                gain = results['async']['rps'] / results['sync']['rps'] if results['sync']['rps'] else 0
+                for mode, result in results.items():
+                    self.stdout.write(
+                        f"{name:<8} {mode:<5} {result['rps']:8.1f} req/s  "
+                        f"p50={result['p50']:.1f}ms p95={result['p95']:.1f}ms errors={result['errors']}"
+                    )
+                self.stdout.write(f'{name:<8} gain  {gain:.2f}x')
+
+    def create_data(self, count):
+        user, created = CustomUser.objects.get_or_create(username='loadtest')
+        if created:
+            user.set_unusable_password()
+            user.save()
+        Diary.objects.bulk_create([
+            Diary(user=user, title=f'压测日记 {i}', content='今天天气很好。' * 50, mood='happy', is_public=True)
+            for i in range(count)
+        ])
+
+    async def run(self, application, url, headers, options):
+        path, _, query = url.partition('?')
+        latencies = []
+        errors = 0
+
+        async def request():
+            nonlocal errors
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', b'testserver'), *headers],
+                'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            }
+            status = None
+            body_sent = asyncio.Event()
+
+            async def receive():
+                if not body_sent.is_set():
+                    body_sent.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # 客户端不会主动断开，Django 在响应结束后取消等待
+                await asyncio.Future()
+
+            async def send(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                else:
+                    await asyncio.sleep(options['client_delay'])
+
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                errors += 1
+
+        async def client():
+            for _ in range(options['requests']):
+                await request()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'errors': errors,
+        }
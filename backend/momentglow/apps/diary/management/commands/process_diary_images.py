@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from momentglow.apps.diary import images
+from momentglow.apps.diary.models import DiaryImage
+
+
+class Command(BaseCommand):
+    help = '同步处理未完成或失败的日记图片（生成缩略图、去除 EXIF），用于进程重启后补处理'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='重新处理全部图片，例如调整缩略图宽度之后')
+
+    def handle(self, *args, **options):
+        queryset = DiaryImage.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.exclude(processing_status=DiaryImage.STATUS_READY)
+        done = failed = 0
+        for image_id in queryset.values_list('pk', flat=True).iterator():
+            images.run(image_id)
+            status = DiaryImage.objects.filter(pk=image_id).values_list('processing_status', flat=True).first()
+            if status == DiaryImage.STATUS_READY:
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'处理完成 {done} 张，失败 {failed} 张'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from momentglow.apps.diary import sync
+from momentglow.apps.diary.models import Diary, Tombstone
+
+
+class Command(BaseCommand):
+    help = '清理超过保留期的删除记录，以及所属日记已删除的评论、图片删除记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+        parser.add_argument('--dry-run', action='store_true', help='只统计不删除')
+
+    def handle(self, *args, **options):
+        tombstones = Tombstone.objects.using(options['database'])
+        expired = tombstones.filter(deleted_at__lt=sync.tombstone_horizon())
+        # 日记的删除记录已让客户端移除其评论和图片
+        orphaned = tombstones.exclude(kind=Tombstone.KIND_DIARY).exclude(
+            diary_id__in=Diary.objects.using(options['database']).values('pk')
+        )
+        if options['dry_run']:
+            self.stdout.write(f'可清理过期记录 {expired.count()} 条，孤立记录 {orphaned.count()} 条')
+            return
+        expired_count, _ = expired.delete()
+        orphaned_count, _ = orphaned.delete()
+        self.stdout.write(self.style.SUCCESS(f'已清理过期记录 {expired_count} 条，孤立记录 {orphaned_count} 条'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from momentglow.apps.diary import stats
+
+
+class Command(BaseCommand):
+    help = '按日记表重建每日统计汇总（批量导入或绕过信号的更新之后使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='只重建指定用户，可重复')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的汇总行数')
+
+    def handle(self, *args, **options):
+        total = stats.rebuild(
+            using=options['database'], user_ids=options['user_ids'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'已写入 {total} 行每日统计'))
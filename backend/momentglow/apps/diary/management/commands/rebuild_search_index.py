@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from momentglow.apps.diary import search
+from momentglow.apps.diary.models import Diary
+
+
+class Command(BaseCommand):
+    help = '重建日记全文索引（批量导入或绕过信号的更新之后使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批写入的日记数')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        if not search.is_supported(connection):
+            self.stderr.write(f'数据库 {connection.vendor} 不支持全文索引，已跳过')
+            return
+
+        rows = Diary.objects.using(using).order_by('pk').values_list('pk', 'title', 'content')
+        total = 0
+        with transaction.atomic(using=using):
+            search.drop_index(connection)
+            search.create_index(connection)
+            batch = []
+            for row in rows.iterator(chunk_size=options['batch_size']):
+                batch.append(row)
+                if len(batch) >= options['batch_size']:
+                    search.index_rows(connection, batch)
+                    total += len(batch)
+                    batch = []
+            search.index_rows(connection, batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'已重建 {total} 篇日记的全文索引'))
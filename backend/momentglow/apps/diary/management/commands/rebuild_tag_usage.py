@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from momentglow.apps.diary import tags
+
+
+class Command(BaseCommand):
+    help = '按日记与标签的关联重算标签的使用次数与热度（批量导入或绕过信号的写入之后使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+
+    def handle(self, *args, **options):
+        total = tags.rebuild_usage(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'已重算 {total} 个标签的使用次数与热度'))
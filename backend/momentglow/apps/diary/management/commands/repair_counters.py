@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from momentglow.apps.diary import counters
+
+
+class Command(BaseCommand):
+    help = '按实际行数重算日记的评论数、图片数与用户的日记数、公开日记数，只更新有偏差的行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='要修复的数据库别名')
+        parser.add_argument('--dry-run', action='store_true', help='只统计偏差不修复')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            drift = counters.repair(using=options['database'], dry_run=options['dry_run'])
+        for (model, field), rows in drift.items():
+            self.stdout.write(f'{model}.{field}: {rows} 行有偏差')
+        total = sum(drift.values())
+        if options['dry_run']:
+            self.stdout.write(f'共 {total} 行有偏差（未修复）')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已修复 {total} 行'))
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from momentglow.apps.diary import search
+
+    connection = schema_editor.connection
+    search.create_index(connection)
+    Diary = apps.get_model('diary', 'Diary')
+    rows = Diary.objects.using(connection.alias).values_list('pk', 'title', 'content')
+    search.index_rows(connection, rows.iterator())
+
+
+def drop_search_index(apps, schema_editor):
+    from momentglow.apps.diary import search
+
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0002_diary_fulltext_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='diary',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='diary.diary', verbose_name='日记'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['diary', 'created_at'], name='comment_diary_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diary',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='diary_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diary',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['-created_at', '-id'], name='diary_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diary',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['mood', '-created_at', '-id'], name='diary_public_mood_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diaryimage',
+            index=models.Index(fields=['diary', 'created_at'], name='diaryimage_diary_created_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0003_diary_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diaryimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='高度'),
+        ),
+        migrations.AddField(
+            model_name='diaryimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', '处理中'), ('ready', '已完成'), ('failed', '处理失败')], default='pending', max_length=10, verbose_name='处理状态'),
+        ),
+        migrations.AddField(
+            model_name='diaryimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=list, verbose_name='缩略图'),
+        ),
+        migrations.AddField(
+            model_name='diaryimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='宽度'),
+        ),
+    ]
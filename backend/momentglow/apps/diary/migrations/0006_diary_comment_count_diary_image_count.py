@@ -0,0 +1,51 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:53
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, field):
+    counts = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    """按现有数据初始化日记与用户的计数字段"""
+    db = schema_editor.connection.alias
+    Diary = apps.get_model('diary', 'Diary')
+    Comment = apps.get_model('diary', 'Comment')
+    DiaryImage = apps.get_model('diary', 'DiaryImage')
+    CustomUser = apps.get_model('user', 'CustomUser')
+    Diary.objects.using(db).update(
+        comment_count=count_of(Comment.objects.using(db), 'diary'),
+        image_count=count_of(DiaryImage.objects.using(db), 'diary'),
+    )
+    CustomUser.objects.using(db).update(
+        diary_count=count_of(Diary.objects.using(db), 'user'),
+        public_diary_count=count_of(Diary.objects.using(db).filter(is_public=True), 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0005_comment_diaryimage_updated_at'),
+        ('user', '0003_customuser_diary_count_customuser_public_diary_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diary',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='评论数'),
+        ),
+        migrations.AddField(
+            model_name='diary',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='图片数'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
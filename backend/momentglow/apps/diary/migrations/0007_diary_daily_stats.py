@@ -0,0 +1,49 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """按现有日记生成每日汇总"""
+    db = schema_editor.connection.alias
+    Diary = apps.get_model('diary', 'Diary')
+    DiaryDailyStat = apps.get_model('diary', 'DiaryDailyStat')
+    rows = Diary.objects.using(db).annotate(date=TruncDate('created_at')).order_by().values(
+        'user_id', 'date', 'mood', 'weather'
+    ).annotate(count=Count('pk'))
+    DiaryDailyStat.objects.using(db).bulk_create([DiaryDailyStat(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0006_diary_comment_count_diary_image_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiaryDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('mood', models.CharField(blank=True, max_length=50, verbose_name='心情')),
+                ('weather', models.CharField(blank=True, max_length=50, verbose_name='天气')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='日记数')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diary_daily_stats', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '日记每日统计',
+                'verbose_name_plural': '日记每日统计',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='diarydailystat',
+            constraint=models.UniqueConstraint(fields=('user', 'date', 'mood', 'weather'), name='diary_daily_stat_key'),
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0008_diary_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='diary',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='创建时间'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:09
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """同名标签合并到 ID 最小的一个，关联的日记一并迁移"""
+    db = schema_editor.connection.alias
+    Tag = apps.get_model('diary', 'Tag')
+    Through = apps.get_model('diary', 'Diary').tags.through
+    duplicates = Tag.objects.using(db).values('name').annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for row in duplicates:
+        others = Tag.objects.using(db).filter(name=row['name']).exclude(pk=row['keep'])
+        linked = set(Through.objects.using(db).filter(tag_id=row['keep']).values_list('diary_id', flat=True))
+        moved = set(Through.objects.using(db).filter(tag__in=others).values_list('diary_id', flat=True))
+        Through.objects.using(db).bulk_create([
+            Through(diary_id=diary_id, tag_id=row['keep']) for diary_id in moved - linked
+        ])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0009_diary_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:12
+
+import math
+
+from django.db import migrations, models
+
+# 与 tags.DECAY_SECONDS 相同
+DECAY_SECONDS = 7 * 24 * 3600
+
+
+def backfill_tag_usage(apps, schema_editor):
+    """按现有关联计算使用次数与热度"""
+    db = schema_editor.connection.alias
+    Diary = apps.get_model('diary', 'Diary')
+    Tag = apps.get_model('diary', 'Tag')
+    rows = Diary.tags.through.objects.using(db).order_by().values_list('tag_id', 'diary__created_at')
+    usage = {}
+    for tag_id, created_at in rows.iterator(chunk_size=1000):
+        score = created_at.timestamp() / DECAY_SECONDS
+        if tag_id in usage:
+            count, last_used_at, total = usage[tag_id]
+            total = max(total, score) + math.log1p(math.exp(-abs(total - score)))
+            usage[tag_id] = (count + 1, max(last_used_at, created_at), total)
+        else:
+            usage[tag_id] = (1, created_at, score)
+    Tag.objects.using(db).bulk_update([
+        Tag(pk=tag_id, diary_count=count, last_used_at=last_used_at, trending_score=score)
+        for tag_id, (count, last_used_at, score) in usage.items()
+    ], ['diary_count', 'last_used_at', 'trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0011_tag_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='diary_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='使用次数'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='最近使用时间'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='热度'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-trending_score'], name='tag_trending_idx'),
+        ),
+        migrations.RunPython(backfill_tag_usage, migrations.RunPython.noop),
+    ]
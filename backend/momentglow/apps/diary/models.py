@@ -1,15 +1,23 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.conf import settings
+from django.utils import timezone
 
 class Tag(models.Model):
     """标签模型"""
-    name = models.CharField('标签名', max_length=50)
+    name = models.CharField('标签名', max_length=50, unique=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    # 以下由 signals 维护，见 tags.py；偏差可用 rebuild_tag_usage 命令重算
+    diary_count = models.PositiveIntegerField('使用次数', default=0, editable=False)
+    last_used_at = models.DateTimeField('最近使用时间', null=True, blank=True, editable=False)
+    trending_score = models.FloatField('热度', default=0, editable=False)
     
     class Meta:
         verbose_name = '标签'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-trending_score'], name='tag_trending_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -20,45 +28,187 @@ class Diary(models.Model):
     title = models.CharField('标题', max_length=200)
     content = models.TextField('内容')
     tags = models.ManyToManyField(Tag, blank=True, verbose_name='标签')
-    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    # 不用 auto_now_add，导入时可以在插入时直接写入原创建时间
+    created_at = models.DateTimeField('创建时间', default=timezone.now, editable=False)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
     mood = models.CharField('心情', max_length=50, blank=True)
     weather = models.CharField('天气', max_length=50, blank=True)
     location = models.CharField('位置', max_length=200, blank=True)
     is_public = models.BooleanField('是否公开', default=False)
+    # 由 signals 中的 F 表达式维护，偏差可用 repair_counters 命令修复
+    comment_count = models.PositiveIntegerField('评论数', default=0, editable=False)
+    image_count = models.PositiveIntegerField('图片数', default=0, editable=False)
     class Meta:
         verbose_name = '日记'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        # 列表按作者、公开日记流按 is_public 过滤，都按 (created_at, id) 倒序分页。
+        # 公开日记用部分索引：SQLite 把 is_public=True 编译为裸列条件，无法命中以它开头的复合索引
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='diary_user_created_idx'),
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_public=True),
+                name='diary_public_created_idx'
+            ),
+            models.Index(
+                fields=['mood', '-created_at', '-id'], condition=models.Q(is_public=True),
+                name='diary_public_mood_idx'
+            ),
+            # 增量同步按作者取 (updated_at, id) 之后的日记
+            models.Index(fields=['user', 'updated_at', 'id'], name='diary_user_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
 class DiaryImage(models.Model):
     """日记图片模型"""
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '处理中'),
+        (STATUS_READY, '已完成'),
+        (STATUS_FAILED, '处理失败'),
+    ]
+
     diary = models.ForeignKey(Diary, on_delete=models.CASCADE, related_name='images', verbose_name='日记')
     image = models.ImageField('图片', upload_to='diary_images/%Y/%m/%d/')
+    width = models.PositiveIntegerField('宽度', null=True, blank=True)
+    height = models.PositiveIntegerField('高度', null=True, blank=True)
+    # 缩略图列表，每项为 {"width": 640, "format": "webp", "name": "存储路径"}
+    variants = models.JSONField('缩略图', default=list, blank=True)
+    processing_status = models.CharField(
+        '处理状态', max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
     created_at = models.DateTimeField('上传时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
     
     class Meta:
         verbose_name = '日记图片'
         verbose_name_plural = verbose_name
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['diary', 'created_at'], name='diaryimage_diary_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='diaryimage_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.diary.title}的图片 - {self.id}"
 
 class Comment(models.Model):
-    """评论模型"""
+    """评论模型
+
+    回复以物化路径保存：path 由从根评论到本评论的各级 ID 依次补零到 PATH_STEP 位
+    拼接而成，按 path 排序即为楼中楼的展示顺序（父评论在前，其回复紧随其后，
+    同级按创建先后）。整篇日记的评论或某条评论的全部回复都是 (diary, path)
+    索引上的一次范围查询。回复超过 MAX_DEPTH 层时挂到上一层，与被回复的评论并列。
+    """
+    PATH_STEP = 10
+    MAX_DEPTH = 25
+
     diary = models.ForeignKey(Diary, related_name='comments', on_delete=models.CASCADE, verbose_name='日记')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='评论者')
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE, verbose_name='回复的评论'
+    )
     content = models.TextField('评论内容')
+    # 由 save() 在插入后写入
+    path = models.CharField('路径', max_length=PATH_STEP * MAX_DEPTH, default='', editable=False)
+    depth = models.PositiveSmallIntegerField('层级', default=0, editable=False)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
     
     class Meta:
         verbose_name = '评论'
         verbose_name_plural = verbose_name
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['diary', 'path'], name='comment_diary_path_idx'),
+            models.Index(fields=['updated_at', 'id'], name='comment_updated_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} on {self.diary.title}'
+
+    @classmethod
+    def path_segment(cls, pk):
+        return str(pk).zfill(cls.PATH_STEP)
+
+    @classmethod
+    def subtree_bounds(cls, path):
+        """path 本身及其全部回复所在的 [下界, 上界) 范围
+
+        上界是下一个同级评论的路径前缀（末段加一），两端都只含数字，
+        在任何排序规则下都与按字节比较的结果一致。
+        """
+        parent_path, last = path[:-cls.PATH_STEP], path[-cls.PATH_STEP:]
+        return path, parent_path + cls.path_segment(int(last) + 1)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            while self.parent_id and self.parent.depth + 1 >= self.MAX_DEPTH:
+                self.parent = self.parent.parent
+            self.depth = self.parent.depth + 1 if self.parent_id else 0
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        # 插入与写入 path 在同一事务中，其他连接看不到 path 为空的评论
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            if not self.path:
+                self.path = (self.parent.path if self.parent_id else '') + self.path_segment(self.pk)
+                type(self)._base_manager.using(self._state.db).filter(pk=self.pk).update(path=self.path)
+
+class DiaryDailyStat(models.Model):
+    """日记按 (用户, 日期, 心情, 天气) 的每日汇总，由 signals 增量维护，供统计接口读取"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='diary_daily_stats', verbose_name='用户'
+    )
+    date = models.DateField('日期')
+    mood = models.CharField('心情', max_length=50, blank=True)
+    weather = models.CharField('天气', max_length=50, blank=True)
+    count = models.PositiveIntegerField('日记数', default=0)
+
+    class Meta:
+        verbose_name = '日记每日统计'
+        verbose_name_plural = verbose_name
+        # 统计接口按 (user, date) 范围读取，唯一约束的索引同时覆盖该查询
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'mood', 'weather'], name='diary_daily_stat_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.date} {self.mood}/{self.weather}: {self.count}'
+
+class Tombstone(models.Model):
+    """已删除的日记、评论、图片，供增量同步接口下发删除记录"""
+    KIND_DIARY = 'diary'
+    KIND_COMMENT = 'comment'
+    KIND_IMAGE = 'image'
+    KIND_CHOICES = [
+        (KIND_DIARY, '日记'),
+        (KIND_COMMENT, '评论'),
+        (KIND_IMAGE, '图片'),
+    ]
+
+    kind = models.CharField('类型', max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField('对象ID')
+    # 日记已删除时评论、图片的删除记录无需下发，因此只记录所属日记的 ID，
+    # 同步时按当前用户仍拥有的日记过滤；日记的删除记录按 user 过滤
+    diary_id = models.BigIntegerField('所属日记ID')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='+', verbose_name='作者'
+    )
+    deleted_at = models.DateTimeField('删除时间', auto_now_add=True)
+
+    class Meta:
+        verbose_name = '删除记录'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['diary_id', 'deleted_at', 'id'], name='tombstone_diary_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
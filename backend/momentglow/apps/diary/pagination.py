@@ -0,0 +1,140 @@
+import base64
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from django.db import models
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class DiaryKeysetPagination(BasePagination):
+    """
+    基于 (created_at, id) 的游标分页
+
+    不统计总数，也不使用 OFFSET，每一页都是一次按索引定位的范围查询，
+    因此第 500 页与第 1 页的开销相同。只支持向后翻页，适用于无限滚动。
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE or 10
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        results = list(self.get_page_queryset(queryset, self.decode_cursor(request)))
+        return self.set_page(results)
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_queryset(self, queryset, position):
+        """position 为上一页末条的 (created_at, id)，首页为 None"""
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(
+                models.Q(created_at__lt=created_at) |
+                models.Q(created_at=created_at, id__lt=pk)
+            )
+        # 多取一条用于判断是否还有下一页
+        return queryset[:self.page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+
+    def encode_cursor(self, obj):
+        raw = f'{obj.created_at.isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            created_at, pk = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class CommentThreadPagination(DiaryKeysetPagination):
+    """
+    按物化路径的游标分页，用于评论列表
+
+    每页是 (diary, path) 索引上接着上一页末条 path 的一次范围查询，
+    热门日记的评论再多也不需要统计总数或跳过前面的行。
+    """
+    ordering = ('path',)
+    page_size = 50
+    path_pattern = re.compile(r'^\d+$')
+
+    def get_page_queryset(self, queryset, position):
+        """position 为上一页末条的 path，首页为 None"""
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(path__gt=position)
+        return queryset[:self.page_size + 1]
+
+    def encode_cursor(self, obj):
+        return obj.path
+
+    def decode_cursor(self, request):
+        path = request.query_params.get(self.cursor_query_param)
+        if not path:
+            return None
+        if not self.path_pattern.match(path):
+            raise NotFound(self.invalid_cursor_message)
+        return path
+
+
+async def apaginate_queryset(paginator, queryset, request):
+    """paginate_queryset() 的异步版本，支持 PageNumberPagination 与 DiaryKeysetPagination
+
+    分页器的状态与同步分页后一致，可以继续调用 get_paginated_response()。
+    """
+    if isinstance(paginator, DiaryKeysetPagination):
+        paginator.request = request
+        page_queryset = paginator.get_page_queryset(queryset, paginator.decode_cursor(request))
+        return paginator.set_page([obj async for obj in page_queryset])
+
+    assert isinstance(paginator, PageNumberPagination)
+    page_size = paginator.get_page_size(request)
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    # 预先异步取得总数，paginator.page() 便不会再同步查询
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    page.object_list = [obj async for obj in page.object_list]
+    paginator.page = page
+    paginator.request = request
+    return list(page)
@@ -0,0 +1,171 @@
+"""
+日记全文检索
+
+SQLite 使用 FTS5 影子表 ``diary_diary_fts``（rowid 即日记 id），
+PostgreSQL 使用 ``diary_diary.search_vector`` tsvector 列及其 GIN 索引。
+中文等 CJK 文本没有空格分词，这里在写入索引和解析查询前统一切分为
+单字加二元组（bigram），两种后端都以 simple 方式按空格分隔的词元建索引。
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+from rest_framework import filters
+
+FTS_TABLE = 'diary_diary_fts'
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_VECTOR_INDEX = 'diary_diary_search_vector_gin'
+
+CJK_RANGES = (
+    '\u3040-\u30ff'  # 日文假名
+    '\u3400-\u4dbf'  # CJK 扩展 A
+    '\u4e00-\u9fff'  # CJK 统一汉字
+    '\uac00-\ud7af'  # 韩文音节
+    '\uf900-\ufaff'  # CJK 兼容汉字
+)
+TOKEN_RE = re.compile(rf'[{CJK_RANGES}]+|[^\W_{CJK_RANGES}]+')
+CJK_RE = re.compile(rf'[{CJK_RANGES}]')
+
+
+def tokenize(text, for_query=False):
+    """
+    把文本切分为检索词元
+
+    CJK 连续片段在建索引时同时产出单字与二元组，使单字查询和多字查询都能命中；
+    查询时多字片段只取二元组，单字片段取单字本身。
+    """
+    tokens = []
+    for run in TOKEN_RE.findall(text or ''):
+        if not CJK_RE.match(run):
+            tokens.append(run.lower())
+            continue
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if for_query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+def build_document(title, content):
+    """返回写入索引的 (标题, 正文) 词元串"""
+    return ' '.join(tokenize(title)), ' '.join(tokenize(strip_tags(content or '')))
+
+
+def build_query(search_terms):
+    """由 SearchFilter 拆出的检索词构造各后端统一的词元列表，去重保序"""
+    tokens = []
+    for term in search_terms:
+        tokens.extend(tokenize(term, for_query=True))
+    return list(dict.fromkeys(tokens))
+
+
+def is_supported(connection):
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(connection):
+    """创建索引结构（迁移中调用）"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, content)')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'ALTER TABLE diary_diary ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_VECTOR_INDEX} '
+                f'ON diary_diary USING GIN ({SEARCH_VECTOR_COLUMN})'
+            )
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {SEARCH_VECTOR_INDEX}')
+            cursor.execute(f'ALTER TABLE diary_diary DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}')
+
+
+def index_rows(connection, rows):
+    """写入或覆盖索引，rows 为 (id, title, content) 可迭代对象"""
+    if not is_supported(connection):
+        return
+    documents = [(pk, *build_document(title, content)) for pk, title, content in rows]
+    if not documents:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[pk] for pk, *_ in documents])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)', documents)
+        else:
+            cursor.executemany(
+                f"UPDATE diary_diary SET {SEARCH_VECTOR_COLUMN} = "
+                f"setweight(to_tsvector('simple', %s), 'A') || "
+                f"setweight(to_tsvector('simple', %s), 'B') WHERE id = %s",
+                [[title_doc, content_doc, pk] for pk, title_doc, content_doc in documents]
+            )
+
+
+def remove_rows(connection, pks):
+    """删除索引记录；PostgreSQL 的 tsvector 列随日记行一起删除，无需处理"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pk in pks:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def update_diary(diary, using='default'):
+    index_rows(connections[using], [(diary.pk, diary.title, diary.content)])
+
+
+def remove_diary(diary, using='default'):
+    remove_rows(connections[using], [diary.pk])
+
+
+class DiaryFullTextSearchFilter(filters.SearchFilter):
+    """
+    基于全文索引的 ``?search=`` 过滤，结果按相关度排序
+
+    数据库不支持时退回 SearchFilter 的 icontains 实现。
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        connection = connections[queryset.db]
+        if not is_supported(connection):
+            return super().filter_queryset(request, queryset, view)
+        tokens = build_query(search_terms)
+        if not tokens:
+            return queryset.none()
+
+        if connection.vendor == 'sqlite':
+            match = ' '.join('"{}"'.format(token.replace('"', '""')) for token in tokens)
+            matched = RawSQL(
+                f'diary_diary.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+                [match], output_field=BooleanField()
+            )
+            # bm25 越小越相关，标题权重高于正文
+            rank = RawSQL(
+                f'(SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = diary_diary.id)',
+                [match], output_field=FloatField()
+            )
+            order = 'search_rank'
+        else:
+            query = ' '.join(tokens)
+            matched = RawSQL(
+                f"diary_diary.{SEARCH_VECTOR_COLUMN} @@ plainto_tsquery('simple', %s)",
+                [query], output_field=BooleanField()
+            )
+            rank = RawSQL(
+                f"ts_rank(diary_diary.{SEARCH_VECTOR_COLUMN}, plainto_tsquery('simple', %s))",
+                [query], output_field=FloatField()
+            )
+            order = '-search_rank'
+        return queryset.filter(matched).annotate(search_rank=rank).order_by(order, '-created_at', '-id')
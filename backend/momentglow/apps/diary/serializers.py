@@ -1,13 +1,25 @@
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+from django.utils.html import strip_tags
 from rest_framework import serializers
 from .models import Diary, DiaryImage, Tag, Comment
+from . import images
+from .tags import get_or_create_tags
+from momentglow import media
 from momentglow.apps.user.models import CustomUser
 # 移除 from django.contrib.auth.models import User
 # 如有UserSerializer，需改为引用自定义用户序列化器
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_url = serializers.SerializerMethodField()
+
     class Meta:
         model = CustomUser
-        fields = ['id', 'username', 'email']
+        fields = ['id', 'username', 'email', 'avatar_url']
+
+    def get_avatar_url(self, obj):
+        # 作者已随日记 JOIN 取出，前端无需再逐个请求头像
+        return media.avatar_url(obj.avatar.name, self.context.get('request'))
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,19 +31,68 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ['id', 'content', 'created_at', 'user_username']
+        fields = ['id', 'content', 'created_at', 'user_username', 'parent', 'depth']
         read_only_fields = ['user']
 
+    def create(self, validated_data):
+        parent = validated_data.get('parent')
+        if parent is not None and parent.diary_id != validated_data['diary'].pk:
+            raise serializers.ValidationError({'parent': '只能回复同一篇日记的评论'})
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # 回复关系创建后不可修改，否则子树的路径都要重写
+        validated_data.pop('parent', None)
+        return super().update(instance, validated_data)
+
 class DiaryImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+    webp_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = DiaryImage
-        fields = ['id', 'image', 'created_at']
+        fields = [
+            'id', 'image', 'created_at', 'width', 'height',
+            'processing_status', 'srcset', 'webp_srcset'
+        ]
+        read_only_fields = ['width', 'height', 'processing_status']
+
+    def is_private(self, obj):
+        # 未随图片取出日记时按私密处理，签名地址对公开日记同样有效
+        return not (DiaryImage.diary.is_cached(obj) and obj.diary.is_public)
+
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        if obj.image:
+            data['image'] = self.build_url(obj.image.name, obj)
+        return data
+
+    def build_url(self, name, obj):
+        return media.media_url(name, self.context.get('request'), private=self.is_private(obj))
+
+    def get_srcset(self, obj):
+        return images.build_srcset(obj, 'jpeg', lambda name: self.build_url(name, obj))
+
+    def get_webp_srcset(self, obj):
+        return images.build_srcset(obj, 'webp', lambda name: self.build_url(name, obj))
+
+class TagUsageSerializer(TagSerializer):
+    """热门标签，附带使用次数与最近使用时间"""
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['diary_count', 'last_used_at']
+
+
+class DiaryTagSerializer(TagSerializer):
+    """日记中嵌套的标签，同名标签直接复用，不做唯一性校验"""
+    class Meta(TagSerializer.Meta):
+        extra_kwargs = {'name': {'validators': []}}
+
 
 class DiarySerializer(serializers.ModelSerializer):
+    """日记详情；评论不内嵌，由评论接口按楼层顺序分页获取"""
     user = UserSerializer(read_only=True)
     images = DiaryImageSerializer(many=True, read_only=True)
-    tags = TagSerializer(many=True, required=False)
-    comments = CommentSerializer(many=True, read_only=True)
+    tags = DiaryTagSerializer(many=True, required=False)
     user_username = serializers.CharField(source='user.username', read_only=True)
     
     class Meta:
@@ -39,30 +100,92 @@ class DiarySerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'content', 'created_at', 'updated_at',
             'mood', 'weather', 'location', 'is_public',
-            'user', 'tags', 'comments', 'user_username','images'
+            'user', 'tags', 'user_username','images',
+            'comment_count', 'image_count'
         ]
         read_only_fields = ['user', 'created_at', 'updated_at']
 
     def create(self, validated_data):
         tags_data = validated_data.pop('tags', [])
         diary = Diary.objects.create(**validated_data)
-        
-        for tag_data in tags_data:
-            tag, _ = Tag.objects.get_or_create(**tag_data)
-            diary.tags.add(tag)
-        
+        tags = get_or_create_tags(tag['name'] for tag in tags_data)
+        if tags:
+            diary.tags.add(*tags.values())
         return diary
 
     def update(self, instance, validated_data):
-        tags_data = validated_data.pop('tags', [])
+        tags_data = validated_data.pop('tags', None)
         diary = super().update(instance, validated_data)
-        
-        if tags_data:
-            # 清除现有标签
-            diary.tags.clear()
-            # 添加新标签
-            for tag_data in tags_data:
-                tag, _ = Tag.objects.get_or_create(**tag_data)
-                diary.tags.add(tag)
-        
-        return diary 
\ No newline at end of file
+        # 未传 tags 时保持原有标签，传入空列表时清空
+        if tags_data is not None:
+            diary.tags.set(get_or_create_tags(tag['name'] for tag in tags_data).values())
+        return diary
+
+
+class DiarySummarySerializer(serializers.ModelSerializer):
+    """日记摘要，用于列表类接口，不内嵌正文全文、评论和全部图片"""
+    # 数据库侧截取的正文前缀长度，需留出被剥离的 HTML 标签的余量
+    CONTENT_PREFIX_LENGTH = 512
+    EXCERPT_LENGTH = 120
+
+    user = UserSerializer(read_only=True)
+    tags = TagSerializer(many=True, read_only=True)
+    user_username = serializers.CharField(source='user.username', read_only=True)
+    excerpt = serializers.SerializerMethodField()
+    cover_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Diary
+        fields = [
+            'id', 'title', 'excerpt', 'created_at', 'updated_at',
+            'mood', 'weather', 'location', 'is_public',
+            'user', 'tags', 'user_username',
+            'comment_count', 'image_count', 'cover_image'
+        ]
+        read_only_fields = fields
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        """为摘要所需字段添加注解，正文只取前缀，避免加载全文
+
+        评论数、图片数是日记上的冗余字段；封面图使用相关子查询而不是 JOIN，
+        分页查询才能沿索引顺序读取并在 LIMIT 处停止。
+        """
+        first_image = DiaryImage.objects.filter(
+            diary=OuterRef('pk')
+        ).order_by('created_at', 'id').values('image')[:1]
+        return queryset.defer('content').annotate(
+            content_prefix=Substr('content', 1, cls.CONTENT_PREFIX_LENGTH),
+            cover_image_name=Subquery(first_image),
+        ).order_by('-created_at', '-id')
+
+    def get_excerpt(self, obj):
+        text = strip_tags(obj.content_prefix)
+        # 前缀截断处可能留下未闭合的标签
+        if '<' in text:
+            text = text[:text.rindex('<')]
+        text = ' '.join(text.split())
+        if len(text) > self.EXCERPT_LENGTH:
+            text = text[:self.EXCERPT_LENGTH] + '...'
+        return text
+
+    def get_cover_image(self, obj):
+        if not obj.cover_image_name:
+            return None
+        return media.media_url(obj.cover_image_name, self.context.get('request'), private=not obj.is_public)
+
+
+class DiarySyncSerializer(DiarySerializer):
+    """增量同步中的日记，评论和图片单独下发"""
+    class Meta(DiarySerializer.Meta):
+        fields = [field for field in DiarySerializer.Meta.fields if field != 'images']
+
+
+class CommentSyncSerializer(CommentSerializer):
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['diary', 'updated_at']
+
+
+class DiaryImageSyncSerializer(DiaryImageSerializer):
+    class Meta(DiaryImageSerializer.Meta):
+        fields = DiaryImageSerializer.Meta.fields + ['diary', 'updated_at']
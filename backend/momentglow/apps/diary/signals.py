@@ -0,0 +1,230 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import counters, images, search, stats, tags
+from .feed_cache import public_feed_cache
+from momentglow.apps.user.models import CustomUser
+from .models import Comment, Diary, DiaryImage, Tag, Tombstone
+
+
+@receiver(post_save, sender=Diary)
+def index_diary(sender, instance, using, **kwargs):
+    """保存日记后同步全文索引"""
+    search.update_diary(instance, using=using)
+
+
+@receiver(post_delete, sender=Diary)
+def unindex_diary(sender, instance, using, **kwargs):
+    """删除日记后移除全文索引"""
+    search.remove_diary(instance, using=using)
+
+
+def feed_state(diary):
+    """公开日记流缓存关心的字段；只读 __dict__，避免触发延迟字段加载"""
+    return diary.__dict__.get('user_id'), diary.__dict__.get('mood'), diary.__dict__.get('is_public')
+
+
+def invalidate_feed(states, using):
+    """事务提交后让包含这些日记的公开日记流缓存失效，states 为 feed_state 元组"""
+    variants = {(user_id, mood) for user_id, mood, is_public in states if is_public}
+    for user_id, mood in variants:
+        transaction.on_commit(partial(public_feed_cache.invalidate, user_id, mood), using=using)
+
+
+def invalidate_feed_for_diary_ids(diary_ids, using):
+    states = Diary.objects.using(using).filter(pk__in=diary_ids).values_list('user_id', 'mood', 'is_public')
+    invalidate_feed(states, using)
+
+
+@receiver(post_init, sender=Diary)
+def remember_feed_state(sender, instance, **kwargs):
+    instance._feed_state = feed_state(instance)
+    instance._stat_key = stats.stat_key(instance)
+
+
+@receiver(post_save, sender=Diary)
+def count_diary_saved(sender, instance, created, using, raw=False, **kwargs):
+    """维护用户的日记数与公开日记数；须在 diary_saved 更新 _feed_state 之前执行"""
+    if raw:
+        return
+    user_id, _, is_public = feed_state(instance)
+    if created:
+        counters.adjust_user(user_id, using, diary_count=1, public_diary_count=int(bool(is_public)))
+        return
+    old_user_id, _, was_public = instance._feed_state
+    # 字段被延迟加载或未保存时取不到，说明本次没有修改
+    if was_public is None or is_public is None or (old_user_id, was_public) == (user_id, is_public):
+        return
+    if old_user_id == user_id:
+        counters.adjust_user(user_id, using, public_diary_count=int(is_public) - int(was_public))
+    else:
+        counters.adjust_user(old_user_id, using, diary_count=-1, public_diary_count=-int(was_public))
+        counters.adjust_user(user_id, using, diary_count=1, public_diary_count=int(is_public))
+
+
+@receiver(post_save, sender=Diary)
+def diary_saved(sender, instance, using, **kwargs):
+    invalidate_feed({instance._feed_state, feed_state(instance)}, using)
+    instance._feed_state = feed_state(instance)
+
+
+@receiver(post_delete, sender=Diary)
+def diary_deleted(sender, instance, using, **kwargs):
+    invalidate_feed([feed_state(instance)], using)
+
+
+@receiver(post_delete, sender=Diary)
+def count_diary_deleted(sender, instance, using, **kwargs):
+    user_id, _, is_public = feed_state(instance)
+    counters.adjust_user(user_id, using, diary_count=-1, public_diary_count=-int(bool(is_public)))
+
+
+@receiver(post_save, sender=Diary)
+def update_daily_stats(sender, instance, created, using, raw=False, **kwargs):
+    """把日记从旧的汇总行移到新的汇总行；字段未加载时说明本次没有修改"""
+    key = stats.stat_key(instance)
+    old_key = None if created else instance._stat_key
+    instance._stat_key = key
+    if raw or key is None or key == old_key or (not created and old_key is None):
+        return
+    if old_key is not None:
+        stats.add(old_key, -1, using)
+    stats.add(key, 1, using)
+
+
+@receiver(post_delete, sender=Diary)
+def remove_daily_stats(sender, instance, using, **kwargs):
+    key = stats.stat_key(instance)
+    if key is not None:
+        stats.add(key, -1, using)
+
+
+CHILD_COUNTERS = {Comment: 'comment_count', DiaryImage: 'image_count'}
+# 记在本次删除的发起对象（实例或查询集）上的日记 ID 集合
+DELETING_DIARIES_ATTR = '_deleting_diary_ids'
+
+
+@receiver(pre_delete, sender=Diary)
+def mark_diary_deleting(sender, instance, origin=None, **kwargs):
+    """pre_delete 在级联删除任何子记录之前发送；记下同一次删除中的日记"""
+    if origin is not None:
+        deleting = getattr(origin, DELETING_DIARIES_ATTR, None)
+        if deleting is None:
+            deleting = set()
+            setattr(origin, DELETING_DIARIES_ATTR, deleting)
+        deleting.add(instance.pk)
+
+
+def diary_deleted_with(instance, origin):
+    """评论、图片是否随所属日记一起删除，此时由日记自身的处理覆盖，不再逐条更新日记"""
+    return origin is not None and instance.diary_id in getattr(origin, DELETING_DIARIES_ATTR, ())
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=DiaryImage)
+def count_child_saved(sender, instance, created, using, raw=False, **kwargs):
+    if created and not raw:
+        counters.adjust_diary(instance.diary_id, using, **{CHILD_COUNTERS[sender]: 1})
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=DiaryImage)
+def count_child_deleted(sender, instance, using, origin=None, **kwargs):
+    if diary_deleted_with(instance, origin):
+        return
+    counters.adjust_diary(instance.diary_id, using, **{CHILD_COUNTERS[sender]: -1})
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=DiaryImage)
+@receiver(post_delete, sender=DiaryImage)
+def diary_child_changed(sender, instance, using, origin=None, **kwargs):
+    """评论数、图片数与封面图都在日记摘要中；随日记一起删除时由 diary_deleted 失效一次"""
+    if diary_deleted_with(instance, origin):
+        return
+    if sender.diary.is_cached(instance):
+        invalidate_feed([feed_state(instance.diary)], using)
+    else:
+        invalidate_feed_for_diary_ids([instance.diary_id], using)
+
+
+# 日记摘要中嵌入的作者字段
+FEED_AUTHOR_FIELDS = {'username', 'email', 'avatar'}
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(sender, instance, created, using, update_fields=None, raw=False, **kwargs):
+    """作者资料或头像变化后，让包含其公开日记的变体失效；只更新其他字段（如 last_login）时跳过"""
+    if created or raw or (update_fields is not None and not FEED_AUTHOR_FIELDS & set(update_fields)):
+        return
+    moods = Diary.objects.using(using).filter(user_id=instance.pk, is_public=True).order_by().values_list(
+        'mood', flat=True
+    ).distinct()
+    invalidate_feed([(instance.pk, mood, True) for mood in moods], using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(sender, instance, using, created=False, **kwargs):
+    """标签改名或删除（关联行随之级联删除，不触发 m2m_changed）时，让使用它的日记所在变体失效"""
+    if not created:
+        invalidate_feed_for_diary_ids(Diary.tags.through.objects.using(using).filter(tag_id=instance.pk).values('diary_id'), using)
+
+
+@receiver(m2m_changed, sender=Diary.tags.through)
+def diary_tags_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_feed([feed_state(instance)], using)
+    elif pk_set:
+        invalidate_feed_for_diary_ids(pk_set, using)
+
+
+@receiver(m2m_changed, sender=Diary.tags.through)
+def update_tag_usage(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """维护标签的使用次数与热度；clear 之前先记下将被移除的关联"""
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_usage = {instance.pk: instance.diary_set.using(using).count()}
+        else:
+            instance._cleared_usage = dict.fromkeys(instance.tags.using(using).values_list('pk', flat=True), 1)
+    elif action == 'post_clear':
+        tags.release_usage(instance.__dict__.pop('_cleared_usage', {}), using)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        usage = {instance.pk: len(pk_set)} if reverse else dict.fromkeys(pk_set, 1)
+        if action == 'post_add':
+            tags.record_usage(usage, using)
+        else:
+            tags.release_usage(usage, using)
+
+
+@receiver(pre_delete, sender=Diary)
+def release_diary_tags(sender, instance, using, **kwargs):
+    """删除日记时关联表的行由级联删除，不会触发 m2m_changed"""
+    tags.release_usage(dict.fromkeys(instance.tags.using(using).values_list('pk', flat=True), 1), using)
+
+
+@receiver(post_delete, sender=Diary)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=DiaryImage)
+def record_tombstone(sender, instance, using, origin=None, **kwargs):
+    """记录删除，供增量同步下发；评论、图片只记录所属日记，由同步接口按日记归属过滤。
+    随日记一起删除的评论、图片由日记的删除记录覆盖"""
+    if sender is Diary:
+        Tombstone.objects.using(using).create(
+            kind=Tombstone.KIND_DIARY, object_id=instance.pk, diary_id=instance.pk, user_id=instance.user_id
+        )
+    elif not diary_deleted_with(instance, origin):
+        kind = Tombstone.KIND_COMMENT if sender is Comment else Tombstone.KIND_IMAGE
+        Tombstone.objects.using(using).create(kind=kind, object_id=instance.pk, diary_id=instance.diary_id)
+
+
+@receiver(post_delete, sender=DiaryImage)
+def delete_image_variants(sender, instance, using, **kwargs):
+    """缩略图随图片记录一起释放；内容寻址存储下实际删除由 collect_media_blobs 完成"""
+    transaction.on_commit(partial(images.delete_variants, instance), using=using)
@@ -0,0 +1,99 @@
+"""
+日记的心情、天气与活跃度统计
+
+DiaryDailyStat 按 (用户, 日期, 心情, 天气) 记录日记数，日期取 TIME_ZONE 下的本地日期。
+日记增删改时由 signals 增量更新对应的汇总行；bulk_create、QuerySet.update() 等
+绕过信号的写入后可运行 ``python manage.py rebuild_diary_stats`` 重建。
+统计接口只读取时间窗口内的汇总行，查询量与用户的日记总数无关。
+"""
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import adjust
+from .models import Diary, DiaryDailyStat
+
+DEFAULT_DAYS = 365
+MAX_DAYS = 366 * 2
+KEY_FIELDS = ('user_id', 'created_at', 'mood', 'weather')
+
+
+def local_date(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def stat_key(diary):
+    """日记所属汇总行的键；只读 __dict__，字段未加载或尚未保存时返回 None"""
+    values = diary.__dict__
+    if any(values.get(field) is None for field in KEY_FIELDS):
+        return None
+    return values['user_id'], local_date(values['created_at']), values['mood'], values['weather']
+
+
+def add(key, delta, using):
+    """把汇总行的日记数增减 delta，行不存在时创建"""
+    user_id, date, mood, weather = key
+    rows = DiaryDailyStat.objects.using(using).filter(user_id=user_id, date=date, mood=mood, weather=weather)
+    if adjust(rows, count=delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic(using=using):
+            DiaryDailyStat.objects.using(using).create(
+                user_id=user_id, date=date, mood=mood, weather=weather, count=delta
+            )
+    except IntegrityError:
+        # 并发写入已创建同一行
+        adjust(rows, count=delta)
+
+
+def rebuild(using='default', user_ids=None, batch_size=1000):
+    """按日记表重建汇总，返回写入的行数"""
+    diaries = Diary.objects.using(using)
+    stats = DiaryDailyStat.objects.using(using)
+    if user_ids:
+        diaries = diaries.filter(user_id__in=user_ids)
+        stats = stats.filter(user_id__in=user_ids)
+    rows = diaries.annotate(date=TruncDate('created_at')).order_by().values(
+        'user_id', 'date', 'mood', 'weather'
+    ).annotate(count=Count('pk'))
+
+    total = 0
+    with transaction.atomic(using=using):
+        stats.delete()
+        iterator = (DiaryDailyStat(**row) for row in rows.iterator(chunk_size=batch_size))
+        while batch := list(islice(iterator, batch_size)):
+            DiaryDailyStat.objects.using(using).bulk_create(batch)
+            total += len(batch)
+    return total
+
+
+def summarize(user_id, start, end):
+    """汇总 [start, end] 内的日记：心情、天气分布，每日日记数与按月的心情变化"""
+    rows = DiaryDailyStat.objects.filter(
+        user_id=user_id, date__range=(start, end), count__gt=0
+    ).values_list('date', 'mood', 'weather', 'count')
+
+    moods, weather, days = Counter(), Counter(), Counter()
+    monthly = defaultdict(Counter)
+    for date, mood, weather_name, count in rows:
+        days[date] += count
+        if mood:
+            moods[mood] += count
+            monthly[date.strftime('%Y-%m')][mood] += count
+        if weather_name:
+            weather[weather_name] += count
+
+    return {
+        'start': start,
+        'end': end,
+        'total': sum(days.values()),
+        'active_days': len(days),
+        'moods': [{'mood': mood, 'count': count} for mood, count in moods.most_common()],
+        'weather': [{'weather': name, 'count': count} for name, count in weather.most_common()],
+        'heatmap': [{'date': date, 'count': days[date]} for date in sorted(days)],
+        'mood_trend': [{'month': month, 'moods': dict(monthly[month])} for month in sorted(monthly)],
+    }
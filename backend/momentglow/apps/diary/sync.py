@@ -0,0 +1,140 @@
+"""
+日记的增量同步
+
+客户端保存上次同步返回的游标，下次只取之后变化的日记、评论、图片与删除记录。
+四类记录各自按 (updated_at, id)（删除记录按 (deleted_at, id)）排序、独立推进，
+每次每类最多返回 limit 条；任一类还有剩余时 has_more 为真，客户端带上新游标
+继续请求即可，中途断开也能从上次的游标恢复。
+
+客户端应按 id 幂等地写入，评论、图片可能先于所属日记到达。删除日记时只下发
+日记的删除记录，客户端需一并删除其评论与图片。删除记录保留
+TOMBSTONE_DAYS 天，游标或 updated_since 早于该期限时返回 reset，此时本次响应
+是一次全量同步的开始，客户端需先清空本地数据。
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comment, Diary, DiaryImage, Tombstone
+from .serializers import CommentSyncSerializer, DiaryImageSyncSerializer, DiarySyncSerializer
+
+DEFAULTS = {
+    'LIMIT': 100,
+    'MAX_LIMIT': 500,
+    'TOMBSTONE_DAYS': 90,
+}
+STREAMS = ('diaries', 'comments', 'images', 'deleted')
+DELETED_KEYS = {
+    Tombstone.KIND_DIARY: 'diaries',
+    Tombstone.KIND_COMMENT: 'comments',
+    Tombstone.KIND_IMAGE: 'images',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DIARY_SYNC', {})}
+
+
+def tombstone_horizon(now=None):
+    """早于该时间的删除记录可能已被清理"""
+    return (now or timezone.now()) - timedelta(days=get_config()['TOMBSTONE_DAYS'])
+
+
+def encode_cursor(positions, synced_at):
+    data = {
+        name: [position[0].isoformat(), position[1]] if position else None
+        for name, position in positions.items()
+    }
+    data['synced_at'] = synced_at.isoformat()
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+
+
+def decode_cursor(encoded):
+    """解析游标，返回 (各类记录的位置, 同步时间)，格式不正确时抛出 ValueError"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        positions = {
+            name: (datetime.fromisoformat(data[name][0]), int(data[name][1])) if data[name] else None
+            for name in STREAMS
+        }
+        return positions, datetime.fromisoformat(data['synced_at'])
+    except (TypeError, KeyError, IndexError, AttributeError, ValueError) as exc:
+        raise ValueError('无效的游标') from exc
+
+
+def initial_positions(updated_since, now):
+    """首次同步从头读取数据、从现在开始记录删除；指定 updated_since 时都从该时间开始"""
+    if updated_since is None:
+        return {'diaries': None, 'comments': None, 'images': None, 'deleted': (now, 0)}
+    return {name: (updated_since, 0) for name in STREAMS}
+
+
+def get_streams(user):
+    """各类记录的查询集与排序时间字段"""
+    own_diaries = Diary.objects.filter(user=user)
+    return {
+        'diaries': (own_diaries.select_related('user').prefetch_related('tags'), 'updated_at'),
+        'comments': (Comment.objects.filter(diary__user=user).select_related('user'), 'updated_at'),
+        'images': (DiaryImage.objects.filter(diary__user=user), 'updated_at'),
+        'deleted': (
+            Tombstone.objects.filter(Q(user=user) | Q(diary_id__in=own_diaries.values('pk'))),
+            'deleted_at',
+        ),
+    }
+
+
+def read_stream(queryset, field, position, limit):
+    """取 position 之后的 limit 条，返回 (记录, 新位置, 是否还有剩余)"""
+    queryset = queryset.order_by(field, 'id')
+    if position is not None:
+        value, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+    # 多取一条用于判断是否还有剩余
+    rows = list(queryset[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (getattr(rows[-1], field), rows[-1].pk)
+    return rows, position, has_more
+
+
+def changes(user, context, cursor=None, updated_since=None, limit=None):
+    """返回 user 在游标之后的变化
+
+    cursor 为 decode_cursor() 的结果；cursor 与 updated_since 都为空时为全量同步的首页。
+    """
+    config = get_config()
+    limit = min(limit or config['LIMIT'], config['MAX_LIMIT'])
+    now = timezone.now()
+    if cursor:
+        positions, synced_at = cursor
+    else:
+        positions, synced_at = initial_positions(updated_since, now), updated_since or now
+
+    # 上次同步之后的删除记录可能已被清理，只能从头全量同步
+    reset = synced_at < tombstone_horizon(now)
+    if reset:
+        positions = initial_positions(None, now)
+
+    results, has_more = {}, False
+    for name, (queryset, field) in get_streams(user).items():
+        rows, positions[name], more = read_stream(queryset, field, positions[name], limit)
+        results[name] = rows
+        has_more = has_more or more
+
+    deleted = {key: [] for key in DELETED_KEYS.values()}
+    for tombstone in results['deleted']:
+        deleted[DELETED_KEYS[tombstone.kind]].append(tombstone.object_id)
+    return {
+        'diaries': DiarySyncSerializer(results['diaries'], many=True, context=context).data,
+        'comments': CommentSyncSerializer(results['comments'], many=True, context=context).data,
+        'images': DiaryImageSyncSerializer(results['images'], many=True, context=context).data,
+        'deleted': deleted,
+        'cursor': encode_cursor(positions, now),
+        'has_more': has_more,
+        'reset': reset,
+    }
@@ -0,0 +1,112 @@
+"""
+标签的批量写入与使用统计
+
+标签名唯一。保存日记时用一次查询取出已有标签，缺失的用一条
+bulk_create(ignore_conflicts=True) 插入，并发请求同时创建同名标签的冲突
+由数据库忽略，再查询一次取得它们的 ID。日记与标签的关联由 tags.add() /
+tags.set() 一次写入，m2m_changed 信号照常触发。
+
+Tag.diary_count、last_used_at 与 trending_score 由 signals 在关联增删时维护。
+热度按时间指数衰减：每次使用贡献 exp(t / DECAY_SECONDS)，t 为使用时刻的
+Unix 时间；为避免溢出，trending_score 保存其总和的对数，新增使用时在数据库中
+以 log-sum-exp 原子地累加。比较热度时直接比较该对数，因此热门标签只需按
+索引取前 N 个，不必统计关联表。
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .counters import adjust
+from .models import Diary, Tag
+
+DECAY_SECONDS = 7 * 24 * 3600
+
+
+def normalize(names):
+    """去掉首尾空白、空名与重复名，保持原有顺序"""
+    return list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+
+
+def get_or_create_tags(names, using='default'):
+    """返回 {标签名: Tag}，顺序与 normalize(names) 一致"""
+    names = normalize(names)
+    if not names:
+        return {}
+    found = {tag.name: tag for tag in Tag.objects.using(using).filter(name__in=names)}
+    missing = [name for name in names if name not in found]
+    if missing:
+        Tag.objects.using(using).bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        found.update((tag.name, tag) for tag in Tag.objects.using(using).filter(name__in=missing))
+    return {name: found[name] for name in names}
+
+
+def usage_score(when, count=1):
+    """count 次发生在 when 的使用对应的对数热度"""
+    return when.timestamp() / DECAY_SECONDS + math.log(count)
+
+
+def log_add(a, b):
+    """log(exp(a) + exp(b))，避免直接求 exp 溢出"""
+    return max(a, b) + math.log1p(math.exp(-abs(a - b)))
+
+
+def group_by_count(tag_counts):
+    """{tag_id: 次数} 按次数分组，次数相同的标签合并为一条 UPDATE"""
+    groups = defaultdict(list)
+    for tag_id, count in tag_counts.items():
+        if count > 0:
+            groups[count].append(tag_id)
+    return groups.items()
+
+
+def record_usage(tag_counts, using='default', when=None, trending=True):
+    """标签新增 {tag_id: 次数} 次使用；trending 为假时只增加次数（如导入旧日记）"""
+    when = when or timezone.now()
+    for count, tag_ids in group_by_count(tag_counts):
+        values = {'diary_count': F('diary_count') + count}
+        if trending:
+            score = Value(usage_score(when, count))
+            # 与 log_add() 相同的计算
+            values['trending_score'] = Greatest(F('trending_score'), score) + Ln(
+                Value(1.0) + Exp(Abs(F('trending_score') - score) * Value(-1.0))
+            )
+            values['last_used_at'] = when
+        Tag.objects.using(using).filter(pk__in=tag_ids).update(**values)
+
+
+def release_usage(tag_counts, using='default'):
+    """移除关联时只减少次数，热度随时间自然衰减"""
+    for count, tag_ids in group_by_count(tag_counts):
+        adjust(Tag.objects.using(using).filter(pk__in=tag_ids), diary_count=-count)
+
+
+def trending(limit):
+    return Tag.objects.filter(diary_count__gt=0).order_by('-trending_score', 'id')[:limit]
+
+
+def rebuild_usage(using='default', batch_size=1000):
+    """按关联表与日记的创建时间重算全部标签的使用次数与热度，返回有使用记录的标签数"""
+    rows = Diary.tags.through.objects.using(using).order_by().values_list('tag_id', 'diary__created_at')
+    usage = {}
+    for tag_id, created_at in rows.iterator(chunk_size=batch_size):
+        score = usage_score(created_at)
+        if tag_id in usage:
+            count, last_used_at, total = usage[tag_id]
+            usage[tag_id] = (count + 1, max(last_used_at, created_at), log_add(total, score))
+        else:
+            usage[tag_id] = (1, created_at, score)
+
+    tags = [
+        Tag(pk=tag_id, diary_count=count, last_used_at=last_used_at, trending_score=score)
+        for tag_id, (count, last_used_at, score) in usage.items()
+    ]
+    with transaction.atomic(using=using):
+        Tag.objects.using(using).update(diary_count=0, last_used_at=None, trending_score=0)
+        Tag.objects.using(using).bulk_update(
+            tags, ['diary_count', 'last_used_at', 'trending_score'], batch_size=batch_size
+        )
+    return len(tags)
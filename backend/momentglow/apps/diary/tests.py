@@ -1,3 +1,1337 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.http import HttpResponse
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from PIL import ExifTags, Image
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from momentglow import db, metrics
+from momentglow.apps.user.models import CustomUser
+from . import tags as tags_module
+from .models import Diary, DiaryImage, Tag, Comment, Tombstone
+from .feed_cache import public_feed_cache
+from .management.commands import benchmark_api
+from .pagination import CommentThreadPagination
+
+
+class DiaryTestCase(APITestCase):
+    def setUp(self):
+        # 公开日记流缓存在测试之间共享，且测试事务不会触发 on_commit 失效
+        cache.clear()
+
+
+class DiaryKeysetPaginationTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        now = timezone.now()
+        # 25 篇公开日记，其中两两共享同一 created_at，用于验证 id 作为次序键
+        for i in range(25):
+            diary = Diary.objects.create(
+                user=self.user, title=f'日记{i}', content='内容', is_public=True,
+                mood='happy' if i % 2 else 'sad',
+            )
+            Diary.objects.filter(pk=diary.pk).update(created_at=now - timedelta(minutes=i // 2))
+
+    def collect(self, url, params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            data = response.data['data']
+            self.assertNotIn('count', data)
+            ids.extend(item['id'] for item in data['results'])
+            if not data['next']:
+                return ids
+            response = self.client.get(data['next'])
+
+    def test_public_cursor_walks_all_pages_in_order(self):
+        ids = self.collect('/api/diaries/public/', {'cursor': ''})
+        expected = list(
+            Diary.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_public_cursor_keeps_filters(self):
+        ids = self.collect('/api/diaries/public/', {'cursor': '', 'mood': 'happy'})
+        expected = list(
+            Diary.objects.filter(mood='happy').order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_list_cursor_requires_own_diaries(self):
+        self.client.force_authenticate(self.user)
+        ids = self.collect('/api/diaries/', {'cursor': ''})
+        self.assertEqual(len(ids), 25)
+
+    def test_page_number_is_default(self):
+        response = self.client.get('/api/diaries/public/')
+        self.assertEqual(response.data['data']['count'], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/diaries/public/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class DiarySummarySerializerTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='bob', password='pass1234')
+        self.diary = Diary.objects.create(
+            user=self.user, title='长日记', is_public=True,
+            content='<p>' + '今天天气很好。' * 40 + '</p>',
+        )
+        for i in range(3):
+            Comment.objects.create(diary=self.diary, user=self.user, content=f'评论{i}')
+        for i in range(2):
+            DiaryImage.objects.create(diary=self.diary, image=f'diary_images/{i}.jpg')
+
+    def test_public_returns_summary(self):
+        response = self.client.get('/api/diaries/public/')
+        item = response.data['data']['results'][0]
+        self.assertNotIn('content', item)
+        self.assertNotIn('comments', item)
+        self.assertEqual(item['comment_count'], 3)
+        self.assertEqual(item['image_count'], 2)
+        self.assertTrue(item['cover_image'].endswith('/media/diary_images/0.jpg'))
+        self.assertEqual(item['user']['avatar_url'], 'http://testserver/media/default.jpg')
+        self.assertTrue(item['excerpt'].startswith('今天天气很好。'))
+        self.assertTrue(item['excerpt'].endswith('...'))
+        self.assertNotIn('<', item['excerpt'])
+
+    def test_retrieve_keeps_full_payload(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/diaries/{self.diary.pk}/')
+        data = response.data['data']
+        self.assertEqual(data['content'], self.diary.content)
+        # 评论不内嵌，由评论接口分页获取
+        self.assertNotIn('comments', data)
+        self.assertEqual(data['comment_count'], 3)
+        self.assertEqual(len(data['images']), 2)
+
+
+class DiaryQueryBudgetTests(DiaryTestCase):
+    """各读取接口的查询次数必须与页面内容无关"""
+
+    def make_diaries(self, count, comments=3, images=2, tags=2):
+        diaries = []
+        for i in range(count):
+            diary = Diary.objects.create(
+                user=self.author, title=f'日记{i}', content='内容', is_public=True,
+            )
+            for j in range(tags):
+                diary.tags.add(self.tags[j])
+            for j in range(comments):
+                commenter = self.commenters[j % len(self.commenters)]
+                Comment.objects.create(diary=diary, user=commenter, content=f'评论{j}')
+            for j in range(images):
+                DiaryImage.objects.create(diary=diary, image=f'diary_images/{i}_{j}.jpg')
+            diaries.append(diary)
+        return diaries
+
+    def setUp(self):
+        super().setUp()
+        self.author = CustomUser.objects.create_user(username='author', password='pass1234')
+        self.commenters = [
+            CustomUser.objects.create_user(username=f'commenter{i}', password='pass1234')
+            for i in range(3)
+        ]
+        self.tags = [Tag.objects.create(name=f'标签{i}') for i in range(3)]
+        self.client.force_authenticate(self.author)
+
+    def assert_budget(self, budget, url, params=None, sizes=((1, 1), (8, 6))):
+        for diary_count, comment_count in sizes:
+            with self.subTest(diaries=diary_count, comments=comment_count):
+                Diary.objects.all().delete()
+                diaries = self.make_diaries(diary_count, comments=comment_count)
+                target = url(diaries) if callable(url) else url
+                query = params(diaries) if callable(params) else params
+                cache.clear()
+                with self.assertNumQueries(budget):
+                    response = self.client.get(target, query)
+                self.assertEqual(response.status_code, 200)
+
+    def test_list(self):
+        # COUNT + 分页数据 + tags 预取
+        self.assert_budget(3, '/api/diaries/')
+
+    def test_list_cursor(self):
+        # 分页数据 + tags 预取
+        self.assert_budget(2, '/api/diaries/', {'cursor': ''})
+
+    def test_public(self):
+        self.assert_budget(3, '/api/diaries/public/')
+
+    def test_retrieve(self):
+        # 日记 + tags + images
+        self.assert_budget(3, lambda diaries: f'/api/diaries/{diaries[0].pk}/')
+
+    def test_tag_diaries(self):
+        # 标签 + COUNT + 日记 + tags 预取
+        self.assert_budget(4, f'/api/diaries/tags/{self.tags[0].pk}/diaries/')
+
+    def test_comments(self):
+        # 日记可见性 + 一页评论（含评论者）
+        self.assert_budget(2, '/api/diaries/comments/', lambda diaries: {'diary': diaries[0].pk})
+
+
+class DiaryFullTextSearchTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='carol', password='pass1234')
+        self.client.force_authenticate(self.user)
+        self.in_title = Diary.objects.create(user=self.user, title='西湖游记', content='<p>天气晴朗</p>')
+        self.in_content = Diary.objects.create(user=self.user, title='周末', content='<p>和朋友去了西湖散步</p>')
+        self.other = Diary.objects.create(user=self.user, title='Reading', content='Finished a good BOOK today')
+
+    def search(self, term, url='/api/diaries/'):
+        response = self.client.get(url, {'search': term})
+        return [item['id'] for item in response.data['data']['results']]
+
+    def test_cjk_search_ranks_title_first(self):
+        self.assertEqual(self.search('西湖'), [self.in_title.pk, self.in_content.pk])
+
+    def test_single_cjk_character(self):
+        self.assertEqual(self.search('晴'), [self.in_title.pk])
+
+    def test_latin_search_is_case_insensitive(self):
+        self.assertEqual(self.search('book'), [self.other.pk])
+
+    def test_markup_is_not_indexed(self):
+        self.assertEqual(self.search('p'), [])
+
+    def test_index_follows_update_and_delete(self):
+        self.in_content.content = '在家看书'
+        self.in_content.save()
+        self.assertEqual(self.search('西湖'), [self.in_title.pk])
+        self.in_title.delete()
+        self.assertEqual(self.search('西湖'), [])
+
+    def test_public_search(self):
+        Diary.objects.filter(pk=self.in_content.pk).update(is_public=True)
+        self.in_content.refresh_from_db()
+        self.assertEqual(self.search('西湖', '/api/diaries/public/'), [self.in_content.pk])
+
+
+class PublicFeedCacheTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = CustomUser.objects.create_user(username='dave', password='pass1234')
+        self.other = CustomUser.objects.create_user(username='erin', password='pass1234')
+        self.diary = Diary.objects.create(user=self.author, title='晴天', content='内容', mood='happy', is_public=True)
+        Diary.objects.create(user=self.other, title='雨天', content='内容', mood='sad', is_public=True)
+
+    def fetch(self, params=None):
+        return self.client.get('/api/diaries/public/', params)
+
+    def test_repeated_request_is_served_from_cache(self):
+        self.fetch()
+        with self.assertNumQueries(0):
+            response = self.fetch()
+        self.assertEqual(len(response.data['data']['results']), 2)
+        stats = public_feed_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['rebuilds']), (1, 1, 1))
+
+    def test_uncacheable_requests_bypass_cache(self):
+        for params in ({'page': 4}, {'timeRange': '2020-01-01,2030-01-01'}, {'search': '晴天'}):
+            self.fetch(params)
+        self.assertEqual(public_feed_cache.stats()['rebuilds'], 0)
+
+    def test_comment_invalidates_affected_variants_only(self):
+        self.fetch()
+        self.fetch({'mood': 'sad'})
+        self.fetch({'user_id': self.author.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(diary=self.diary, user=self.other, content='好')
+
+        response = self.fetch({'user_id': self.author.pk})
+        self.assertEqual(response.data['data']['results'][0]['comment_count'], 1)
+        with self.assertNumQueries(0):
+            self.fetch({'mood': 'sad'})
+        self.assertEqual(self.fetch().data['data']['results'][-1]['comment_count'], 1)
+
+    def test_unpublishing_invalidates(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.diary.is_public = False
+            self.diary.save()
+        self.assertEqual(len(self.fetch().data['data']['results']), 1)
+
+    def test_diary_delete_invalidates_once(self):
+        for i in range(5):
+            Comment.objects.create(diary=self.diary, user=self.other, content=str(i))
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with CaptureQueriesContext(connection) as ctx:
+                self.diary.delete()
+        # 级联删除的评论不再逐条查询所属日记
+        lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT "diary_diary"."user_id"')]
+        self.assertFalse(lookups)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(self.fetch().data['data']['results']), 1)
+
+    def test_author_changes_invalidate(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomUser.objects.get(pk=self.author.pk).save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.fetch()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.username = 'dave2'
+            self.author.save()
+        authors = [item['user']['username'] for item in self.fetch().data['data']['results']]
+        self.assertIn('dave2', authors)
+
+    def test_tag_rename_invalidates(self):
+        tag = Tag.objects.create(name='旅行')
+        self.diary.tags.add(tag)
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = '出行'
+            tag.save()
+        tags = [t['name'] for item in self.fetch().data['data']['results'] for t in item['tags']]
+        self.assertEqual(tags, ['出行'])
+
+    def test_private_diary_writes_keep_cache(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            Diary.objects.create(user=self.author, title='私密', content='内容')
+        with self.assertNumQueries(0):
+            self.fetch()
+
+
+class ConditionalGetTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='frank', password='pass1234')
+        self.diary = Diary.objects.create(user=self.user, title='晴天', content='内容', is_public=True)
+        self.comment = Comment.objects.create(diary=self.diary, user=self.user, content='好')
+        self.client.force_authenticate(self.user)
+
+    def assert_not_modified(self, url, params=None, queries=1):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_retrieve(self):
+        url = f'/api/diaries/{self.diary.pk}/'
+        etag = self.assert_not_modified(url)
+
+        # 评论修改不会更新日记的 updated_at，但会改变 ETag
+        self.comment.content = '很好'
+        self.comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_author_change_updates_etag(self):
+        url = f'/api/diaries/{self.diary.pk}/'
+        etag = self.assert_not_modified(url)
+        self.user.avatar = 'avatars/new.jpg'
+        self.user.save(update_fields=['avatar'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_and_cursor(self):
+        etag = self.assert_not_modified('/api/diaries/', queries=2)
+        self.assert_not_modified('/api/diaries/', {'cursor': ''})
+
+        Diary.objects.create(user=self.user, title='雨天', content='内容')
+        response = self.client.get('/api/diaries/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['count'], 2)
+
+    def test_filter_params_change_etag(self):
+        first = self.client.get('/api/diaries/public/')['ETag']
+        self.assertNotEqual(first, self.client.get('/api/diaries/public/', {'mood': 'sad'})['ETag'])
+
+    def test_cached_public_feed_validates_without_queries(self):
+        self.assert_not_modified('/api/diaries/public/', queries=0)
+        # 不可缓存的请求查询版本信息后返回 304
+        self.assert_not_modified('/api/diaries/public/', {'search': '晴天'}, queries=2)
+
+    def test_if_modified_since(self):
+        url = f'/api/diaries/{self.diary.pk}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class FastJSONRendererTests(DiaryTestCase):
+    def test_matches_drf_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+        from momentglow.renderers import FastJSONRenderer
+        from .management.commands.benchmark_json_rendering import make_feed_payload
+
+        payload = make_feed_payload(3)
+        payload['results'][0]['title'] = '换行\u2028分隔'
+        payload['generated_at'] = timezone.now()
+        self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+    def test_envelope_keeps_view_headers(self):
+        diary = Diary.objects.create(
+            user=CustomUser.objects.create_user(username='grace', password='pass1234'),
+            title='晴天', content='内容', is_public=True,
+        )
+        response = self.client.get('/api/diaries/public/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('ETag', response)
+        body = response.json()
+        self.assertEqual((body['code'], body['errMsg']), (0, ''))
+        self.assertEqual(body['data']['results'][0]['id'], diary.pk)
+
+
+class AsyncViewTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='judy', password='pass1234')
+        self.diary = Diary.objects.create(user=self.user, title='晴天', content='内容', is_public=True)
+        self.url = f'/api/diaries/{self.diary.pk}/'
+
+    def test_read_endpoints_are_async(self):
+        for url in ('/api/diaries/public/', self.url, f'/api/users/profiles/{self.user.pk}/',
+                    f'/api/users/avatar/{self.user.pk}/'):
+            with self.subTest(url=url):
+                self.assertTrue(iscoroutinefunction(resolve(url).func))
+
+    def test_jwt_authentication(self):
+        token = AccessToken.for_user(self.user)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['title'], '晴天')
+
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_is_not_accessed_in_event_loop(self):
+        blocking = []
+
+        def watch(name):
+            method = getattr(LocMemCache, name)
+
+            def wrapper(cache, *args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    pass
+                else:
+                    blocking.append(name)
+                return method(cache, *args, **kwargs)
+            return mock.patch.object(LocMemCache, name, wrapper)
+
+        token = AccessToken.for_user(self.user)
+        with watch('get'), watch('set'), watch('add'), watch('incr'):
+            for _ in range(2):
+                self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 200)
+                self.assertEqual(self.client.get('/api/diaries/public/').status_code, 200)
+        self.assertEqual(blocking, [])
+
+    def test_other_users_diary_not_found(self):
+        other = CustomUser.objects.create_user(username='mallory', password='pass1234')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_writes_fall_back_to_viewset(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.put(self.url, {'title': '雨天', 'content': '内容'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['title'], '雨天')
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(Diary.objects.filter(pk=self.diary.pk).exists())
+
+
+class CounterTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.other = CustomUser.objects.create_user(username='bob', password='pass1234')
+        self.diary = Diary.objects.create(user=self.user, title='日记', content='内容', is_public=True)
+
+    def assertCounts(self, user, diary_count, public_diary_count):
+        user.refresh_from_db()
+        self.assertEqual((user.diary_count, user.public_diary_count), (diary_count, public_diary_count))
+
+    def test_child_counts(self):
+        comments = [Comment.objects.create(diary=self.diary, user=self.other, content=str(i)) for i in range(3)]
+        comments[0].delete()
+        self.diary.refresh_from_db()
+        self.assertEqual(self.diary.comment_count, 2)
+        self.assertEqual(self.diary.image_count, 0)
+
+    def test_cascade_skips_counts_of_deleted_diary(self):
+        for i in range(5):
+            Comment.objects.create(diary=self.diary, user=self.other, content=str(i))
+        other_diary = Diary.objects.create(user=self.user, title='另一篇', content='内容')
+        Comment.objects.create(diary=other_diary, user=self.other, content='评论')
+        with CaptureQueriesContext(connection) as ctx:
+            self.diary.delete()
+        self.assertFalse([q for q in ctx.captured_queries if 'comment_count' in q['sql']])
+
+        # 删除评论者时，其他日记上的评论仍需更新计数
+        self.other.delete()
+        other_diary.refresh_from_db()
+        self.assertEqual(other_diary.comment_count, 0)
+
+    def test_user_counts(self):
+        self.assertCounts(self.user, 1, 1)
+        private = Diary.objects.create(user=self.user, title='私密', content='内容')
+        self.assertCounts(self.user, 2, 1)
+
+        private.is_public = True
+        private.save()
+        self.assertCounts(self.user, 2, 2)
+        # 只保存其他字段时不改变计数
+        private.title = '改名'
+        private.save(update_fields=['title'])
+        self.assertCounts(self.user, 2, 2)
+
+        private.user = self.other
+        private.save()
+        self.assertCounts(self.user, 1, 1)
+        self.assertCounts(self.other, 1, 1)
+
+        self.diary.delete()
+        self.assertCounts(self.user, 0, 0)
+
+    def test_counts_in_responses(self):
+        Comment.objects.create(diary=self.diary, user=self.other, content='评论')
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/diaries/{self.diary.pk}/')
+        self.assertEqual(response.data['data']['comment_count'], 1)
+        response = self.client.get(f'/api/users/profiles/{self.user.pk}/')
+        self.assertEqual(response.data['data']['diary_count'], 1)
+        self.assertEqual(response.data['data']['public_diary_count'], 1)
+
+    def test_repair_counters(self):
+        # bulk_create 与 update() 不触发信号，计数产生偏差
+        Comment.objects.bulk_create([Comment(diary=self.diary, user=self.other, content='评论') for _ in range(2)])
+        Diary.objects.filter(pk=self.diary.pk).update(is_public=False)
+        out = StringIO()
+        call_command('repair_counters', '--dry-run', stdout=out)
+        self.assertIn('Diary.comment_count: 1 行有偏差', out.getvalue())
+        self.assertIn('CustomUser.public_diary_count: 1 行有偏差', out.getvalue())
+        self.diary.refresh_from_db()
+        self.assertEqual(self.diary.comment_count, 0)
+
+        call_command('repair_counters', stdout=StringIO())
+        self.diary.refresh_from_db()
+        self.assertEqual(self.diary.comment_count, 2)
+        self.assertCounts(self.user, 1, 0)
+        out = StringIO()
+        call_command('repair_counters', '--dry-run', stdout=out)
+        self.assertIn('共 0 行有偏差', out.getvalue())
+
+
+class DiaryStatsTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.client.force_authenticate(self.user)
+        for mood, weather in (('happy', 'sunny'), ('happy', 'rainy'), ('sad', 'rainy')):
+            Diary.objects.create(user=self.user, title='日记', content='内容', mood=mood, weather=weather)
+        diary = Diary.objects.create(user=self.user, title='旧日记', content='内容', mood='calm')
+        # update() 不触发信号，随后重建汇总
+        Diary.objects.filter(pk=diary.pk).update(created_at=timezone.now() - timedelta(days=40))
+        self.diary = Diary.objects.get(pk=diary.pk)
+        call_command('rebuild_diary_stats', stdout=StringIO())
+
+    def fetch(self, **params):
+        response = self.client.get('/api/diaries/stats/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_summary(self):
+        data = self.fetch()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(data['active_days'], 2)
+        self.assertEqual(data['moods'][0], {'mood': 'happy', 'count': 2})
+        self.assertEqual(data['weather'], [{'weather': 'rainy', 'count': 2}, {'weather': 'sunny', 'count': 1}])
+        self.assertEqual(data['heatmap'][-1], {'date': timezone.localdate(), 'count': 3})
+        self.assertEqual(self.fetch(days=7)['total'], 3)
+
+    def test_incremental_updates(self):
+        self.diary.mood = 'happy'
+        self.diary.save()
+        self.assertEqual(self.fetch()['moods'][0], {'mood': 'happy', 'count': 3})
+        self.diary.delete()
+        Diary.objects.filter(mood='sad').get().delete()
+        data = self.fetch()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['moods'], [{'mood': 'happy', 'count': 2}])
+
+    def test_query_count_independent_of_history(self):
+        with self.assertNumQueries(1):
+            self.fetch()
+        for i in range(20):
+            diary = Diary.objects.create(user=self.user, title='日记', content='内容', mood='happy')
+            Diary.objects.filter(pk=diary.pk).update(created_at=timezone.now() - timedelta(days=i * 30))
+        call_command('rebuild_diary_stats', '--user', str(self.user.pk), stdout=StringIO())
+        with self.assertNumQueries(1):
+            self.fetch()
+
+    def test_invalid_days(self):
+        response = self.client.get('/api/diaries/stats/', {'days': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DeltaSyncTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.other = CustomUser.objects.create_user(username='bob', password='pass1234')
+        self.client.force_authenticate(self.user)
+        self.diaries = [
+            Diary.objects.create(user=self.user, title=f'日记{i}', content='内容') for i in range(3)
+        ]
+        Diary.objects.create(user=self.other, title='别人的日记', content='内容')
+        self.comment = Comment.objects.create(diary=self.diaries[0], user=self.other, content='评论')
+
+    def fetch(self, **params):
+        response = self.client.get('/api/diaries/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_full_then_delta(self):
+        data = self.fetch()
+        self.assertEqual([d['id'] for d in data['diaries']], [d.pk for d in self.diaries])
+        self.assertEqual([c['id'] for c in data['comments']], [self.comment.pk])
+        self.assertNotIn('comments', data['diaries'][0])
+        self.assertFalse(data['has_more'])
+
+        # 没有变化时不返回任何记录
+        empty = self.fetch(cursor=data['cursor'])
+        self.assertEqual((empty['diaries'], empty['comments'], empty['images']), ([], [], []))
+
+        self.diaries[1].title = '改过的标题'
+        self.diaries[1].save()
+        comment_id, diary_id = self.comment.pk, self.diaries[2].pk
+        self.comment.delete()
+        self.diaries[2].delete()
+        delta = self.fetch(cursor=empty['cursor'])
+        self.assertEqual([d['title'] for d in delta['diaries']], ['改过的标题'])
+        self.assertEqual(delta['deleted'], {'diaries': [diary_id], 'comments': [comment_id], 'images': []})
+
+    def test_bounded_and_resumable(self):
+        seen, cursor = [], None
+        while True:
+            data = self.fetch(limit=2, **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(data['diaries']), 2)
+            seen += [d['id'] for d in data['diaries']]
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [d.pk for d in self.diaries])
+
+    def test_updated_since(self):
+        Diary.objects.filter(pk=self.diaries[0].pk).update(updated_at=timezone.now() - timedelta(days=1))
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+        data = self.fetch(updated_since=since)
+        self.assertEqual([d['id'] for d in data['diaries']], [d.pk for d in self.diaries[1:]])
+        self.assertFalse(data['reset'])
+
+        # 早于删除记录保留期时要求客户端全量同步
+        data = self.fetch(updated_since=(timezone.now() - timedelta(days=365)).isoformat())
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['diaries']), 3)
+
+    def test_invalid_params(self):
+        for params in ({'cursor': 'bad'}, {'updated_since': 'yesterday'}, {'limit': 'x'}):
+            self.assertEqual(self.client.get('/api/diaries/sync/', params).status_code, 400)
+
+    def test_cascade_records_diary_tombstone_only(self):
+        DiaryImage.objects.create(diary=self.diaries[0], image='a.jpg')
+        self.diaries[0].delete()
+        self.assertEqual(list(Tombstone.objects.values_list('kind', flat=True)), [Tombstone.KIND_DIARY])
+
+    def test_prune_tombstones(self):
+        self.comment.delete()
+        self.diaries[0].delete()
+        call_command('prune_tombstones', stdout=StringIO())
+        # 所属日记已删除的评论删除记录被清理，日记的删除记录保留
+        self.assertEqual(list(Tombstone.objects.values_list('kind', flat=True)), [Tombstone.KIND_DIARY])
+
+
+@override_settings(DIARY_IMAGE_PIPELINE={'SYNC': True, 'WIDTHS': (320,)}, DIARY_ARCHIVE={'CHUNK_SIZE': 2})
+class DiaryArchiveTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.client.force_authenticate(self.user)
+        tag = Tag.objects.create(name='旅行')
+        for i in range(3):
+            diary = Diary.objects.create(
+                user=self.user, title=f'日记{i}', content='内容', mood='happy', is_public=i == 0
+            )
+            diary.tags.add(tag)
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, format='JPEG')
+        DiaryImage.objects.create(diary=diary, image=SimpleUploadedFile('photo.jpg', buffer.getvalue()))
+
+    def export(self):
+        response = self.client.get('/api/diaries/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        return b''.join(response.streaming_content)
+
+    def test_export_archive(self):
+        with zipfile.ZipFile(BytesIO(self.export())) as archive:
+            lines = archive.read('diaries.ndjson').decode().splitlines()
+            records = [json.loads(line) for line in lines]
+            self.assertEqual([r['title'] for r in records], ['日记0', '日记1', '日记2'])
+            self.assertEqual(records[0]['tags'], ['旅行'])
+            image_path = records[2]['images'][0]
+            self.assertEqual(archive.read(image_path)[:2], b'\xff\xd8')
+            self.assertEqual(json.loads(archive.read('manifest.json'))['diaries'], 3)
+
+    def test_import_round_trip(self):
+        data = self.export()
+        other = CustomUser.objects.create_user(username='bob', password='pass1234')
+        self.client.force_authenticate(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/diaries/import/', {'file': SimpleUploadedFile('export.zip', data)}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data'], {'diaries': 3, 'images': 1})
+
+        imported = Diary.objects.filter(user=other).order_by('created_at')
+        self.assertEqual([d.title for d in imported], ['日记0', '日记1', '日记2'])
+        self.assertEqual(
+            [d.created_at for d in imported],
+            list(Diary.objects.filter(user=self.user).order_by('created_at').values_list('created_at', flat=True))
+        )
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertEqual(imported[0].tags.get().name, '旅行')
+        self.assertEqual(imported[2].image_count, 1)
+        self.assertEqual(imported[2].images.get().processing_status, DiaryImage.STATUS_READY)
+        other.refresh_from_db()
+        self.assertEqual((other.diary_count, other.public_diary_count), (3, 1))
+        self.assertEqual(self.client.get('/api/diaries/stats/').data['data']['total'], 3)
+        self.assertEqual(self.client.get('/api/diaries/', {'search': '日记1'}).data['data']['count'], 1)
+
+    def test_import_skips_non_images(self):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'blue').save(buffer, format='PNG')
+        data = BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('diaries.ndjson', json.dumps({
+                'title': '附件', 'content': '内容', 'is_public': True,
+                'images': ['images/evil.html', 'images/photo.jpg'],
+            }) + '\n')
+            archive.writestr('images/evil.html', '<script>alert(1)</script>')
+            # 扩展名与实际格式不符
+            archive.writestr('images/photo.jpg', buffer.getvalue())
+        response = self.client.post(
+            '/api/diaries/import/', {'file': SimpleUploadedFile('export.zip', data.getvalue())}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201)
+        image = DiaryImage.objects.get(diary__title='附件')
+        self.assertTrue(image.image.name.endswith('.png'))
+
+    def test_import_ndjson_rejects_invalid_line(self):
+        lines = '{"title": "好", "content": "内容"}\n{"title": "缺少正文"}\n'
+        response = self.client.post(
+            '/api/diaries/import/', {'file': SimpleUploadedFile('diaries.ndjson', lines.encode())},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data']['line'], '2')
+        self.assertEqual(Diary.objects.filter(title='好').count(), 0)
+
+
+class DiaryTagUpsertTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(name='旅行')
+
+    def create(self, names):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/diaries/', {
+                'title': '日记', 'content': '内容', 'tags': [{'name': name} for name in names],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Diary.objects.get(pk=response.data['data']['id']), len(queries)
+
+    def test_create_reuses_existing_and_dedupes(self):
+        diary, _ = self.create(['旅行', '美食', ' 美食 ', '旅行'])
+        self.assertEqual(sorted(diary.tags.values_list('name', flat=True)), ['旅行', '美食'])
+        self.assertEqual(Tag.objects.filter(name='旅行').count(), 1)
+
+    def test_query_count_independent_of_tag_count(self):
+        # 首篇日记会额外创建当天的统计行
+        self.create(['x'])
+        _, few = self.create(['a', 'b'])
+        _, many = self.create([f'tag{i}' for i in range(20)] + ['a'])
+        self.assertEqual(few, many)
+
+    def test_update_replaces_tags(self):
+        diary, _ = self.create(['旅行', '美食'])
+        url = f'/api/diaries/{diary.pk}/'
+        response = self.client.put(url, {'title': '日记', 'content': '内容', 'tags': [{'name': '读书'}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(diary.tags.values_list('name', flat=True)), ['读书'])
+        # 不传 tags 时保留
+        self.client.put(url, {'title': '改名', 'content': '内容'}, format='json')
+        self.assertEqual(diary.tags.count(), 1)
+        self.client.put(url, {'title': '改名', 'content': '内容', 'tags': []}, format='json')
+        self.assertEqual(diary.tags.count(), 0)
+
+    def test_tag_endpoint_rejects_duplicate(self):
+        response = self.client.post('/api/diaries/tags/', {'name': '旅行'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TagUsageTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        self.travel, self.food, self.books = (Tag.objects.create(name=name) for name in ('旅行', '美食', '读书'))
+
+    def usage(self, tag):
+        tag.refresh_from_db()
+        return tag.diary_count
+
+    def test_counts_follow_links(self):
+        diary = Diary.objects.create(user=self.user, title='a', content='b')
+        diary.tags.add(self.travel, self.food)
+        self.assertEqual((self.usage(self.travel), self.usage(self.food)), (1, 1))
+        self.assertIsNotNone(self.travel.last_used_at)
+
+        diary.tags.set([self.food, self.books])
+        self.assertEqual([self.usage(tag) for tag in (self.travel, self.food, self.books)], [0, 1, 1])
+        self.books.diary_set.remove(diary)
+        self.assertEqual(self.usage(self.books), 0)
+        diary.tags.clear()
+        self.assertEqual(self.usage(self.food), 0)
+
+        diary.tags.add(self.travel)
+        other = Diary.objects.create(user=self.user, title='c', content='d')
+        self.travel.diary_set.add(other)
+        self.assertEqual(self.usage(self.travel), 2)
+        diary.delete()
+        self.assertEqual(self.usage(self.travel), 1)
+
+    def test_trending_prefers_recent_use(self):
+        diary = Diary.objects.create(user=self.user, title='a', content='b')
+        diary.tags.add(self.travel, self.food)
+        # 旅行较早被大量使用，美食最近被使用
+        tags_module.record_usage({self.travel.pk: 5}, when=timezone.now() - timedelta(days=60))
+        tags_module.record_usage({self.food.pk: 2})
+
+        response = self.client.get('/api/diaries/tags/trending/', {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data['data']], ['美食', '旅行'])
+        self.assertEqual(response.data['data'][1]['diary_count'], 6)
+        self.assertEqual(self.client.get('/api/diaries/tags/trending/', {'limit': 'x'}).status_code, 400)
+
+    def test_rebuild_matches_links(self):
+        diary = Diary.objects.create(user=self.user, title='a', content='b')
+        diary.tags.add(self.travel)
+        maintained = Tag.objects.get(pk=self.travel.pk).trending_score
+        Tag.objects.update(diary_count=7, trending_score=0)
+        call_command('rebuild_tag_usage', stdout=StringIO())
+        self.assertEqual([self.usage(tag) for tag in (self.travel, self.food)], [1, 0])
+        # 重建按日记创建时间计算，与保存时记录的热度几乎相同
+        self.assertAlmostEqual(self.travel.trending_score, maintained, places=3)
+
+    def test_tag_feed_paginates_public_diaries(self):
+        for i in range(12):
+            Diary.objects.create(user=self.user, title=f'公开{i}', content='x', is_public=True).tags.add(self.travel)
+        Diary.objects.create(user=self.user, title='私密', content='x').tags.add(self.travel)
+        Diary.objects.create(user=self.user, title='其他', content='x', is_public=True).tags.add(self.food)
+        url = f'/api/diaries/tags/{self.travel.pk}/diaries/'
+
+        page = self.client.get(url).data['data']
+        self.assertEqual(page['count'], 12)
+        self.assertEqual(len(page['results']), 10)
+
+        page = self.client.get(url, {'cursor': ''}).data['data']
+        titles = [item['title'] for item in page['results']]
+        page = self.client.get(page['next']).data['data']
+        titles += [item['title'] for item in page['results']]
+        self.assertIsNone(page['next'])
+        self.assertEqual(titles, [f'公开{i}' for i in reversed(range(12))])
+
+
+class CommentThreadTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = CustomUser.objects.create_user(username='author', password='pass1234')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pass1234')
+        self.diary = Diary.objects.create(user=self.author, title='公开', content='x', is_public=True)
+        self.client.force_authenticate(self.reader)
+
+    def comment(self, content, parent=None, diary=None):
+        return Comment.objects.create(diary=diary or self.diary, user=self.reader, content=content, parent=parent)
+
+    def contents(self, url, params=None):
+        return [item['content'] for item in self.client.get(url, params).data['data']['results']]
+
+    def test_thread_in_display_order(self):
+        first = self.comment('1')
+        second = self.comment('2')
+        reply = self.comment('1.1', first)
+        self.comment('1.1.1', reply)
+        self.comment('2.1', second)
+        self.comment('1.2', first)
+
+        url = '/api/diaries/comments/'
+        self.assertEqual(self.contents(url, {'diary': self.diary.pk}), ['1', '1.1', '1.1.1', '1.2', '2', '2.1'])
+        self.assertEqual(self.contents(f'{url}{first.pk}/thread/'), ['1', '1.1', '1.1.1', '1.2'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_subtree_is_single_query(self):
+        root = self.comment('root')
+        for i in range(5):
+            self.comment(str(i), self.comment(f'r{i}', root))
+        self.comment('other')
+        # 根评论（含可见性检查）+ 子树一页
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/diaries/comments/{root.pk}/thread/')
+        self.assertEqual(len(response.data['data']['results']), 11)
+
+    def test_subtree_bounds(self):
+        root = self.comment('root')
+        reply = self.comment('reply', self.comment('child', root))
+        sibling = self.comment('sibling')
+        lower, upper = Comment.subtree_bounds(root.path)
+        self.assertTrue(lower <= reply.path < upper)
+        self.assertFalse(lower <= sibling.path < upper)
+        # 上界只含数字，不依赖数据库排序规则对标点的处理
+        self.assertTrue(upper.isdigit())
+        self.assertEqual(Comment.subtree_bounds('0000000009'), ('0000000009', '0000000010'))
+
+    def test_path_written_atomically(self):
+        with mock.patch.object(Comment._base_manager, 'using', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.comment('broken')
+        self.assertFalse(Comment.objects.filter(content='broken').exists())
+
+    def test_cursor_pagination(self):
+        page_size = CommentThreadPagination.page_size
+        for i in range(page_size + 1):
+            self.comment(str(i))
+        page = self.client.get('/api/diaries/comments/', {'diary': self.diary.pk}).data['data']
+        self.assertEqual(len(page['results']), page_size)
+        page = self.client.get(page['next']).data['data']
+        self.assertEqual([item['content'] for item in page['results']], [str(page_size)])
+        self.assertIsNone(page['next'])
+        response = self.client.get('/api/diaries/comments/', {'diary': self.diary.pk, 'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_depth_is_capped(self):
+        parent = None
+        for i in range(Comment.MAX_DEPTH + 2):
+            parent = self.comment(str(i), parent)
+        self.assertEqual(parent.depth, Comment.MAX_DEPTH - 1)
+        self.assertEqual(len(parent.path), Comment.MAX_DEPTH * Comment.PATH_STEP)
+
+    def test_create_reply(self):
+        parent = self.comment('楼主')
+        response = self.client.post('/api/diaries/comments/', {'content': '回复', 'parent': parent.pk})
+        self.assertEqual(response.status_code, 201)
+        reply = Comment.objects.get(pk=response.data['data']['id'])
+        self.assertEqual((reply.diary_id, reply.user, reply.depth), (self.diary.pk, self.reader, 1))
+        self.assertTrue(reply.path.startswith(parent.path))
+
+        other = Diary.objects.create(user=self.author, title='另一篇', content='x', is_public=True)
+        response = self.client.post(
+            f'/api/diaries/{other.pk}/add_comment/', {'content': '串楼', 'parent': parent.pk}
+        )
+        self.assertEqual(response.status_code, 404)  # 只能在自己的日记下使用 add_comment
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            f'/api/diaries/{other.pk}/add_comment/', {'content': '串楼', 'parent': parent.pk}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_private_diary_comments_hidden(self):
+        private = Diary.objects.create(user=self.author, title='私密', content='x')
+        comment = Comment.objects.create(diary=private, user=self.author, content='自言自语')
+        self.assertEqual(self.client.get('/api/diaries/comments/', {'diary': private.pk}).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/diaries/comments/{comment.pk}/thread/').status_code, 404)
+
+    def test_delete_removes_replies_and_counts(self):
+        root = self.comment('root')
+        self.comment('reply', self.comment('child', root))
+        self.assertEqual(self.client.delete(f'/api/diaries/comments/{root.pk}/').status_code, 204)
+        self.diary.refresh_from_db()
+        self.assertEqual((Comment.objects.count(), self.diary.comment_count), (0, 0))
+
+
+class RequestMetricsTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.user = CustomUser.objects.create_user(username='alice', password='pass1234')
+        Diary.objects.create(user=self.user, title='公开', content='x', is_public=True)
+        self.client.force_authenticate(self.user)
+
+    def samples(self):
+        with self.settings(REQUEST_METRICS={'TOKEN': 'secret'}):
+            response = self.client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_records_per_view_action(self):
+        self.client.get('/api/diaries/')
+        self.client.get('/api/diaries/')
+        self.client.get('/api/diaries/public/')
+        samples = self.samples()
+
+        view = 'view="DiaryViewSet.list"'
+        self.assertEqual(samples[f'momentglow_request_duration_seconds_count{{{view}}}'], 2)
+        self.assertEqual(samples[f'momentglow_request_duration_seconds_bucket{{{view},le="+Inf"}}'], 2)
+        # COUNT + 分页数据 + tags 预取
+        self.assertEqual(samples[f'momentglow_request_db_queries_total{{{view}}}'], 6)
+        self.assertGreater(samples[f'momentglow_request_serialize_seconds_total{{{view}}}'], 0)
+        self.assertGreater(samples[f'momentglow_request_render_seconds_total{{{view}}}'], 0)
+        self.assertGreater(samples[f'momentglow_response_bytes_total{{{view}}}'], 0)
+        self.assertEqual(samples[f'momentglow_responses_total{{{view},status="200"}}'], 2)
+        # 异步视图与同步实现记在同一个视图名下，其中的查询同样计入
+        self.assertGreater(samples['momentglow_request_db_queries_total{view="DiaryViewSet.public"}'], 0)
+
+    def test_endpoint_access(self):
+        # 回环地址默认不放行，本机反向代理转发的请求都来自这里
+        self.assertEqual(self.client.get('/internal/metrics', REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/internal/metrics', REMOTE_ADDR='10.0.0.1').status_code, 404)
+        with self.settings(REQUEST_METRICS={'ALLOWED_IPS': ('10.0.0.1',)}):
+            self.assertEqual(self.client.get('/internal/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+        with self.settings(REQUEST_METRICS={'TOKEN': 'secret'}):
+            response = self.client.get('/internal/metrics', REMOTE_ADDR='10.0.0.1', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_profiles_slow_requests(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir, ignore_errors=True)
+        with self.settings(REQUEST_METRICS={
+            'PROFILE_SAMPLE_RATE': 1.0, 'PROFILE_THRESHOLD': 0, 'PROFILE_DIR': profile_dir, 'PROFILE_KEEP': 2,
+        }):
+            client = self.client_class()
+            client.force_authenticate(self.user)
+            for _ in range(3):
+                client.get('/api/diaries/')
+        dumps = os.listdir(profile_dir)
+        self.assertEqual(len(dumps), 2)
+        self.assertTrue(all('DiaryViewSet.list' in name for name in dumps))
+
+
+class BenchmarkCommandTests(DiaryTestCase):
+    def run_benchmark(self, **options):
+        output = os.path.join(tempfile.mkdtemp(), 'result.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output), ignore_errors=True)
+        call_command(
+            'benchmark_api', use_current_db=True, users=3, diaries=4, tags=5, requests=5, warmup=1,
+            scenarios='diaries.list,diaries.public,comments.list,users.profile', output=output,
+            stdout=StringIO(), **options,
+        )
+        with open(output, encoding='utf-8') as f:
+            return output, json.load(f)
+
+    def test_reports_scenarios_and_rolls_back(self):
+        _, results = self.run_benchmark()
+        self.assertEqual(
+            list(results['scenarios']), ['diaries.list', 'diaries.public', 'comments.list', 'users.profile']
+        )
+        summary = results['scenarios']['diaries.list']
+        self.assertEqual((summary['requests'], summary['errors']), (5, 0))
+        self.assertLessEqual(summary['latency_ms']['p50'], summary['latency_ms']['p99'])
+        self.assertGreater(summary['queries']['mean'], 0)
+        self.assertGreater(summary['bytes']['mean'], 0)
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_baseline_regression(self):
+        path, results = self.run_benchmark()
+        for summary in results['scenarios'].values():
+            summary['queries']['max'] -= 1
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        with self.assertRaisesMessage(CommandError, '相对基线回退'):
+            self.run_benchmark(baseline=path, stderr=StringIO())
+
+
+    def test_generated_images_are_ready(self):
+        benchmark_api.generate(users=2, diaries_per_user=10, tag_count=3, seed=1)
+        self.assertTrue(DiaryImage.objects.exists())
+        self.assertFalse(DiaryImage.objects.exclude(processing_status=DiaryImage.STATUS_READY).exists())
+
+
+class ExplainQuerysetsCommandTests(DiaryTestCase):
+    def test_feed_paths_use_indexes(self):
+        out = StringIO()
+        call_command('explain_querysets', stdout=out)
+        lines = out.getvalue().splitlines()
+        for label in ('DiaryViewSet.list', 'DiaryViewSet.public', 'DiaryViewSet.public mood=happy'):
+            self.assertIn(f'[OK] {label}', lines)
+            self.assertIn(f'[OK] {label} (cursor)', lines)
+
+
+@override_settings(DIARY_IMAGE_PIPELINE={'SYNC': True, 'WIDTHS': (320, 640)})
+class DiaryImagePipelineTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.user = CustomUser.objects.create_user(username='frank', password='pass1234')
+        self.diary = Diary.objects.create(user=self.user, title='照片', content='内容')
+        self.client.force_authenticate(self.user)
+
+    def make_upload(self, size=(800, 600), orientation=None):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Make] = 'TestCamera'
+        if orientation:
+            exif[ExifTags.Base.Orientation] = orientation
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, format='JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/diaries/images/', {'diary': self.diary.pk, 'image': self.make_upload(**kwargs)}
+            )
+        self.assertEqual(response.status_code, 201)
+        return DiaryImage.objects.get(pk=response.data['data']['id'])
+
+    def test_upload_generates_variants_and_strips_exif(self):
+        image = self.upload()
+        self.assertEqual(image.processing_status, DiaryImage.STATUS_READY)
+        self.assertEqual((image.width, image.height), (800, 600))
+        self.assertEqual(
+            sorted((v['width'], v['format']) for v in image.variants),
+            [(320, 'jpeg'), (320, 'webp'), (640, 'jpeg'), (640, 'webp')]
+        )
+        with image.image.open('rb') as f:
+            self.assertEqual(len(Image.open(f).getexif()), 0)
+
+        response = self.client.get(f'/api/diaries/images/{image.pk}/')
+        data = response.data['data']
+        # 私密日记的图片地址带有签名
+        self.assertRegex(data['srcset'], r'^http://testserver/media/\S+\.jpg\?\S+ 320w, \S+\.jpg\?\S+ 640w, \S+\.jpg\?\S+ 800w$')
+        self.assertRegex(data['webp_srcset'], r'\.webp\?\S+ 320w, \S+\.webp\?\S+ 640w, ')
+
+    def test_orientation_is_applied(self):
+        # Orientation=6 表示需要顺时针旋转 90 度
+        image = self.upload(size=(400, 300), orientation=6)
+        self.assertEqual((image.width, image.height), (300, 400))
+        self.assertEqual([v['width'] for v in image.variants], [])
+
+    def test_delete_releases_variants_for_collection(self):
+        image = self.upload()
+        storage = image.image.storage
+        names = [image.image.name] + [variant['name'] for variant in image.variants]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/diaries/images/{image.pk}/')
+        self.assertTrue(all(storage.exists(name) for name in names))
+        call_command('collect_media_blobs', grace_seconds=0, stdout=StringIO())
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/'))
+        self.assertEqual(
+            [v['name'] for v in first.variants], [v['name'] for v in second.variants]
+        )
+
+    def test_collection_keeps_shared_blobs(self):
+        first, second = self.upload(), self.upload()
+        first.delete()
+        call_command('collect_media_blobs', grace_seconds=0, stdout=StringIO())
+        self.assertTrue(second.image.storage.exists(second.image.name))
+        for variant in second.variants:
+            self.assertTrue(second.image.storage.exists(variant['name']))
+
+    def test_collection_removes_original_with_exif(self):
+        upload = self.make_upload()
+        raw_name = DiaryImage._meta.get_field('image').storage.save('raw.jpg', upload)
+        upload.seek(0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/diaries/images/', {'diary': self.diary.pk, 'image': upload})
+        image = DiaryImage.objects.get(pk=response.data['data']['id'])
+        self.assertNotEqual(image.image.name, raw_name)
+        call_command('collect_media_blobs', grace_seconds=0, stdout=StringIO())
+        self.assertFalse(image.image.storage.exists(raw_name))
+
+
+class MediaServingTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.user = CustomUser.objects.create_user(username='lily', password='pass1234')
+        self.diary = Diary.objects.create(user=self.user, title='私密', content='内容')
+        name = default_storage.save('diary_images/a.png', ContentFile(b'0123456789' * 100))
+        self.image = DiaryImage.objects.create(diary=self.diary, image=name)
+        self.client.force_authenticate(self.user)
+        self.data = self.client.get(f'/api/diaries/images/{self.image.pk}/').data['data']
+        # <img> 请求不携带认证信息
+        self.client.force_authenticate(None)
+
+    def test_private_image_requires_signature(self):
+        path = '/media/' + self.image.image.name
+        self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertEqual(self.client.get(path + '?expires=9999999999&signature=forged').status_code, 404)
+
+        response = self.client.get(self.data['image'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 100)
+        self.assertIn('private', response['Cache-Control'])
+
+        Diary.objects.filter(pk=self.diary.pk).update(is_public=True)
+        cache.clear()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_range_requests(self):
+        url = self.data['image']
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1000')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=1000-').status_code, 416)
+        # If-Range 与当前 ETag 不一致时返回完整文件
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    @override_settings(MEDIA_DELIVERY={'ACCEL': 'nginx', 'ACCEL_PREFIX': '/protected-media/'})
+    def test_accel_redirect(self):
+        response = self.client.get(self.data['image'])
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.image.image.name)
+        self.assertEqual(response.content, b'')
+
+    def test_non_images_are_downloaded(self):
+        name = default_storage.save('diary_images/evil.html', ContentFile(b'<script>alert(1)</script>'))
+        DiaryImage.objects.create(diary=Diary.objects.create(user=self.user, title='公开', is_public=True), image=name)
+        response = self.client.get('/media/' + name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertEqual(response['Content-Disposition'], 'attachment')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+        response = self.client.get(self.data['image'])
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_path_traversal(self):
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+
+@override_settings(DATABASE_TUNING={'REPLICAS': ('replica_0',), 'STICKY_SECONDS': 5})
+class DatabaseRoutingTests(DiaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='mia', password='pass1234')
+        self.router = db.ReplicaRouter()
+
+    def run_request(self, method, action, write=False):
+        """在路由中间件内执行一次请求，返回本请求读取所用的数据库"""
+        request = getattr(APIRequestFactory(), method)('/')
+        request.user = self.user
+        result = {}
+
+        def view(request):
+            db.route_reads(request, action)
+            if write:
+                self.router.db_for_write(Diary)
+            result['db'] = self.router.db_for_read(Diary)
+            return HttpResponse()
+
+        db.ReplicaRoutingMiddleware(view)(request)
+        return result['db']
+
+    def test_read_actions_use_replica(self):
+        self.assertEqual(self.run_request('get', 'list'), 'replica_0')
+        self.assertIsNone(self.run_request('get', 'stats'))
+        self.assertIsNone(self.run_request('post', 'create'))
+        # 请求之外不做路由
+        self.assertIsNone(self.router.db_for_read(Diary))
+
+    def test_reads_after_write_stick_to_primary(self):
+        self.assertIsNone(self.run_request('post', 'create', write=True))
+        self.assertIsNone(self.run_request('get', 'list'))
+        cache.delete(db.sticky_key(self.user.pk))
+        self.assertEqual(self.run_request('get', 'list'), 'replica_0')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica_0', 'diary'))
+        self.assertIsNone(self.router.allow_migrate('default', 'diary'))
+
+    def test_sqlite_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于 SQLite')
+        # 测试用例运行在事务中，新建一个连接检查建立连接时的设置
+        new_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        self.addCleanup(new_connection.close)
+        with new_connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+
+    def test_middleware_skips_unopened_connections(self):
+        # 如测试运行器设置的只读副本镜像：已初始化但尚未打开
+        unopened = connections.create_connection(DEFAULT_DB_ALIAS)
+        with mock.patch.object(db.connections, 'all', return_value=[unopened]):
+            db.ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        self.assertIsNone(unopened.connection)
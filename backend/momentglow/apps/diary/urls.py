@@ -1,15 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import DiaryViewSet, TagViewSet, DiaryImageViewSet, CommentViewSet
+from .async_views import PublicDiaryFeedView, diary_detail_view
 
 app_name = 'diary'
 
 router = DefaultRouter()
-router.register(r'', DiaryViewSet, basename='diary')
 router.register(r'images', DiaryImageViewSet, basename='diary-image')
 router.register(r'tags', TagViewSet, basename='tag')
 router.register(r'comments', CommentViewSet, basename='comment')
+# 日记挂在根前缀上，其详情路由会匹配任意路径段，必须最后注册
+router.register(r'', DiaryViewSet, basename='diary')
 
 urlpatterns = [
+    # 读取频繁的公开日记流与日记详情使用异步视图，需排在路由器生成的同名路由之前
+    path('public/', PublicDiaryFeedView.as_view(), name='diary-public'),
+    path('<int:pk>/', diary_detail_view()),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+日记的版本信息，用于生成条件 GET 的 ETag
+
+日记的表示还包含评论、图片，它们的增删改不会更新日记本身的 updated_at，
+因此每篇日记的版本由 (id, updated_at, 评论数, 评论最后修改时间,
+图片数, 图片最后修改时间) 组成。计数取日记上的冗余字段，最后修改时间由
+相关子查询在同一条 SQL 中取出。表示中还嵌入了作者的用户名、邮箱与头像，
+用户表没有修改时间，直接把这几个字段计入版本。
+"""
+from django.db.models import F, Max, OuterRef, Subquery
+
+from .models import Comment, DiaryImage
+
+VERSION_FIELDS = (
+    'pk', 'updated_at',
+    'comment_count', 'comments_updated_at',
+    'image_count', 'images_updated_at',
+    'author_username', 'author_email', 'author_avatar',
+)
+TIMESTAMP_FIELDS = ('updated_at', 'comments_updated_at', 'images_updated_at')
+
+
+def latest_subquery(model):
+    """关联到外层日记的 model 行中最后的修改时间"""
+    latest = model.objects.filter(
+        diary=OuterRef('pk')
+    ).order_by().values('diary').annotate(latest=Max('updated_at')).values('latest')
+    return Subquery(latest)
+
+
+def with_versions(queryset):
+    """为查询集添加版本信息注解"""
+    return queryset.annotate(
+        comments_updated_at=latest_subquery(Comment),
+        images_updated_at=latest_subquery(DiaryImage),
+        author_username=F('user__username'),
+        author_email=F('user__email'),
+        author_avatar=F('user__avatar'),
+    )
+
+
+def query_versions(queryset):
+    """只查询版本信息，不加载日记内容，也不触发预取"""
+    return [tuple(row) for row in queryset.values_list(*VERSION_FIELDS)]
+
+
+async def aquery_versions(queryset):
+    return [tuple(row) async for row in queryset.values_list(*VERSION_FIELDS)]
+
+
+def get_versions(diaries):
+    """从已加载（且带版本注解）的日记取版本信息，与 query_versions 的结果一致"""
+    return [tuple(getattr(diary, field) for field in VERSION_FIELDS) for diary in diaries]
+
+
+def last_modified(versions):
+    indexes = [VERSION_FIELDS.index(field) for field in TIMESTAMP_FIELDS]
+    return max((row[i] for row in versions for i in indexes if row[i] is not None), default=None)
@@ -6,12 +6,26 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django_filters import rest_framework as django_filters
 from .models import Diary, DiaryImage, Tag, Comment
 from .serializers import (
-    DiarySerializer, DiaryImageSerializer, 
-    TagSerializer, CommentSerializer
+    DiarySerializer, DiarySummarySerializer, DiaryImageSerializer,
+    TagSerializer, TagUsageSerializer, CommentSerializer
 )
+from .pagination import CommentThreadPagination, DiaryKeysetPagination
+from .search import DiaryFullTextSearchFilter
+from .feed_cache import public_feed_cache
+from . import archive, images, stats, sync, tags
+from .versions import with_versions, query_versions, get_versions, last_modified
 from django.db import models
 from momentglow.views_base import CustomAPIView
-from rest_framework.permissions import AllowAny
+from momentglow.metrics import serializer_data
+from momentglow.conditional import make_etag, has_validators, not_modified, set_validators
+from rest_framework.permissions import IsAdminUser
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from django.http import StreamingHttpResponse
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
 
 # Create your views here.
 
@@ -22,13 +36,33 @@ class TagViewSet(CustomAPIView, viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
     
-    @action(detail=True)
+    def get_diary_viewset(self):
+        """标签下的日记流沿用公开日记流的查询集、过滤、分页与验证器"""
+        return DiaryViewSet(
+            request=self.request, args=self.args, kwargs=self.kwargs,
+            format_kwarg=self.format_kwarg, action='public', headers={},
+        )
+
+    def get_diaries_queryset(self, tag, viewset=None):
+        viewset = viewset or self.get_diary_viewset()
+        return viewset.filter_queryset(viewset.get_public_queryset()).filter(tags=tag)
+
+    @action(detail=True, permission_classes=[permissions.AllowAny])
     def diaries(self, request, pk=None):
-        """获取特定标签下的所有日记"""
+        """获取特定标签下的公开日记，支持页码与游标分页"""
         tag = self.get_object()
-        diaries = tag.diaries.filter(is_public=True)
-        serializer = DiarySerializer(diaries, many=True)
-        return Response(serializer.data)
+        viewset = self.get_diary_viewset()
+        return viewset.page_response(self.get_diaries_queryset(tag, viewset), private=False)[0]
+
+    # 热门标签：按随时间衰减的使用热度排序，?limit= 指定个数
+    @action(detail=False, permission_classes=[permissions.AllowAny])
+    def trending(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            raise ValidationError({'limit': '必须是整数'})
+        serializer = TagUsageSerializer(tags.trending(limit), many=True)
+        return Response(serializer_data(serializer))
 
 class DiaryFilter(django_filters.FilterSet):
     created_at = django_filters.DateFromToRangeFilter()
@@ -48,20 +82,36 @@ class DiaryFilter(django_filters.FilterSet):
 class DiaryViewSet(CustomAPIView, viewsets.ModelViewSet):
     serializer_class = DiarySerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, DiaryFullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['is_public', 'mood', 'weather']
     search_fields = ['title', 'content']
     ordering_fields = ['created_at', 'updated_at']
 
+    # 列表类接口返回摘要，详情返回完整内容
+    def get_serializer_class(self):
+        if self.action in ('list', 'public'):
+            return DiarySummarySerializer
+        return DiarySerializer
+
     # 处理查询
     def get_queryset(self):
         user = self.request.user
-        queryset = Diary.objects.filter(models.Q(user=user)).select_related('user').prefetch_related('tags', 'comments')
+        queryset = Diary.objects.filter(models.Q(user=user)).select_related('user')
+        if self.action == 'list':
+            queryset = DiarySummarySerializer.setup_queryset(queryset.prefetch_related('tags'))
+        else:
+            queryset = queryset.prefetch_related('tags', 'images')
+        if self.action in ('list', 'retrieve'):
+            queryset = with_versions(queryset)
 
         # # 处理 user_id 参数
         # user_id = self.request.query_params.get('user_id')
         # if user_id:
         #     queryset = queryset.filter(user=user_id)
+        return self.filter_by_params(queryset)
+
+    def filter_by_params(self, queryset):
+        """按 mood、timeRange 参数过滤日记"""
         # 处理 mood 参数
         mood = self.request.query_params.get('mood')
         if mood:
@@ -75,13 +125,114 @@ class DiaryViewSet(CustomAPIView, viewsets.ModelViewSet):
             except ValueError:
                 pass
         return queryset
+
+    @property
+    def paginator(self):
+        """列表类接口在请求携带 cursor 参数时改用游标分页"""
+        if not hasattr(self, '_paginator'):
+            if (self.action in ('list', 'public') and
+                    DiaryKeysetPagination.cursor_query_param in self.request.query_params):
+                self._paginator = DiaryKeysetPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def query_page_versions(self, queryset):
+        """只查询当前页的版本信息，返回 (总数或是否有下一页, 版本列表)；页码无效时返回 None"""
+        paginator = self.paginator
+        if paginator is None:
+            return None, query_versions(queryset)
+        if isinstance(paginator, DiaryKeysetPagination):
+            page_queryset = paginator.get_page_queryset(queryset, paginator.decode_cursor(self.request))
+            versions = query_versions(page_queryset)
+            return len(versions) > paginator.page_size, versions[:paginator.page_size]
+        page_size = paginator.get_page_size(self.request)
+        try:
+            number = int(self.request.query_params.get(paginator.page_query_param, 1))
+        except ValueError:
+            return None
+        if number < 1:
+            return None
+        count = queryset.count()
+        offset = (number - 1) * page_size
+        if number > 1 and offset >= count:
+            return None
+        return count, query_versions(queryset[offset:offset + page_size])
+
+    def get_page_versions(self, page):
+        """从已分页的结果取版本信息，与 query_page_versions 的结果一致"""
+        paginator = self.paginator
+        if isinstance(paginator, DiaryKeysetPagination):
+            return paginator.has_next, get_versions(page)
+        return paginator.page.paginator.count, get_versions(page)
+
+    def get_page_etag(self, page_versions):
+        return make_etag(self.request, *page_versions)
+
+    def not_modified_page(self, page_versions, private=True):
+        if page_versions is None:
+            return None
+        return not_modified(
+            self.request, self.get_page_etag(page_versions), last_modified(page_versions[1]), private
+        )
+
+    def page_response(self, queryset, private=True):
+        """分页返回摘要列表；客户端缓存仍然有效时只查询版本信息并返回 304"""
+        if has_validators(self.request):
+            page_versions = self.query_page_versions(queryset)
+            response = self.not_modified_page(page_versions, private)
+            if response is not None:
+                return response, page_versions
+
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            serializer = self.get_serializer(queryset, many=True)
+            page_versions = None, get_versions(queryset)
+            response = set_validators(
+                Response(serializer_data(serializer)), self.get_page_etag(page_versions),
+                last_modified(page_versions[1]), private,
+            )
+            return response, page_versions
+        return self.serialize_page(page, private)
+
+    def serialize_page(self, page, private=True):
+        """序列化已分页的结果并设置验证器，返回 (响应, 版本信息)"""
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer_data(serializer))
+        page_versions = self.get_page_versions(page)
+        set_validators(response, self.get_page_etag(page_versions), last_modified(page_versions[1]), private)
+        return response, page_versions
+
+    def cached_page_response(self, cached):
+        """由公开日记流缓存中的 (数据, 版本信息) 构造响应，不查询数据库"""
+        data, page_versions = cached
+        response = self.not_modified_page(page_versions, private=False)
+        if response is None:
+            response = set_validators(
+                Response(data), self.get_page_etag(page_versions), last_modified(page_versions[1]), private=False
+            )
+        return response
+
+    def not_modified_diary(self, versions):
+        if not versions:
+            return None
+        return not_modified(self.request, make_etag(self.request, versions), last_modified(versions))
+
+    def diary_response(self, diary):
+        """序列化日记详情并设置验证器"""
+        serializer = self.get_serializer(diary)
+        versions = get_versions([diary])
+        return set_validators(
+            Response(serializer_data(serializer)), make_etag(self.request, versions), last_modified(versions)
+        )
     # 处理创建
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        data = serializer_data(serializer)
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
 
     # 处理创建
     def perform_create(self, serializer):
@@ -92,36 +243,77 @@ class DiaryViewSet(CustomAPIView, viewsets.ModelViewSet):
     def add_comment(self, request, pk=None):
         diary = self.get_object()
         serializer = CommentSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(diary=diary, user=request.user)
-        return Response(serializer.data)
-
-    # 处理获取公共日记
-    @action(detail=False, methods=['get'], url_path='public', permission_classes=[AllowAny])
-    def public(self, request):
-        queryset = Diary.objects.filter(is_public=True).select_related('user').prefetch_related('tags', 'comments')
+        serializer.is_valid(raise_exception=True)
+        serializer.save(diary=diary, user=request.user)
+        return Response(serializer_data(serializer))
+
+    def get_public_queryset(self):
+        """公开日记流的查询集，按 user_id、mood、timeRange 参数过滤"""
+        queryset = with_versions(DiarySummarySerializer.setup_queryset(
+            Diary.objects.filter(is_public=True).select_related('user').prefetch_related('tags')
+        ))
         # 处理 user_id 参数
-        user_id = request.query_params.get('user_id')
+        user_id = self.request.query_params.get('user_id')
         if user_id:
             queryset = queryset.filter(user__id=user_id)
-        # 处理 mood 参数
-        mood = request.query_params.get('mood')
-        if mood:
-            queryset = queryset.filter(mood=mood)
-        # 处理 timeRange 参数
-        time_range = request.query_params.get('timeRange')
-        if time_range:
-            try:
-                start, end = time_range.split(',')
-                queryset = queryset.filter(created_at__range=[start, end])
-            except ValueError:
-                pass
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.filter_by_params(queryset)
+
+    # 公开日记流（GET /public/）与日记详情的读取由 async_views 中的异步视图处理
+
+    # 公开日记流缓存的命中率与重建耗时
+    @action(detail=False, methods=['get'], url_path='public/cache-stats', permission_classes=[IsAdminUser])
+    def public_cache_stats(self, request):
+        return Response(public_feed_cache.stats())
+
+    # 当前用户的心情、天气分布与活跃度热力图，?days= 指定统计最近多少天
+    @action(detail=False, methods=['get'], url_path='stats')
+    def statistics(self, request):
+        try:
+            days = int(request.query_params.get('days', stats.DEFAULT_DAYS))
+        except ValueError:
+            raise ValidationError({'days': '必须是整数'})
+        days = min(max(days, 1), stats.MAX_DAYS)
+        end = timezone.localdate()
+        return Response(stats.summarize(request.user.pk, end - timedelta(days=days - 1), end))
+
+    # 增量同步：返回游标（或 ?updated_since=）之后变化的日记、评论、图片与删除记录
+    @action(detail=False, methods=['get'], url_path='sync')
+    def sync_changes(self, request):
+        params = request.query_params
+        updated_since = None
+        if params.get('updated_since'):
+            updated_since = parse_datetime(params['updated_since'])
+            if updated_since is None:
+                raise ValidationError({'updated_since': '必须是 ISO 8601 时间'})
+            if timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since)
+        try:
+            limit = max(int(params['limit']), 1) if params.get('limit') else None
+        except ValueError:
+            raise ValidationError({'limit': '必须是整数'})
+        try:
+            cursor = sync.decode_cursor(params['cursor']) if params.get('cursor') else None
+        except ValueError as exc:
+            raise ValidationError({'cursor': str(exc)})
+        return Response(sync.changes(
+            request.user, self.get_serializer_context(),
+            cursor=cursor, updated_since=updated_since, limit=limit,
+        ))
+
+    # 导出当前用户的全部日记与图片，边查询边以 zip 流式返回
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_archive(self, request):
+        response = StreamingHttpResponse(archive.export_archive(request.user), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{archive.export_filename(request.user)}"'
+        return response
+
+    # 导入导出的 zip 或 NDJSON 文件（字段 file），按块批量写入
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_archive(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': '请上传导出的 zip 或 NDJSON 文件'})
+        return Response(archive.import_archive(request.user, upload), status=status.HTTP_201_CREATED)
 
     # 处理修改日记
     def update(self, request, *args, **kwargs):
@@ -129,7 +321,7 @@ class DiaryViewSet(CustomAPIView, viewsets.ModelViewSet):
         serializer = self.get_serializer(diary, data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
-        return Response(serializer.data)
+        return Response(serializer_data(serializer))
 
     # 处理删除日记
     def destroy(self, request, *args, **kwargs):
@@ -137,21 +329,11 @@ class DiaryViewSet(CustomAPIView, viewsets.ModelViewSet):
         self.perform_destroy(diary)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    # 处理获取日记详情
-    def retrieve(self, request, *args, **kwargs):
-        diary = self.get_object()
-        serializer = self.get_serializer(diary)
-        return Response(serializer.data)
-
     # 处理获取日记列表
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset();
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset())
+        response, _ = self.page_response(queryset)
+        return response
 
 class DiaryImageViewSet(CustomAPIView, viewsets.ModelViewSet):
     serializer_class = DiaryImageSerializer
@@ -163,18 +345,65 @@ class DiaryImageViewSet(CustomAPIView, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         diary_id = self.request.data.get('diary')
         diary = Diary.objects.get(id=diary_id, user=self.request.user)
-        serializer.save(diary=diary)
+        image = serializer.save(diary=diary)
+        # 缩略图与 EXIF 清理交给后台线程，不阻塞上传请求
+        images.schedule(image)
+
+def visible_diaries(user):
+    """user 可以查看和评论的日记：公开日记与自己的日记"""
+    diaries = Diary.objects.all()
+    if not user.is_authenticated:
+        return diaries.filter(is_public=True)
+    return diaries.filter(models.Q(is_public=True) | models.Q(user=user))
+
 
 class CommentViewSet(CustomAPIView, viewsets.ModelViewSet):
+    """评论
+
+    列表需指定 ?diary=，按楼层顺序（物化路径）游标分页返回该日记的全部评论；
+    /comments/{id}/thread/ 以同样的方式返回一条评论及其全部回复。
+    """
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = CommentThreadPagination
     
     def get_queryset(self):
-        return Comment.objects.filter(parent=None)  # 只返回父评论
+        queryset = Comment.objects.select_related('user')
+        if self.request.method in permissions.SAFE_METHODS:
+            return queryset.filter(diary__in=visible_diaries(self.request.user))
+        # 只能修改、删除自己的评论
+        return queryset.filter(user=self.request.user)
+
+    def get_thread_queryset(self, diary_id, root=None):
+        """日记的评论（root 不为空时为 root 及其全部回复），按楼层顺序排列"""
+        queryset = Comment.objects.select_related('user').filter(diary_id=diary_id)
+        if root is not None:
+            lower, upper = Comment.subtree_bounds(root.path)
+            queryset = queryset.filter(path__gte=lower, path__lt=upper)
+        return queryset.order_by('path')
+
+    def list(self, request, *args, **kwargs):
+        diary_id = request.query_params.get('diary')
+        if not diary_id:
+            raise ValidationError({'diary': '必须指定日记'})
+        diary = get_object_or_404(visible_diaries(request.user).only('pk'), pk=diary_id)
+        return self.thread_response(self.get_thread_queryset(diary.pk))
+
+    @action(detail=True)
+    def thread(self, request, pk=None):
+        root = self.get_object()
+        return self.thread_response(self.get_thread_queryset(root.diary_id, root))
+
+    def thread_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(serializer_data(self.get_serializer(page, many=True)))
     
     def perform_create(self, serializer):
-        diary_id = self.request.data.get('diary')
-        diary = Diary.objects.get(id=diary_id)
+        parent = serializer.validated_data.get('parent')
+        diary_id = parent.diary_id if parent is not None else self.request.data.get('diary')
+        if not diary_id:
+            raise ValidationError({'diary': '必须指定日记'})
+        diary = get_object_or_404(Diary, pk=diary_id)
         if not diary.is_public and diary.user != self.request.user:
-            raise permissions.PermissionDenied("不能评论非公开的日记")
-        serializer.save(diary=diary)
+            raise PermissionDenied("不能评论非公开的日记")
+        serializer.save(diary=diary, user=self.request.user)
@@ -0,0 +1,144 @@
+"""
+头像上传
+
+AvatarUploadHandler 替换默认的上传处理器：Content-Length 已超限时不解析请求体，
+逐块接收时累计大小，超出 MAX_SIZE 或文件头不是允许的图片格式时立即停止读取，
+不会先把整个请求体写入临时文件。头像不大，内容直接保存在内存中。
+
+normalize() 只读取文件头判断格式与尺寸，JPEG 按需要的分辨率缩放解码，
+按 EXIF 方向摆正后居中裁剪并缩放为 SIZE×SIZE 的正方形，重新编码时不写入 EXIF。
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+DEFAULTS = {
+    'FIELD_NAME': 'avatar',
+    'MAX_SIZE': 5 * 1024 * 1024,
+    'SIZE': 256,
+    # 解码前按文件头拒绝像素过多的图片
+    'MAX_PIXELS': 40_000_000,
+    'QUALITY': 85,
+}
+# 文件头特征与对应的 PIL 格式
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+SNIFF_LENGTH = 12
+# multipart 的分隔符与各部分的头，允许请求体比文件本身略大
+MULTIPART_OVERHEAD = 64 * 1024
+
+ERROR_TOO_LARGE = 'too_large'
+ERROR_FORMAT = 'format'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'USER_AVATAR', {})}
+
+
+def sniff(header):
+    """按文件头判断图片格式，不认识时返回 None"""
+    for signature, fmt in SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class InvalidAvatar(Exception):
+    pass
+
+
+class AvatarUploadHandler(FileUploadHandler):
+    """只接收头像字段，超限或格式不对时中止上传并在 error 中记录原因"""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        config = get_config()
+        self.field = config['FIELD_NAME']
+        self.max_size = config['MAX_SIZE']
+        self.error = None
+        self.format = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            self.error = ERROR_TOO_LARGE
+            # 返回空结果即不再解析请求体
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != self.field:
+            raise SkipFile()
+        super().new_file(field_name, *args, **kwargs)
+        self.file = BytesIO()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        if self.file.tell() > self.max_size:
+            self.abort(ERROR_TOO_LARGE)
+        if self.format is None and self.file.tell() >= SNIFF_LENGTH:
+            self.check_header()
+        return None
+
+    def file_complete(self, file_size):
+        if self.format is None:
+            self.check_header()
+        self.file.seek(0)
+        return InMemoryUploadedFile(
+            self.file, self.field_name, self.file_name, self.content_type, file_size, self.charset,
+            self.content_type_extra,
+        )
+
+    def check_header(self):
+        self.format = sniff(self.file.getbuffer()[:SNIFF_LENGTH].tobytes())
+        if self.format is None:
+            self.abort(ERROR_FORMAT)
+
+    def abort(self, error):
+        self.error = error
+        # 不再读取剩余的请求体
+        raise StopUpload(connection_reset=True)
+
+
+def normalize(file):
+    """校验并缩放头像，返回可直接保存到 ImageField 的 ContentFile"""
+    config = get_config()
+    try:
+        # 只解析文件头，此时尚未解码像素
+        image = Image.open(file)
+    except (UnidentifiedImageError, OSError):
+        raise InvalidAvatar('无法识别的图片')
+    width, height = image.size
+    if image.format not in ('JPEG', 'PNG', 'GIF', 'WEBP'):
+        raise InvalidAvatar('只支持JPEG、PNG、GIF、WebP格式的图片')
+    if width * height > config['MAX_PIXELS']:
+        raise InvalidAvatar('图片尺寸过大')
+
+    size = min(config['SIZE'], width, height)
+    try:
+        # JPEG 直接以 1/2、1/4、1/8 的比例解码，结果不小于目标尺寸
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise InvalidAvatar('图片已损坏')
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    buffer = BytesIO()
+    if has_alpha:
+        image.convert('RGBA').save(buffer, format='PNG', optimize=True)
+        ext = 'png'
+    else:
+        image.convert('RGB').save(buffer, format='JPEG', quality=config['QUALITY'], optimize=True)
+        ext = 'jpg'
+    return ContentFile(buffer.getvalue(), name=f'avatar.{ext}')
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_alter_customuser_options_customuser_bio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='diary_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='日记数'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='public_diary_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='公开日记数'),
+        ),
+    ]
@@ -4,6 +4,9 @@ from django.db import models
 class CustomUser(AbstractUser):
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name='头像')
     bio = models.TextField(max_length=500, blank=True, null=True, verbose_name='个人简介')
+    # 由日记应用的 signals 维护，偏差可用 repair_counters 命令修复
+    diary_count = models.PositiveIntegerField('日记数', default=0, editable=False)
+    public_diary_count = models.PositiveIntegerField('公开日记数', default=0, editable=False)
     
     class Meta:
         verbose_name = '用户'
@@ -2,8 +2,9 @@ from rest_framework import serializers
 from .models import CustomUser
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from momentglow.authentication import RefreshToken
 from django.conf import settings
+from momentglow import media
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -37,28 +38,12 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CustomUser
-        fields = ('id', 'username', 'email', 'avatar_url', 'bio', 'date_joined')
-        read_only_fields = ('id', 'date_joined')
+        fields = ('id', 'username', 'email', 'avatar_url', 'bio', 'date_joined', 'diary_count', 'public_diary_count')
+        read_only_fields = ('id', 'date_joined', 'diary_count', 'public_diary_count')
     
     def get_avatar_url(self, obj):
         """返回用户头像URL，如果用户没有设置头像则返回默认头像"""
-        request = self.context.get('request')
-        if request is not None:
-            # 获取完整的host信息
-            host = request.build_absolute_uri('/').rstrip('/')
-            
-            if obj.avatar and hasattr(obj.avatar, 'url'):
-                # 返回完整的URL
-                return f"{host}{obj.avatar.url}"
-            else:
-                # 返回默认头像的完整URL
-                return f"{host}/media/default.jpg"
-        else:
-            # 如果没有request上下文，返回相对路径
-            if obj.avatar and hasattr(obj.avatar, 'url'):
-                return obj.avatar.url
-            else:
-                return '/media/default.jpg'
+        return media.avatar_url(obj.avatar.name, self.context.get('request'))
 
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField(required=True)
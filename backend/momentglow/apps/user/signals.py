@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from momentglow.authentication import invalidate_user, token_claims
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, **kwargs):
+    """用户资料、密码或启用状态变化后清除 JWT 认证缓存的用户，并记录最新的令牌声明"""
+    invalidate_user(instance.pk, token_claims(instance), active=instance.is_active)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk, active=False)
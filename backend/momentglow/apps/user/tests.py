@@ -0,0 +1,230 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from momentglow.authentication import JWTAuthentication, RefreshToken
+from .models import CustomUser
+
+
+class AvatarUploadTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.user = CustomUser.objects.create_user(username='grace', password='pass1234')
+
+    def make_avatar(self, color='blue'):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), color).save(buffer, format='PNG')
+        return SimpleUploadedFile('avatar.png', buffer.getvalue(), content_type='image/png')
+
+    def upload(self, user, avatar):
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/users/avatar/upload/', {'avatar': avatar})
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        return response
+
+    def test_same_avatar_is_stored_once(self):
+        other = CustomUser.objects.create_user(username='heidi', password='pass1234')
+        self.upload(self.user, self.make_avatar())
+        response = self.upload(other, self.make_avatar())
+        self.assertEqual(self.user.avatar.name, other.avatar.name)
+        self.assertTrue(response.data['data']['avatar_url'].endswith('/media/' + other.avatar.name))
+        # 头像是公开的，不需要签名
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(response.data['data']['avatar_url']).status_code, 200)
+
+    def test_replaced_avatar_is_collected(self):
+        self.upload(self.user, self.make_avatar('blue'))
+        old_name = self.user.avatar.name
+        self.upload(self.user, self.make_avatar('red'))
+        storage = self.user.avatar.storage
+        self.assertTrue(storage.exists(old_name))
+        call_command('collect_media_blobs', grace_seconds=0, stdout=StringIO())
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(self.user.avatar.name))
+
+    def test_recent_blobs_survive_grace_period(self):
+        self.upload(self.user, self.make_avatar('blue'))
+        old_name = self.user.avatar.name
+        self.upload(self.user, self.make_avatar('red'))
+        call_command('collect_media_blobs', stdout=StringIO())
+        self.assertTrue(self.user.avatar.storage.exists(old_name))
+
+    def test_avatar_is_cropped_and_resized(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), 'green').save(buffer, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        with CaptureQueriesContext(connection) as ctx:
+            self.upload(self.user, upload)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"password"', updates[0])
+        with self.user.avatar.open('rb') as f:
+            image = Image.open(f)
+            self.assertEqual(image.size, (256, 256))
+            self.assertEqual(image.format, 'JPEG')
+
+    def test_oversized_upload_is_rejected(self):
+        with self.settings(USER_AVATAR={'MAX_SIZE': 1024}):
+            self.client.force_authenticate(self.user)
+            big = SimpleUploadedFile('big.png', b'\x89PNG\r\n\x1a\n' + b'0' * (200 * 1024), content_type='image/png')
+            response = self.client.post('/api/users/avatar/upload/', {'avatar': big})
+        self.assertEqual(response.status_code, 413)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+
+    def test_content_type_is_not_trusted(self):
+        self.client.force_authenticate(self.user)
+        fake = SimpleUploadedFile('fake.png', b'not an image at all', content_type='image/png')
+        response = self.client.post('/api/users/avatar/upload/', {'avatar': fake})
+        self.assertEqual(response.status_code, 400)
+
+        # 文件头正确但内容损坏
+        broken = SimpleUploadedFile('broken.png', b'\x89PNG\r\n\x1a\n' + b'0' * 64, content_type='image/png')
+        response = self.client.post('/api/users/avatar/upload/', {'avatar': broken})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='ivan', password='pass1234', bio='你好')
+
+    def test_profile_not_modified(self):
+        url = f'/api/users/profiles/{self.user.pk}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        CustomUser.objects.filter(pk=self.user.pk).update(bio='再见')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['bio'], '再见')
+
+    def test_avatar_not_modified(self):
+        url = f'/api/users/avatar/{self.user.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        CustomUser.objects.filter(pk=self.user.pk).update(avatar='avatars/new.jpg')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AvatarURLTests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='judy', password='pass1234', avatar='blobs/ab/cd/judy.jpg')
+        self.other = CustomUser.objects.create_user(username='karl', password='pass1234')
+
+    def test_batch_lookup(self):
+        url = f'/api/users/avatars/?ids={self.user.pk},{self.other.pk},999999'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        avatars = response.data['data']['avatars']
+        self.assertEqual(avatars, {
+            str(self.user.pk): 'http://testserver/media/blobs/ab/cd/judy.jpg',
+            str(self.other.pk): 'http://testserver/media/default.jpg',
+        })
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_batch_rejects_bad_ids(self):
+        self.assertEqual(self.client.get('/api/users/avatars/?ids=1,x').status_code, 400)
+        self.assertEqual(self.client.get('/api/users/avatars/').status_code, 400)
+        ids = ','.join(str(i) for i in range(1, 102))
+        self.assertEqual(self.client.get(f'/api/users/avatars/?ids={ids}').status_code, 400)
+
+    @override_settings(MEDIA_DELIVERY={'BASE_URL': 'https://cdn.example.com/'})
+    def test_base_url(self):
+        response = self.client.get(f'/api/users/profiles/{self.user.pk}/')
+        self.assertEqual(response.data['data']['avatar_url'], 'https://cdn.example.com/media/blobs/ab/cd/judy.jpg')
+        response = self.client.get(f'/api/users/avatar/{self.other.pk}/')
+        self.assertEqual(response.data['data']['avatar_url'], 'https://cdn.example.com/media/default.jpg')
+        self.assertFalse(response.data['data']['has_avatar'])
+
+
+class JWTUserCacheTests(APITestCase):
+    def setUp(self):
+        caches['users'].clear()
+        self.user = CustomUser.objects.create_user(username='ken', password='pass1234', email='ken@example.com')
+        self.token = RefreshToken.for_user(self.user).access_token
+
+    def authenticate(self, token=None):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token or self.token}')
+        return JWTAuthentication().authenticate(Request(request))[0]
+
+    def test_user_is_cached(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate().pk, self.user.pk)
+
+    def test_save_invalidates(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_async_views_use_cache(self):
+        url = '/api/users/avatar/'
+        self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(JWT_USER_CACHE={'CACHE_ALIAS': 'users', 'TRUST_TOKEN_CLAIMS': True})
+    def test_trusted_claims(self):
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.username), (self.user.pk, 'ken'))
+
+        # 其余字段延迟加载，保存时只写回已加载的字段
+        user.bio = '你好'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.bio, self.user.email), ('你好', 'ken@example.com'))
+        self.assertTrue(self.user.check_password('pass1234'))
+
+        # 没有用户声明的旧令牌仍然查询用户表
+        with self.assertNumQueries(1):
+            self.authenticate(AccessToken.for_user(self.user))
+
+        CustomUser.objects.get(pk=self.user.pk).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(JWT_USER_CACHE={'CACHE_ALIAS': 'users', 'TRUST_TOKEN_CLAIMS': True})
+    def test_trusted_claims_in_async_view(self):
+        self.user.avatar = 'blobs/ab/cd/ken.jpg'
+        self.user.save()
+        token = RefreshToken.for_user(self.user).access_token
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/avatar/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['data']['avatar_url'].endswith('/media/blobs/ab/cd/ken.jpg'))
+
+    @override_settings(JWT_USER_CACHE={'CACHE_ALIAS': 'users', 'TRUST_TOKEN_CLAIMS': True})
+    def test_trusted_claims_follow_saved_changes(self):
+        self.user.is_staff = True
+        self.user.save()
+        token = RefreshToken.for_user(self.user).access_token
+        self.assertTrue(self.authenticate(token).is_staff)
+
+        # 令牌仍声明是管理员，以保存后记录的状态为准
+        self.user.is_staff = False
+        self.user.save()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.authenticate(token).is_staff)
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import RegisterView, ProfileView, LoginView, AvatarUploadView, AvatarView
+from .views import RegisterView, ProfileView, LoginView, AvatarUploadView, AvatarView, AvatarBatchView
 
 app_name = 'user'
 
@@ -12,4 +12,5 @@ urlpatterns = [
     path('avatar/upload/', AvatarUploadView.as_view(), name='avatar_upload'),
     path('avatar/', AvatarView.as_view(), name='avatar'),
     path('avatar/<int:user_id>/', AvatarView.as_view(), name='avatar_by_id'),
+    path('avatars/', AvatarBatchView.as_view(), name='avatar_batch'),
 ] 
\ No newline at end of file
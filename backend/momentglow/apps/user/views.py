@@ -2,13 +2,15 @@ from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
+from . import avatars
 from .models import CustomUser
 from .serializers import RegisterSerializer, UserSerializer, LoginSerializer
-from momentglow.views_base import CustomAPIView
+from momentglow import media
+from momentglow.views_base import CustomAPIView, AsyncAPIView
+from momentglow.metrics import serializer_data
+from momentglow.conditional import make_etag, not_modified, set_validators
 from django.utils import timezone
 import os
-import uuid
-from django.conf import settings
 
 class RegisterView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
@@ -51,130 +53,124 @@ class LoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProfileView(CustomAPIView, generics.RetrieveAPIView):
-    """获取指定用户的详细信息"""
+class ProfileView(AsyncAPIView, generics.GenericAPIView):
+    """获取指定用户的详细信息（异步视图）"""
     permission_classes = (AllowAny,)
     serializer_class = UserSerializer
     queryset = CustomUser.objects.all()
     
-    def get_object(self):
+    async def aget_object(self):
         """根据URL中的user_id获取用户"""
         user_id = self.kwargs.get('user_id')
         if user_id:
-            return CustomUser.objects.get(id=user_id)
+            return await CustomUser.objects.aget(id=user_id)
         return self.request.user
 
+    async def get(self, request, *args, **kwargs):
+        # 用户表没有修改时间，ETag 由资料中会出现在响应里的字段生成
+        user = await self.aget_object()
+        etag = make_etag(
+            request, user.pk, user.username, user.email, user.avatar.name, user.bio, user.date_joined,
+            user.diary_count, user.public_diary_count,
+        )
+        response = not_modified(request, etag, private=False)
+        if response is None:
+            serializer = self.get_serializer(user)
+            response = set_validators(Response(serializer_data(serializer)), etag, private=False)
+        return response
+
 class AvatarUploadView(CustomAPIView, APIView):
+    """上传头像：请求体由 AvatarUploadHandler 边接收边校验，图片在内存中校验并缩放"""
     permission_classes = (IsAuthenticated,)
-    
-    def generate_unique_filename(self, original_filename):
-        """生成唯一的文件名"""
-        # 获取文件扩展名
-        file_ext = os.path.splitext(original_filename)[1].lower()
-        # 生成UUID作为文件名
-        unique_id = str(uuid.uuid4())
-        # 组合新的文件名
-        new_filename = f"{unique_id}{file_ext}"
-        return new_filename
-    
-    def get_full_url(self, request, path):
-        """获取完整的URL"""
-        host = request.build_absolute_uri('/').rstrip('/')
-        return f"{host}{path}"
+
+    def initialize_request(self, request, *args, **kwargs):
+        # 必须在认证（CSRF 检查可能读取 request.POST）之前替换上传处理器
+        self.upload_handler = avatars.AvatarUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
     
     def post(self, request):
         """上传用户头像"""
-        if 'avatar' not in request.FILES:
+        avatar_file = request.FILES.get('avatar')
+        error = self.upload_handler.error
+        if error == avatars.ERROR_TOO_LARGE:
+            max_mb = avatars.get_config()['MAX_SIZE'] // (1024 * 1024)
+            return Response({'error': f'头像文件大小不能超过{max_mb}MB'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if error == avatars.ERROR_FORMAT:
+            return Response({'error': '只支持JPEG、PNG、GIF、WebP格式的图片'}, status=status.HTTP_400_BAD_REQUEST)
+        if avatar_file is None:
             return Response({'error': '请提供头像文件'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        avatar_file = request.FILES['avatar']
-        
-        # 验证文件类型
-        allowed_types = ['image/jpeg', 'image/png', 'image/gif']
-        if avatar_file.content_type not in allowed_types:
-            return Response({'error': '只支持JPEG、PNG、GIF格式的图片'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 验证文件大小（限制为5MB）
-        if avatar_file.size > 5 * 1024 * 1024:
-            return Response({'error': '头像文件大小不能超过5MB'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
         try:
-            user = request.user
-            
-            # 注释掉删除旧头像文件的代码，暂时不需要删除
-            # if user.avatar:
-            #     if os.path.exists(user.avatar.path):
-            #         os.remove(user.avatar.path)
-            
-            # 生成唯一的文件名
-            original_filename = avatar_file.name
-            unique_filename = self.generate_unique_filename(original_filename)
-            
-            # 确保avatars目录存在
-            avatars_dir = os.path.join(settings.MEDIA_ROOT, 'avatars')
-            if not os.path.exists(avatars_dir):
-                os.makedirs(avatars_dir)
-            
-            # 构建完整的文件路径
-            file_path = os.path.join(avatars_dir, unique_filename)
-            
-            # 保存文件到本地
-            with open(file_path, 'wb+') as destination:
-                for chunk in avatar_file.chunks():
-                    destination.write(chunk)
-            
-            # 更新用户头像字段
-            user.avatar = f'avatars/{unique_filename}'
-            user.save()
-            
-            # 构建完整的URL
-            avatar_url = self.get_full_url(request, f'/media/avatars/{unique_filename}')
-            
-            return Response({
-                'message': '头像上传成功',
-                'avatar_url': avatar_url,
-                'filename': unique_filename
-            }, status=status.HTTP_200_OK)
-            
-        except Exception as e:
-            return Response({'error': f'头像上传失败: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            content = avatars.normalize(avatar_file)
+        except avatars.InvalidAvatar as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        # 存储按内容哈希命名并去重，旧头像文件在不再被引用后由 collect_media_blobs 回收
+        user.avatar.save(content.name, content, save=False)
+        user.save(update_fields=['avatar'])
 
-class AvatarView(CustomAPIView, APIView):
+        return Response({
+            'message': '头像上传成功',
+            'avatar_url': media.avatar_url(user.avatar.name, request),
+            'filename': os.path.basename(user.avatar.name)
+        }, status=status.HTTP_200_OK)
+
+class AvatarView(AsyncAPIView):
+    """获取用户头像地址（异步视图）"""
     permission_classes = (AllowAny,)
     
-    def get_full_url(self, request, path):
-        """获取当前请求的完整的URL"""
-        host = request.build_absolute_uri('/').rstrip('/')
-        return f"{host}{path}"
-    
-    def get(self, request, user_id=None):
+    async def get(self, request, user_id=None):
         """获取用户头像"""
         try:
             if user_id:
                 # 获取指定用户的头像
-                user = CustomUser.objects.get(id=user_id)
+                user = await CustomUser.objects.only('avatar').aget(id=user_id)
             else:
                 # 获取当前登录用户的头像
                 if not request.user.is_authenticated:
                     return Response({'error': '需要登录'}, status=status.HTTP_401_UNAUTHORIZED)
                 user = request.user
-            
-            # 如果用户有头像，返回头像URL
-            if user.avatar and hasattr(user.avatar, 'url'):
-                avatar_url = self.get_full_url(request, user.avatar.url)
-                return Response({
-                    'avatar_url': avatar_url,
-                    'has_avatar': True
-                })
-            else:
-                # 返回默认头像
-                default_avatar_url = self.get_full_url(request, '/media/avatars/default.jpg')
-                return Response({
-                    'avatar_url': default_avatar_url,
-                    'has_avatar': False
-                })
+
+            etag = make_etag(request, user.pk, user.avatar.name)
+            response = not_modified(request, etag, private=not user_id)
+            if response is not None:
+                return response
+
+            response = Response({
+                'avatar_url': media.avatar_url(user.avatar.name, request),
+                'has_avatar': bool(user.avatar),
+            })
+            return set_validators(response, etag, private=not user_id)
                 
         except CustomUser.DoesNotExist:
             return Response({'error': '用户不存在'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            return Response({'error': f'获取头像失败: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR) 
\ No newline at end of file
+            return Response({'error': f'获取头像失败: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class AvatarBatchView(AsyncAPIView):
+    """批量获取头像地址：GET /api/users/avatars/?ids=1,2,3，一次查询"""
+    permission_classes = (AllowAny,)
+    MAX_IDS = 100
+
+    async def get(self, request):
+        try:
+            ids = sorted({int(value) for value in request.query_params.get('ids', '').split(',') if value})
+        except ValueError:
+            return Response({'error': 'ids 须为逗号分隔的用户ID'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            return Response({'error': '请提供 ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.MAX_IDS:
+            return Response({'error': f'一次最多查询{self.MAX_IDS}个用户'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = [row async for row in CustomUser.objects.filter(pk__in=ids).values_list('pk', 'avatar').order_by('pk')]
+        etag = make_etag(request, *(f'{pk}:{name}' for pk, name in rows))
+        response = not_modified(request, etag, private=False)
+        if response is not None:
+            return response
+        # 不存在的用户不出现在结果中
+        response = Response({
+            'avatars': {str(pk): media.avatar_url(name, request) for pk, name in rows},
+        })
+        return set_validators(response, etag, private=False)
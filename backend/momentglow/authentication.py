@@ -0,0 +1,193 @@
+"""
+支持异步调用、带用户缓存的认证类
+
+同步视图中的行为与 DRF / simplejwt 的原实现相同；额外提供 aauthenticate()，
+供 AsyncAPIView 在事件循环中认证。
+
+JWT 认证按令牌中的 user_id 从缓存取用户，未命中时才查询用户表；用户保存或
+删除时由 user 应用的信号清除缓存（见 invalidate_user）。开启 TRUST_TOKEN_CLAIMS
+后，直接由令牌中的声明构造用户，不访问数据库；用户保存后缓存中记录其最新的声明
+与启用状态（见 claims_key），令牌有效期内以记录为准，停用、取消管理员或更换头像
+立即生效。
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication
+from rest_framework_simplejwt import authentication as jwt_authentication
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,
+    # 信任访问令牌中的用户声明，常见请求完全不查询用户表
+    'TRUST_TOKEN_CLAIMS': False,
+}
+# 签发令牌时写入、信任模式下用来构造用户的字段；视图读取的用户字段都应在其中，
+# 否则会触发延迟查询，在异步视图中无法执行
+TOKEN_CLAIMS = ('username', 'is_staff', 'avatar')
+KEY_PREFIX = 'jwt_user'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+def user_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def claims_key(user_id):
+    return f'{KEY_PREFIX}:claims:{user_id}'
+
+
+def token_claims(user):
+    """用户当前的声明值，均为可写入令牌的简单类型"""
+    claims = {}
+    for name in TOKEN_CLAIMS:
+        field = user._meta.get_field(name)
+        claims[name] = field.get_prep_value(field.value_from_object(user))
+    return claims
+
+
+def invalidate_user(user_id, claims=None, active=True):
+    """清除缓存的用户，并记录最新的声明与启用状态
+
+    记录保留一个访问令牌有效期，信任模式下以它代替令牌中可能过时的声明；
+    用户删除时只记录停用。
+    """
+    cache = get_cache()
+    cache.delete(user_key(user_id))
+    cache.set(
+        claims_key(user_id), {'claims': claims, 'is_active': active},
+        int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+    )
+
+
+class RefreshToken(tokens.RefreshToken):
+    """在令牌中写入 TOKEN_CLAIMS，由它派生的访问令牌会复制这些声明"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.payload.update(token_claims(user))
+        return token
+
+
+class JWTAuthentication(jwt_authentication.JWTAuthentication):
+    def get_user(self, validated_token):
+        user = self.get_token_user(validated_token)
+        if user is not None:
+            return user
+        user_id = self.get_user_id(validated_token)
+        user = get_cache().get(user_key(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            get_cache().set(user_key(user_id), user, get_config()['TIMEOUT'])
+        else:
+            self.check_user(user, validated_token)
+        return user
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def get_token_claims(self, validated_token):
+        """信任模式下返回令牌中的 (user_id, 声明)，未写入声明的旧令牌返回 None
+
+        由声明构造的用户其余字段为延迟加载，save() 只会写回已加载的字段。修改密码
+        不会使信任模式下的令牌失效，因此开启 CHECK_REVOKE_TOKEN 时不使用信任模式。
+        """
+        if not get_config()['TRUST_TOKEN_CLAIMS'] or api_settings.CHECK_REVOKE_TOKEN:
+            return None
+        if not all(claim in validated_token for claim in TOKEN_CLAIMS):
+            return None
+        return self.get_user_id(validated_token), {claim: validated_token[claim] for claim in TOKEN_CLAIMS}
+
+    def get_token_user(self, validated_token):
+        """信任模式下由令牌声明构造用户，否则返回 None"""
+        found = self.get_token_claims(validated_token)
+        if found is None:
+            return None
+        user_id, claims = found
+        return self.build_token_user(user_id, claims, get_cache().get(claims_key(user_id)))
+
+    async def aget_token_user(self, validated_token):
+        found = self.get_token_claims(validated_token)
+        if found is None:
+            return None
+        user_id, claims = found
+        return self.build_token_user(user_id, claims, await get_cache().aget(claims_key(user_id)))
+
+    def build_token_user(self, user_id, claims, state):
+        """由声明构造用户；state 为用户保存后记录的最新状态，优先于令牌中的声明"""
+        if state is not None:
+            if not state['is_active']:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            claims = state['claims']
+        claims = {api_settings.USER_ID_FIELD: user_id, 'is_active': True, **claims}
+        fields = [f for f in self.user_model._meta.concrete_fields if f.attname in claims]
+        return self.user_model.from_db(
+            None, [f.attname for f in fields], [claims[f.attname] for f in fields]
+        )
+
+    def check_user(self, user, validated_token):
+        """对缓存的用户重复 get_user() 中的状态检查"""
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        # 签名与过期时间的校验不涉及 IO，直接在事件循环中完成
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        """get_user() 的异步版本，缓存通过异步接口读写"""
+        user = await self.aget_token_user(validated_token)
+        if user is not None:
+            return user
+        user_id = self.get_user_id(validated_token)
+        user = await get_cache().aget(user_key(user_id))
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            self.check_user(user, validated_token)
+            await get_cache().aset(user_key(user_id), user, get_config()['TIMEOUT'])
+        else:
+            self.check_user(user, validated_token)
+        return user
+
+
+class SessionAuthentication(authentication.SessionAuthentication):
+    async def aauthenticate(self, request):
+        auser = getattr(request._request, 'auser', None)
+        if auser is None:
+            return None
+        user = await auser()
+        if not user or not user.is_active:
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
@@ -0,0 +1,57 @@
+"""
+条件 GET（ETag / Last-Modified）
+
+视图先用轻量查询得到表示内容的版本信息，生成强 ETag，再决定是否需要
+序列化。验证器仍然有效时直接返回 304：HttpResponseNotModified 没有
+data 属性，CustomAPIView.finalize_response 不会再为它包裹统一响应格式。
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def make_etag(request, *parts):
+    """由版本信息生成强 ETag
+
+    响应中的链接是绝对地址，且不同渲染器的输出不同，
+    因此请求的完整地址与协商出的媒体类型也计入 ETag。
+    """
+    raw = '\x1f'.join(str(part) for part in (
+        request.build_absolute_uri(), getattr(request, 'accepted_media_type', ''), *parts
+    ))
+    return '"%s"' % hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def has_validators(request):
+    """请求是否携带了缓存验证器，没有时无需单独查询版本信息"""
+    return request.method in SAFE_METHODS and (
+        'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+    )
+
+
+def not_modified(request, etag, last_modified=None, private=True):
+    """验证器仍然有效时返回 304 响应，否则返回 None"""
+    if request.method not in SAFE_METHODS:
+        return None
+    response = get_conditional_response(
+        request, etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified, private)
+    return response
+
+
+def set_validators(response, etag, last_modified=None, private=True):
+    """为响应设置 ETag、Last-Modified，并要求客户端每次使用缓存前重新验证"""
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
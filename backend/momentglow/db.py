@@ -0,0 +1,173 @@
+"""
+数据库连接调优与读写分离
+
+连接参数（CONN_MAX_AGE、CONN_HEALTH_CHECKS、只读副本）在 settings.DATABASES 中配置。
+SQLite 在建立连接时设置 SQLITE_PRAGMAS：WAL 模式下读写互不阻塞，synchronous=NORMAL
+在 WAL 下提交仍然安全，mmap_size 与 cache_size 减少读取时的系统调用与重复解析。
+
+ReplicaRouter 把 READ_ACTIONS 中的视图集动作（GET/HEAD）的查询发往 REPLICAS 中的一个
+只读副本，同一请求内固定使用同一个副本；其余查询仍走 default。请求中一旦发生写入，
+后续读取回到主库，并在 STICKY_SECONDS 秒内让该用户的请求只读主库，避免复制延迟
+导致读不到自己刚写入的数据。多进程部署时 CACHE_ALIAS 需指向共享缓存。
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULTS = {
+    'REPLICAS': (),
+    'READ_ACTIONS': ('list', 'retrieve', 'public'),
+    'STICKY_SECONDS': 5,
+    'CACHE_ALIAS': 'default',
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        # 负数表示 KiB
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+    },
+}
+STICKY_KEY_PREFIX = 'db:primary'
+SAFE_METHODS = ('GET', 'HEAD')
+
+current_state = ContextVar('db_routing', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_TUNING', {})}
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # 事务中不能修改 journal_mode 与 synchronous
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        return
+    # 直接在底层连接上执行，不经过 execute_wrapper，也不计入请求的查询数
+    for name, value in get_config()['SQLITE_PRAGMAS'].items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+class RoutingState:
+    """单个请求的路由状态"""
+    __slots__ = ('replica', 'wrote', 'user_id')
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+        self.user_id = None
+
+
+def sticky_key(user_id):
+    return f'{STICKY_KEY_PREFIX}:{user_id}'
+
+
+def read_state(request, action):
+    """记下请求的用户；只读动作且配置了副本时返回路由状态，否则返回 None"""
+    state = current_state.get()
+    if state is None:
+        return None
+    config = get_config()
+    if not config['REPLICAS']:
+        return None
+    if request.user.is_authenticated:
+        state.user_id = request.user.pk
+    if request.method not in SAFE_METHODS or action not in config['READ_ACTIONS']:
+        return None
+    return state
+
+
+def route_reads(request, action):
+    """视图完成认证后调用：只读动作且该用户近期没有写入时，为本请求选定一个副本"""
+    state = read_state(request, action)
+    if state is None:
+        return
+    config = get_config()
+    if state.user_id is not None and caches[config['CACHE_ALIAS']].get(sticky_key(state.user_id)):
+        return
+    state.replica = random.choice(config['REPLICAS'])
+
+
+async def aroute_reads(request, action):
+    """route_reads() 的异步版本"""
+    state = read_state(request, action)
+    if state is None:
+        return
+    config = get_config()
+    if state.user_id is not None and await caches[config['CACHE_ALIAS']].aget(sticky_key(state.user_id)):
+        return
+    state.replica = random.choice(config['REPLICAS'])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = current_state.get()
+        if state is None or state.wrote:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本与主库数据相同，从副本读出的对象可以与主库对象关联
+        databases = {DEFAULT_DB_ALIAS, *get_config()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in get_config()['REPLICAS']:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """为每个请求建立路由状态，请求中有写入时记录该用户需读主库"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # 中间件加载前已建立的连接不会再触发 connection_created；尚未打开的连接在打开时设置
+        for connection in connections.all(initialized_only=True):
+            if connection.connection is not None:
+                apply_sqlite_pragmas(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = current_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_state.reset(token)
+        if state.wrote and state.user_id is not None:
+            config = get_config()
+            caches[config['CACHE_ALIAS']].set(sticky_key(state.user_id), 1, config['STICKY_SECONDS'])
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = current_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_state.reset(token)
+        if state.wrote and state.user_id is not None:
+            config = get_config()
+            await caches[config['CACHE_ALIAS']].aset(sticky_key(state.user_id), 1, config['STICKY_SECONDS'])
+        return response
@@ -0,0 +1,273 @@
+"""
+媒体文件地址与访问
+
+BASE_URL 为 CDN 或站点的源地址（如 ``https://cdn.example.com``），设置后媒体地址
+直接由它拼接，不再依赖请求；未设置时使用当前请求的 host，每个请求只计算一次。
+文件名按内容哈希命名、同名即同一文件，存储返回的相对地址可以长期缓存在进程内。
+
+serve() 负责 MEDIA_URL 下的请求。<img> 无法携带 JWT，非公开日记的图片地址带有
+签名与过期时间；不带签名的请求只放行被头像或公开日记引用的文件，判断结果缓存
+ACCESS_CACHE_TIMEOUT 秒，日记改为私密后最多延迟这么久生效。校验通过后按 ACCEL
+交给前置代理发送（nginx 的 X-Accel-Redirect 或 Apache/lighttpd 的 X-Sendfile），
+未配置时由 FileResponse 发送并支持单个字节区间。只有常见的位图格式直接显示，
+其他文件以附件下载并禁止浏览器猜测类型。blob 内容不可变，以哈希作为 ETag，
+公开的 blob 允许长期缓存。
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import time
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+from django.dispatch import receiver
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+DEFAULTS = {
+    'BASE_URL': '',
+    # 未上传头像的用户使用的默认头像，相对于 MEDIA_URL
+    'DEFAULT_AVATAR': 'default.jpg',
+    # '' 由 Django 发送文件，'nginx' 使用 X-Accel-Redirect，'sendfile' 使用 X-Sendfile
+    'ACCEL': '',
+    # nginx 中指向 MEDIA_ROOT 的 internal location
+    'ACCEL_PREFIX': '/protected-media/',
+    # 签名地址的有效期（秒），过期时间按该长度对齐
+    'SIGNATURE_TTL': 24 * 3600,
+    'ACCESS_CACHE_ALIAS': 'default',
+    'ACCESS_CACHE_TIMEOUT': 60,
+    # 公开 blob 的缓存时长，其他文件（如默认头像）可能被替换，缓存时间较短
+    'MAX_AGE': 365 * 24 * 3600,
+    'MUTABLE_MAX_AGE': 3600,
+}
+SIGNATURE_SALT = 'momentglow.media'
+# 可以在页面中直接显示的图片类型；SVG 可以执行脚本，不在其中
+INLINE_TYPES = frozenset(('image/jpeg', 'image/png', 'image/gif', 'image/webp'))
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_DELIVERY', {})}
+
+
+@lru_cache(maxsize=4096)
+def storage_url(name):
+    """存储中的相对地址"""
+    return default_storage.url(name)
+
+
+@receiver(setting_changed)
+def clear_url_cache(setting, **kwargs):
+    if setting in ('MEDIA_URL', 'STORAGES', 'MEDIA_DELIVERY'):
+        storage_url.cache_clear()
+
+
+def origin(request=None):
+    """媒体地址的前缀；没有请求且未配置 BASE_URL 时为空，返回相对地址"""
+    if request is not None:
+        cached = getattr(request, '_media_origin', None)
+        if cached is not None:
+            return cached
+    base = get_config()['BASE_URL'].rstrip('/')
+    if not base and request is not None:
+        base = request.build_absolute_uri('/').rstrip('/')
+    if request is not None:
+        request._media_origin = base
+    return base
+
+
+def media_url(name, request=None, private=False):
+    """private 为 True 时附带签名，供无法公开访问的文件使用"""
+    url = origin(request) + storage_url(name)
+    if private:
+        url += signed_query(name)
+    return url
+
+
+def avatar_url(name, request=None):
+    """用户头像地址，name 为空时返回默认头像"""
+    return media_url(name or get_config()['DEFAULT_AVATAR'], request)
+
+
+def sign(name, expires):
+    return salted_hmac(SIGNATURE_SALT, f'{name}:{expires}', algorithm='sha256').hexdigest()[:32]
+
+
+def signed_query(name):
+    ttl = get_config()['SIGNATURE_TTL']
+    # 过期时间按窗口对齐，同一窗口内地址不变，浏览器缓存仍然有效；剩余有效期不少于 ttl
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return f'?expires={expires}&signature={sign(name, expires)}'
+
+
+def signature_expires(name, params):
+    """签名有效时返回过期时间戳，否则返回 None"""
+    try:
+        expires = int(params.get('expires', ''))
+    except ValueError:
+        return None
+    if expires <= time.time():
+        return None
+    if not constant_time_compare(params.get('signature', ''), sign(name, expires)):
+        return None
+    return expires
+
+
+def is_public(name):
+    """文件是否被头像或公开日记的图片（原图或缩略图）引用"""
+    config = get_config()
+    if name == config['DEFAULT_AVATAR']:
+        return True
+    cache = caches[config['ACCESS_CACHE_ALIAS']]
+    key = 'media:public:' + hashlib.sha1(name.encode('utf-8')).hexdigest()
+    public = cache.get(key)
+    if public is None:
+        public = lookup_public(name)
+        cache.set(key, public, config['ACCESS_CACHE_TIMEOUT'])
+    return public
+
+
+def lookup_public(name):
+    from momentglow.apps.diary.models import DiaryImage
+    from momentglow.apps.user.models import CustomUser
+
+    if CustomUser.objects.filter(avatar=name).exists():
+        return True
+    images = DiaryImage.objects.filter(diary__is_public=True)
+    if connections[images.db].features.supports_json_field_contains:
+        variant = Q(variants__contains=[{'name': name}])
+    else:
+        # SQLite 等不支持 JSON 包含查询，按序列化后的文本匹配带引号的文件名
+        images = images.alias(variants_text=Cast('variants', TextField()))
+        variant = Q(variants_text__contains=json.dumps(name))
+    return images.filter(Q(image=name) | variant).exists()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """解析 Range 请求头，返回 (start, end)；多个区间或格式不对时返回 None，按完整文件响应"""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    elif last:
+        # 后缀区间：最后 N 个字节
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def read_range(path, start, length, chunk_size=FileResponse.block_size):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def file_response(request, path, size, etag, content_type):
+    header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range 与当前版本不一致时返回完整文件
+    if header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(header, size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_range(path, start, end - start + 1), status=206, content_type=content_type
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            return response
+    # 完整文件交给 FileResponse，WSGI 服务器支持时以 sendfile 发送
+    return FileResponse(open(path, 'rb'), content_type=content_type)
+
+
+def serve(request, path):
+    """MEDIA_URL 下的文件：校验访问权限后交给前置代理或直接发送"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    storage = default_storage
+    try:
+        full_path = storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404
+    config = get_config()
+    expires = signature_expires(path, request.GET)
+    if expires is None and not is_public(path):
+        # 与文件不存在时相同，不暴露私密文件的存在
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    is_blob = getattr(storage, 'is_blob', None)
+    immutable = is_blob is not None and is_blob(path)
+    if immutable:
+        # blob 的文件名即内容的 SHA-256
+        etag = '"%s"' % os.path.splitext(os.path.basename(path))[0]
+    else:
+        etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type not in INLINE_TYPES:
+            # 其他文件只作为附件下载，避免在本站域名下被当作页面渲染
+            content_type = 'application/octet-stream'
+        if config['ACCEL'] == 'nginx':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = quote(config['ACCEL_PREFIX'].rstrip('/') + '/' + path)
+        elif config['ACCEL'] == 'sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = file_response(request, full_path, stat.st_size, etag, content_type)
+            response['Accept-Ranges'] = 'bytes'
+        if content_type not in INLINE_TYPES:
+            response['Content-Disposition'] = 'attachment'
+
+    response['ETag'] = etag
+    response['X-Content-Type-Options'] = 'nosniff'
+    if expires is not None:
+        patch_cache_control(response, private=True, max_age=max(int(expires - time.time()), 0))
+    elif immutable:
+        patch_cache_control(response, public=True, max_age=config['MAX_AGE'], immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=config['MUTABLE_MAX_AGE'])
+    return response
@@ -0,0 +1,320 @@
+"""
+请求级性能指标
+
+RequestMetricsMiddleware 按解析到的视图与动作（如 DiaryViewSet.public）记录请求耗时
+直方图、数据库查询次数与耗时、序列化耗时、渲染耗时和响应大小，/internal/metrics
+以 Prometheus 文本格式输出。序列化耗时是视图经 serializer_data() 取 serializer.data
+的时间（其中的数据库查询同时计入查询耗时），渲染耗时是渲染器编码响应体的时间。每个请求只做几次计时和一次加锁的累加；查询由常驻的 execute_wrapper
+计数，当前请求的统计对象放在 contextvar 中，异步视图经 sync_to_async 执行的查询
+同样计入。指标保存在进程内存中，多进程部署时每个进程各自计数。
+
+PROFILE_SAMPLE_RATE 大于 0 时按该比例对同步请求启用 cProfile（同一进程同时只剖析
+一个请求），耗时不低于 PROFILE_THRESHOLD 秒的请求写入 PROFILE_DIR，可用 pstats
+或 snakeviz 查看，只保留最近 PROFILE_KEEP 个文件。
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+
+DEFAULTS = {
+    # 直方图的桶上界（秒）
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_THRESHOLD': 1.0,
+    'PROFILE_DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    'PROFILE_KEEP': 50,
+    # 指标接口的访问控制：Bearer 令牌或管理员登录；来源地址白名单默认为空，
+    # 经本机反向代理转发时所有请求都来自回环地址，不能据此放行
+    'TOKEN': '',
+    'ALLOWED_IPS': (),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNRESOLVED = '<unresolved>'
+
+current_request = ContextVar('request_metrics', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class RequestStats:
+    """单个请求的累计值"""
+    __slots__ = ('view', 'queries', 'db_seconds', 'serialize_seconds', 'render_seconds')
+
+    def __init__(self):
+        self.view = UNRESOLVED
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+class ViewMetrics:
+    __slots__ = (
+        'buckets', 'count', 'seconds', 'queries', 'db_seconds', 'serialize_seconds', 'render_seconds',
+        'response_bytes', 'statuses',
+    )
+
+    def __init__(self, bucket_count):
+        # 各桶的非累计计数，最后一个为 +Inf
+        self.buckets = [0] * (bucket_count + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+
+class Registry:
+    def __init__(self, buckets):
+        self.bounds = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, stats, status, seconds, size):
+        with self.lock:
+            metrics = self.views.get(stats.view)
+            if metrics is None:
+                metrics = self.views[stats.view] = ViewMetrics(len(self.bounds))
+            metrics.buckets[bisect_left(self.bounds, seconds)] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.queries += stats.queries
+            metrics.db_seconds += stats.db_seconds
+            metrics.serialize_seconds += stats.serialize_seconds
+            metrics.render_seconds += stats.render_seconds
+            metrics.response_bytes += size
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self.lock:
+            views = {view: self.snapshot(metrics) for view, metrics in self.views.items()}
+        lines = [
+            '# HELP momentglow_request_duration_seconds Request latency by view.',
+            '# TYPE momentglow_request_duration_seconds histogram',
+        ]
+        for view, metrics in sorted(views.items()):
+            label = f'view="{escape(view)}"'
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), metrics.buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'momentglow_request_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'momentglow_request_duration_seconds_sum{{{label}}} {metrics.seconds!r}')
+            lines.append(f'momentglow_request_duration_seconds_count{{{label}}} {metrics.count}')
+
+        for name, attr, help_text in (
+            ('momentglow_request_db_queries_total', 'queries', 'Database queries by view.'),
+            ('momentglow_request_db_seconds_total', 'db_seconds', 'Time spent in database queries by view.'),
+            ('momentglow_request_serialize_seconds_total', 'serialize_seconds',
+             'Time spent evaluating serializer data by view.'),
+            ('momentglow_request_render_seconds_total', 'render_seconds', 'Time spent rendering response bodies by view.'),
+            ('momentglow_response_bytes_total', 'response_bytes', 'Response body bytes by view.'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for view, metrics in sorted(views.items()):
+                lines.append(f'{name}{{view="{escape(view)}"}} {getattr(metrics, attr)!r}')
+
+        lines += [
+            '# HELP momentglow_responses_total Responses by view and status code.',
+            '# TYPE momentglow_responses_total counter',
+        ]
+        for view, metrics in sorted(views.items()):
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'momentglow_responses_total{{view="{escape(view)}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def snapshot(metrics):
+        copy = ViewMetrics(0)
+        for field in ViewMetrics.__slots__:
+            value = getattr(metrics, field)
+            setattr(copy, field, value.copy() if isinstance(value, (list, dict)) else value)
+        return copy
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry(get_config()['BUCKETS'])
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    # 插在最前面，execute_wrapper() 上下文退出时 pop() 的仍是它自己添加的包装
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def serializer_data(serializer):
+    """返回 serializer.data，耗时计入当前请求的序列化时间"""
+    stats = current_request.get()
+    if stats is None:
+        return serializer.data
+    started = time.perf_counter()
+    try:
+        return serializer.data
+    finally:
+        stats.serialize_seconds += time.perf_counter() - started
+
+
+def add_render_time(seconds):
+    stats = current_request.get()
+    if stats is not None:
+        stats.render_seconds += seconds
+
+
+def view_label(view_func, method):
+    """DRF 视图集为 类名.动作，其他视图类为 类名.动作属性 或 类名.方法"""
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    name = getattr(cls, 'metrics_name', None) or cls.__name__
+    actions = getattr(view_func, 'actions', None)
+    action = actions.get(method.lower()) if actions else getattr(cls, 'action', None)
+    return f'{name}.{action or method.lower()}'
+
+
+def response_size(response):
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    return 0 if response.streaming else len(response.content)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # 同步的 process_view 在异步模式下会被放进线程池执行
+            self.process_view = self.aprocess_view
+        config = get_config()
+        self.profile_rate = config['PROFILE_SAMPLE_RATE']
+        self.profile_threshold = config['PROFILE_THRESHOLD']
+        self.profile_dir = config['PROFILE_DIR']
+        self.profile_keep = config['PROFILE_KEEP']
+        self.profile_lock = threading.Lock()
+        # 中间件加载前已建立的连接不会再触发 connection_created
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        profiler = self.start_profile()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                self.profile_lock.release()
+            current_request.reset(token)
+        registry.observe(stats, response.status_code, seconds, response_size(response))
+        if profiler is not None and seconds >= self.profile_threshold:
+            self.dump_profile(profiler, stats.view, seconds)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - started
+            current_request.reset(token)
+        registry.observe(stats, response.status_code, seconds, response_size(response))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_request.get()
+        if stats is not None:
+            stats.view = view_label(view_func, request.method)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.process_view(request, view_func, view_args, view_kwargs)
+
+    def start_profile(self):
+        """按比例抽样；协程在 await 期间会交错执行，异步请求不做剖析"""
+        if not self.profile_rate or random.random() >= self.profile_rate:
+            return None
+        if not self.profile_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def dump_profile(self, profiler, view, seconds):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = re.sub(r'[^\w.-]+', '_', view)
+        filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{int(seconds * 1000)}ms-{name}-{os.getpid()}.prof'
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        dumps = sorted(
+            (entry for entry in os.scandir(self.profile_dir) if entry.name.endswith('.prof')),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in dumps[:-self.profile_keep]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def client_allowed(request, config):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = config['TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        return True
+    return request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']
+
+
+def metrics_view(request):
+    """Prometheus 抓取接口；无权访问时返回 404，不暴露接口的存在"""
+    if not client_allowed(request, get_config()):
+        raise Http404
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
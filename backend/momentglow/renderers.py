@@ -0,0 +1,46 @@
+"""
+基于 orjson 的 JSON 渲染器
+
+输出与 DRF 的 JSONRenderer（UNICODE_JSON、COMPACT_JSON 默认开启时）一致：
+紧凑格式、不转义中文、UTC 时间以 Z 结尾。orjson 不支持的类型交给 DRF 的
+JSONEncoder 处理；请求缩进输出（如可浏览 API）或未安装 orjson 时退回
+DRF 的实现。编码耗时计入请求指标的渲染时间。
+"""
+import time
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import add_render_time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    _encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return self.encode(data, accepted_media_type, renderer_context)
+        finally:
+            add_render_time(time.perf_counter() - started)
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self._encoder.default, option=ORJSON_OPTIONS)
+        # 与 DRF 一致，转义 \u2028、\u2029，保证输出是合法的 JavaScript
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -54,6 +54,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，耗时包含其余中间件
+    'momentglow.metrics.RequestMetricsMiddleware',
+    'momentglow.db.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -96,9 +99,25 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', ''),
+        # 持久连接，复用前检查连接是否可用；ASGI 部署时可设为 0 改用数据库自身的连接池
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# 只读副本：DB_REPLICA_HOSTS 为逗号分隔的地址，其余连接参数与 default 相同
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+for index, host in enumerate(DB_REPLICA_HOSTS):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['momentglow.db.ReplicaRouter']
+
+# 读写分离与 SQLite 调优：只读动作使用 REPLICAS，写入后 STICKY_SECONDS 秒内该用户只读主库
+DATABASE_TUNING = {
+    'REPLICAS': tuple(alias for alias in DATABASES if alias != 'default'),
+    'STICKY_SECONDS': int(os.getenv('DB_STICKY_SECONDS', 5)),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -141,6 +160,89 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 媒体地址与发送：BASE_URL 为 CDN 或站点源地址，留空时使用请求的 host；
+# ACCEL 为 nginx（X-Accel-Redirect 到 ACCEL_PREFIX）或 sendfile（X-Sendfile）时文件由前置代理发送
+MEDIA_DELIVERY = {
+    'BASE_URL': os.getenv('MEDIA_BASE_URL', ''),
+    'ACCEL': os.getenv('MEDIA_ACCEL', ''),
+    'ACCEL_PREFIX': os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/'),
+}
+
+# 媒体文件按内容哈希去重存储，未被引用的文件由 collect_media_blobs 命令回收
+STORAGES = {
+    'default': {
+        'BACKEND': 'momentglow.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'momentglow'),
+    },
+    # JWT 认证使用的用户缓存，条目数有上限；多进程部署时可指向共享缓存，使用户变更立即在各进程生效
+    'users': {
+        'BACKEND': os.getenv('USER_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('USER_CACHE_LOCATION', 'momentglow-users'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+
+# JWT 认证的用户缓存：按令牌中的 user_id 缓存 TIMEOUT 秒，用户保存或删除时清除；
+# TRUST_TOKEN_CLAIMS 开启后直接由令牌声明构造用户，不查询用户表
+JWT_USER_CACHE = {
+    'CACHE_ALIAS': 'users',
+    'TIMEOUT': int(os.getenv('JWT_USER_CACHE_TIMEOUT', 60)),
+    'TRUST_TOKEN_CLAIMS': os.getenv('JWT_TRUST_TOKEN_CLAIMS', 'False') == 'True',
+}
+
+# 头像上传：请求体超过 MAX_SIZE 字节或文件头不是图片时停止读取，保存为 SIZE×SIZE 的正方形
+USER_AVATAR = {
+    'MAX_SIZE': int(os.getenv('USER_AVATAR_MAX_SIZE', 5 * 1024 * 1024)),
+    'SIZE': 256,
+}
+
+# 公开日记流缓存：缓存前 PAGES 页，TIMEOUT 秒后过期；写入日记、评论、图片时按需失效
+PUBLIC_FEED_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'PAGES': int(os.getenv('PUBLIC_FEED_CACHE_PAGES', 3)),
+    'TIMEOUT': int(os.getenv('PUBLIC_FEED_CACHE_TIMEOUT', 300)),
+}
+
+# 日记图片后台处理：上传后在进程内线程池中生成缩略图并去除 EXIF
+DIARY_IMAGE_PIPELINE = {
+    'WIDTHS': (320, 640, 1280),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': int(os.getenv('DIARY_IMAGE_WORKERS', 2)),
+}
+
+# 增量同步：每类记录每次最多返回的条数，删除记录的保留天数（由 prune_tombstones 清理）
+DIARY_SYNC = {
+    'LIMIT': 100,
+    'MAX_LIMIT': 500,
+    'TOMBSTONE_DAYS': int(os.getenv('DIARY_SYNC_TOMBSTONE_DAYS', 90)),
+}
+
+# 日记导入导出：每块读取、写入的日记数，导入时跳过超过该大小的图片
+DIARY_ARCHIVE = {
+    'CHUNK_SIZE': 500,
+    'MAX_IMAGE_SIZE': 20 * 1024 * 1024,
+}
+
+# 请求性能指标（/internal/metrics）：按比例对请求做 cProfile 剖析，慢于阈值（秒）的写入 PROFILE_DIR
+REQUEST_METRICS = {
+    'PROFILE_SAMPLE_RATE': float(os.getenv('METRICS_PROFILE_SAMPLE_RATE', 0)),
+    'PROFILE_THRESHOLD': float(os.getenv('METRICS_PROFILE_THRESHOLD', 1.0)),
+    'PROFILE_DIR': os.getenv('METRICS_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles')),
+    'TOKEN': os.getenv('METRICS_TOKEN', ''),
+    'ALLOWED_IPS': tuple(ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -150,10 +252,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'momentglow.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+        'momentglow.authentication.JWTAuthentication',
+        'momentglow.authentication.SessionAuthentication',
     ],
 }
 
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    按内容寻址、去重的本地文件存储
+
+    上传内容在逐块写入临时文件的同时计算 SHA-256，最终保存为
+    ``blobs/ab/cd/<sha256><扩展名>``；相同内容只保存一份，头像与日记图片共用。
+    一个 blob 可能被多处引用，delete() 不会删除 blob，未被引用的 blob 由
+    ``python manage.py collect_media_blobs`` 统计引用后回收。
+    """
+    blob_dir = 'blobs'
+    tmp_dir = 'blobs/tmp'
+
+    def get_available_name(self, name, max_length=None):
+        # 最终文件名由内容决定，同名即同内容，无需避让
+        return name
+
+    def blob_name(self, digest, ext):
+        return f'{self.blob_dir}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+    def is_blob(self, name):
+        return name.startswith(self.blob_dir + '/') and not name.startswith(self.tmp_dir + '/')
+
+    def _makedirs(self, directory):
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lower()
+        tmp_dir = self.path(self.tmp_dir)
+        self._makedirs(tmp_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            hasher = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+
+            name = self.blob_name(hasher.hexdigest(), ext)
+            full_path = self.path(name)
+            self._makedirs(os.path.dirname(full_path))
+            if os.path.exists(full_path):
+                # 已有相同内容；刷新修改时间，避免尚未提交的新引用被回收任务当作过期 blob
+                os.utime(full_path)
+                os.remove(tmp_path)
+            else:
+                # 并发写入同一内容时 replace 的结果相同，无需加锁
+                os.replace(tmp_path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def delete(self, name):
+        if name and self.is_blob(name):
+            return
+        super().delete(name)
+
+    def delete_blob(self, name):
+        """真正删除 blob 文件，只应由回收任务在确认无引用后调用"""
+        super().delete(name)
+
+    def iter_blobs(self):
+        """遍历全部 blob，产出 (name, 修改时间戳, 字节数)"""
+        root = self.path(self.blob_dir)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != self.path(self.tmp_dir)]
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                stat = os.stat(full_path)
+                name = os.path.relpath(full_path, self.location).replace(os.sep, '/')
+                yield name, stat.st_mtime, stat.st_size
+
+    def iter_tmp_files(self):
+        tmp_dir = self.path(self.tmp_dir)
+        if not os.path.isdir(tmp_dir):
+            return
+        for filename in os.listdir(tmp_dir):
+            full_path = os.path.join(tmp_dir, filename)
+            yield full_path, os.stat(full_path).st_mtime
@@ -1,11 +1,84 @@
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions
 from rest_framework.views import APIView
+from . import db
 from .response import CustomResponse
 
 class CustomAPIView(APIView):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # 认证之后才知道用户，据此决定只读动作能否使用只读副本
+        db.route_reads(request, getattr(self, 'action', None))
+
     def finalize_response(self, request, response, *args, **kwargs):
-        # 只包裹普通Response，避免二次包裹
-        if not isinstance(response, CustomResponse) and hasattr(response, 'data'):
+        # 只包裹普通Response，避免二次包裹；条件 GET 的 304 响应没有 data，原样返回
+        # 直接替换原响应的 data，不再另建响应对象，视图设置的响应头也随之保留
+        if not isinstance(response, CustomResponse) and hasattr(response, 'data') \
+                and not getattr(response, 'enveloped', False):
             code = 0 if response.status_code < 400 else response.status_code
             errMsg = "" if response.status_code < 400 else response.data.get('detail', 'error')
-            response = CustomResponse(data=response.data, code=code, errMsg=errMsg, status=response.status_code)
-        return super().finalize_response(request, response, *args, **kwargs) 
\ No newline at end of file
+            response.data = {"code": code, "errMsg": errMsg, "data": response.data}
+            response.enveloped = True
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class AsyncAPIView(CustomAPIView):
+    """
+    原生异步的只读视图
+
+    DRF 的视图只能同步执行，在 ASGI 下每个请求都要经过线程池适配。这里沿用
+    APIView 的请求包装、权限检查、异常处理和统一响应格式，只把需要查询数据库的
+    认证改为异步；子类以 async def 实现 get()，并使用 Django 的异步 ORM 取数。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        # 在事件循环中直接渲染，避免 Django 再把 render() 交给线程池
+        if hasattr(self.response, 'render'):
+            self.response.render()
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        """initial() 的异步版本：认证与读写分离的缓存查询都在事件循环中等待"""
+        await self.aperform_authentication(request)
+        APIView.initial(self, request, *args, **kwargs)
+        await db.aroute_reads(request, getattr(self, 'action', None))
+
+    async def aperform_authentication(self, request):
+        """Request._authenticate() 的异步版本，不支持异步的认证类在线程池中执行"""
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed(request.method)
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
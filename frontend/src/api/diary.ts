@@ -30,9 +30,54 @@ export interface DiaryInfo {
   is_public: boolean
   user: UserInfo
   tags: any[]
-  comments: any[]
   user_username: string
   images: any[]
+  comment_count: number
+  image_count: number
+}
+
+// 评论按楼层顺序排列，depth 为回复层级，根评论的 parent 为 null
+export interface CommentInfo {
+  id: number
+  content: string
+  created_at: string
+  user_username: string
+  parent: number | null
+  depth: number
+}
+
+export interface GetCommentsResponse {
+  code: number
+  errMsg: string
+  data: {
+    next: string | null
+    results: CommentInfo[]
+  }
+}
+
+// 列表类接口返回的日记摘要，完整内容需通过 getDiary 获取
+export interface DiarySummary {
+  id: number
+  title: string
+  excerpt: string
+  mood: string
+  weather: string
+  location: string
+  created_at: string
+  updated_at: string
+  is_public: boolean
+  user: UserInfo
+  tags: any[]
+  user_username: string
+  comment_count: number
+  image_count: number
+  cover_image: string | null
+}
+
+export interface GetDiaryResponse {
+  code: number
+  errMsg: string
+  data: DiaryInfo
 }
 
 export interface GetDiariesRequestParams {
@@ -40,6 +85,17 @@ export interface GetDiariesRequestParams {
   page?: number
   mood?: string
   timeRange?: string
+  // 传入 cursor（首页传空字符串）即启用游标分页，之后直接请求 next 链接
+  cursor?: string
+}
+
+export interface GetCursorDiariesResponse {
+  code: number
+  errMsg: string
+  data: {
+    next: string | null
+    results: DiarySummary[]
+  }
 }
 
 export interface GetPublicDiariesResponse {
@@ -61,16 +117,75 @@ export interface GetDiariesResponse {
   data: DiaryInfo[]
 }
 
+export interface SyncDiariesParams {
+  // 上次同步返回的游标；首次同步两者都不传
+  cursor?: string
+  updated_since?: string
+  limit?: number
+}
+
+export interface SyncDiariesResponse {
+  code: number
+  errMsg: string
+  data: {
+    // 不含 comments、images，二者单独下发，可能先于所属日记到达
+    diaries: Omit<DiaryInfo, 'comments' | 'images'>[]
+    comments: any[]
+    images: any[]
+    deleted: {
+      diaries: number[]
+      comments: number[]
+      images: number[]
+    }
+    cursor: string
+    // 为 true 时立即带上新游标继续请求
+    has_more: boolean
+    // 为 true 时需先清空本地数据，本次响应是全量同步的开始
+    reset: boolean
+  }
+}
+
 // 获取私人日记列表
 export const getDiaries= (params: GetDiariesRequestParams) => {
   return request.get<GetPublicDiariesResponse>('/api/diaries/', { params })
 }
 
+// 增量同步：只取游标之后变化的日记、评论、图片与删除记录
+export const syncDiaries = (params: SyncDiariesParams) => {
+  return request.get<SyncDiariesResponse>('/api/diaries/sync/', { params })
+}
+
+// 导出全部日记与图片（zip）
+export const exportDiaries = () => {
+  return request.get<Blob>('/api/diaries/export/', { responseType: 'blob' })
+}
+
+// 导入导出的 zip 或 NDJSON 文件
+export const importDiaries = (file: File) => {
+  const formData = new FormData()
+  formData.append('file', file)
+  return request.post('/api/diaries/import/', formData, {
+    headers: { 'Content-Type': 'multipart/form-data' }
+  })
+}
+
+// 获取日记详情
+export const getDiary = (diaryId: number) => {
+  return request.get<GetDiaryResponse>(`/api/diaries/${diaryId}/`)
+}
+
 // 获取公开日记列表
 export const getPublicDiaries= (params: GetDiariesRequestParams) => {
   return request.get<GetPublicDiariesResponse>('/api/diaries/public/', { params })
 }
 
+// 游标分页获取公开日记，用于无限滚动
+export const getPublicDiariesByCursor = (params: GetDiariesRequestParams) => {
+  return request.get<GetCursorDiariesResponse>('/api/diaries/public/', {
+    params: { ...params, cursor: params.cursor ?? '' }
+  })
+}
+
 // 点赞日记
 export const likeDiary = (diaryId: number) => {
   return request.post(`/api/diaries/${diaryId}/like/`)
@@ -81,15 +196,24 @@ export const unlikeDiary = (diaryId: number) => {
   return request.delete(`/api/diaries/${diaryId}/like/`)
 }
 
-// 获取日记评论
-export const getDiaryComments = (diaryId: number) => {
-  return request.get(`/api/diaries/${diaryId}/comments/`)
+// 获取日记评论，cursor 为上一页返回的 next 中的游标
+export const getDiaryComments = (diaryId: number, cursor?: string) => {
+  return request.get<GetCommentsResponse>('/api/diaries/comments/', {
+    params: { diary: diaryId, ...(cursor ? { cursor } : {}) }
+  })
 }
 
-// 发表评论
-export const addComment = (diaryId: number, content: string) => {
-  return request.post(`/api/diaries/${diaryId}/add_comment/`, { content })
-} 
+// 获取一条评论及其全部回复
+export const getCommentThread = (commentId: number, cursor?: string) => {
+  return request.get<GetCommentsResponse>(`/api/diaries/comments/${commentId}/thread/`, {
+    params: cursor ? { cursor } : {}
+  })
+}
+
+// 发表评论，parent 为被回复的评论
+export const addComment = (diaryId: number, content: string, parent?: number) => {
+  return request.post('/api/diaries/comments/', { diary: diaryId, content, parent })
+}
 
 // 发布日记
 export const publishDiary = (diary: DiaryInput) => {